@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for ddr-local
+
+Each module is a standalone benchmark.  Run from the ddrlocal/ directory:
+
+    $ python -m benchmarks.search_aggs --help
+
+Results are printed as JSON so runs can be saved and compared.
+benchmarks.suite times the main paths together on a synthetic Store
+(benchmarks.synthetic):
+
+    $ python -m benchmarks.suite -c 3 -e 500 -o results.json
+"""
+
+from datetime import datetime
+import json
+import os
+import statistics
+import sys
+import time
+
+
+def setup_django(settings_module='ddrlocal.settings'):
+    """Configure Django so benchmarks can import webui modules
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+def timeit(func, iterations=10, warmup=1):
+    """Call func repeatedly, return list of elapsed times (seconds)
+    
+    @param func: callable Takes no arguments
+    @param iterations: int Number of timed calls
+    @param warmup: int Number of untimed calls made first
+    @returns: list of float
+    """
+    for n in range(warmup):
+        func()
+    times = []
+    for n in range(iterations):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+def stats(times, count=None):
+    """Summarize list of elapsed times
+    
+    >>> stats([1.0, 2.0, 3.0])
+    {'iterations': 3, 'min': 1.0, 'max': 3.0, 'mean': 2.0, 'median': 2.0}
+    
+    @param times: list of float
+    @param count: int (optional) Items processed per iteration; adds per_sec
+    @returns: dict
+    """
+    data = {
+        'iterations': len(times),
+        'min': min(times),
+        'max': max(times),
+        'mean': statistics.mean(times),
+        'median': statistics.median(times),
+    }
+    if count:
+        data['count'] = count
+        data['per_sec'] = count / data['median'] if data['median'] else None
+    return data
+
+def report(name, results, path=None):
+    """Print (and optionally write) benchmark results as JSON
+    
+    @param name: str Benchmark name
+    @param results: dict
+    @param path: str (optional) Write JSON to this file as well
+    @returns: dict
+    """
+    data = {
+        'benchmark': name,
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'results': results,
+    }
+    text = json.dumps(data, indent=4)
+    print(text)
+    if path:
+        with open(path, 'w') as f:
+            f.write(text)
+    return data
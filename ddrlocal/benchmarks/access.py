@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+description = """Times access file generation (webui.access) per source format."""
+
+epilog = """
+Writes synthetic TIFF, JPEG, and PDF masters with ImageMagick to a
+temporary directory and makes access files for them three ways:
+- serial:    one convert at a time (what adding files does now)
+- parallel:  --workers converts at a time
+- cached:    same jobs again; access files are copied from the sha1 cache
+Reports files/sec per format for each.
+
+    $ python -m benchmarks.access -n 20 -w 4
+    $ python -m benchmarks.access -n 50 --size 6000x4000 --formats tif pdf
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+
+from benchmarks import report, setup_django, stats, timeit
+
+FORMATS = ['tif', 'jpg', 'pdf']
+
+
+def make_masters(base_dir, fmt, count, size):
+    """Write one noise image and copy it count times with different bytes
+    
+    Copies differ in their trailing bytes so each has its own sha1 and
+    nothing is served from the access cache.
+    
+    @returns: list of paths
+    """
+    first = os.path.join(base_dir, 'master-0.%s' % fmt)
+    subprocess.check_call([
+        'convert', '-size', size, 'xc:gray', '+noise', 'Random', first
+    ])
+    paths = [first]
+    for n in range(1, count):
+        path = os.path.join(base_dir, 'master-%s.%s' % (n, fmt))
+        shutil.copyfile(first, path)
+        with open(path, 'ab') as f:
+            f.write(('%s' % n).encode('utf-8'))
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=description, epilog=epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('-n', '--count', type=int, default=20, help='Files per format.')
+    parser.add_argument('-s', '--size', default='4000x3000', help='Master image size.')
+    parser.add_argument('-f', '--formats', nargs='+', default=FORMATS, help='Source formats.')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='Parallel converts.')
+    parser.add_argument('-o', '--output', help='Write JSON results to this file.')
+    args = parser.parse_args()
+    
+    setup_django()
+    from webui import access
+    
+    tmp = tempfile.mkdtemp(prefix='ddrlocal-benchmark-')
+    try:
+        results = {'count': args.count, 'size': args.size, 'workers': args.workers}
+        for fmt in args.formats:
+            fmt_dir = os.path.join(tmp, fmt)
+            os.makedirs(fmt_dir)
+            masters = make_masters(fmt_dir, fmt, args.count, args.size)
+            jobs = [access.job(path) for path in masters]
+            label = access.file_format(masters[0])
+            results[label] = {}
+            for name,workers,fresh in [
+                    ('serial', 1, True),
+                    ('parallel', args.workers, True),
+                    ('cached', args.workers, False),
+            ]:
+                def run():
+                    if fresh:
+                        shutil.rmtree(os.path.join(tmp, 'tmp'), ignore_errors=True)
+                    out,summary = access.generate(jobs, workers=workers, base_dir=tmp)
+                    assert not [r for r in out if r['status'] == 'error']
+                data = stats(timeit(run, iterations=1, warmup=0), len(jobs))
+                results[label][name] = data
+    finally:
+        shutil.rmtree(tmp)
+    
+    report('access', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+description = """Times md5+sha1+sha256 of large files: one pass per digest vs single pass (webui.checksums)."""
+
+epilog = """
+Writes synthetic files of the given sizes and computes md5, sha1, and sha256
+of each three ways:
+- before:    DDR.util.file_hash once per algorithm (three reads)
+- buffered:  webui.checksums.file_checksums (one read, large buffers)
+- mmap:      webui.checksums.file_checksums(use_mmap=True)
+
+Files are written to --dir (default: system temp dir), which should be on
+the device you care about (e.g. a USB Store).  Files larger than RAM are
+read from disk; for smaller files drop the page cache between runs
+(echo 3 > /proc/sys/vm/drop_caches, needs root, see --drop-caches)
+or the numbers mostly measure CPU.
+
+    $ python -m benchmarks.checksums --sizes 1 4 16 --dir /media/qnfs/tmp
+    $ python -m benchmarks.checksums --sizes 64 256 --unit MB -i 3
+"""
+
+import argparse
+import os
+import subprocess
+import tempfile
+
+from benchmarks import report, setup_django, stats, timeit
+
+UNITS = {'MB': 1024**2, 'GB': 1024**3}
+WRITE_CHUNK = 64 * 1024 * 1024
+
+
+def make_file(path, size):
+    """Write size bytes of random-ish data without holding it all in memory
+    """
+    block = os.urandom(WRITE_CHUNK)
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:min(remaining, WRITE_CHUNK)])
+            remaining -= WRITE_CHUNK
+    return path
+
+def drop_caches():
+    subprocess.call(['sync'])
+    with open('/proc/sys/vm/drop_caches', 'w') as f:
+        f.write('3\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=description, epilog=epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[1, 4, 16], help='File sizes.')
+    parser.add_argument('-u', '--unit', choices=UNITS.keys(), default='GB', help='Unit for --sizes.')
+    parser.add_argument('-d', '--dir', default=tempfile.gettempdir(), help='Directory for synthetic files.')
+    parser.add_argument('-i', '--iterations', type=int, default=1, help='Number of timed runs.')
+    parser.add_argument('--drop-caches', action='store_true', help='Drop page cache before each run (root).')
+    parser.add_argument('-o', '--output', help='Write JSON results to this file.')
+    args = parser.parse_args()
+    
+    setup_django()
+    from DDR import util
+    from webui import checksums
+    
+    def run(func):
+        def wrapped():
+            if args.drop_caches:
+                drop_caches()
+            return func()
+        return wrapped
+    
+    results = {}
+    for size in args.sizes:
+        path = os.path.join(args.dir, 'ddrlocal-benchmark-%s%s.bin' % (size, args.unit))
+        nbytes = size * UNITS[args.unit]
+        make_file(path, nbytes)
+        try:
+            def before():
+                return {
+                    algorithm: util.file_hash(path, algorithm)
+                    for algorithm in checksums.CHECKSUM_ALGORITHMS
+                }
+            
+            def buffered():
+                return checksums.file_checksums(path)
+            
+            def mapped():
+                return checksums.file_checksums(path, use_mmap=True)
+            
+            # same answers or the timings mean nothing
+            expected = before()
+            for func in [buffered, mapped]:
+                got = func()
+                assert all(got[a] == expected[a] for a in expected.keys())
+            
+            label = '%s %s' % (size, args.unit)
+            results[label] = {}
+            for name,func in [('before', before), ('buffered', buffered), ('mmap', mapped)]:
+                data = stats(timeit(run(func), args.iterations, warmup=0))
+                data['MB_per_sec'] = nbytes / UNITS['MB'] / data['median']
+                results[label][name] = data
+        finally:
+            os.remove(path)
+    
+    report('checksums', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+description = """Times entity/file CSV export in migration.densho on a synthetic collection."""
+
+epilog = """
+Writes a synthetic collection (default 2000 entities with 4 files each)
+to a temporary directory and exports its entities and files three ways:
+- before:    load each object, make a DDR Module per field per row to
+             find its csvexport_* function (the old export loop)
+- compiled:  function table resolved once per model, one process
+- parallel:  compiled, objects decoded in a pool of --workers processes
+Reports rows/sec for each.
+
+    $ python -m benchmarks.export -e 2000 -f 4 -w 4
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+
+from benchmarks import report, setup_django, stats, timeit
+
+GIT_VERSION = [{'application': 'benchmark', 'git_version': 'git version 2.20.1'}]
+ROLES = ['master', 'mezzanine']
+TEXT_FIELDS = ['title', 'description', 'notes', 'label', 'basename_orig']
+
+
+def write_object(path, data):
+    with open(path, 'w') as f:
+        f.write(json.dumps(GIT_VERSION + [{k: v} for k,v in data.items()]))
+
+def field_values(fields, n):
+    """Default value of each field, with text in the text fields
+    """
+    data = {}
+    for f in fields:
+        if f['name'] in TEXT_FIELDS:
+            data[f['name']] = '%s %s %s' % (f['name'], n, 'lorem ipsum ' * 8)
+        else:
+            data[f['name']] = f.get('default', '')
+    return data
+
+def make_collection(base_dir, cid, entities, files, entity_fields, file_fields):
+    """Write entity.json and file JSONs with every field; no binaries
+    
+    @returns: collection_path
+    """
+    collection_path = os.path.join(base_dir, cid)
+    os.makedirs(collection_path)
+    write_object(os.path.join(collection_path, 'collection.json'), {'id': cid})
+    for e in range(1, entities+1):
+        eid = '%s-%s' % (cid, e)
+        entity_dir = os.path.join(collection_path, 'files', eid)
+        os.makedirs(os.path.join(entity_dir, 'files'))
+        data = field_values(entity_fields, e)
+        data['id'] = eid
+        write_object(os.path.join(entity_dir, 'entity.json'), data)
+        for n in range(files):
+            fid = '%s-%s-%010x' % (eid, ROLES[n % len(ROLES)], random.getrandbits(40))
+            data = field_values(file_fields, n)
+            data['id'] = fid
+            write_object(os.path.join(entity_dir, 'files', '%s.json' % fid), data)
+    return collection_path
+
+def before(densho, model, paths, csv_path):
+    """The export loop as it was: a Module per field per row
+    """
+    from DDR import modules
+    if model == 'entity':
+        module,fields = densho.entitymodule,densho.ENTITY_FIELDS
+    else:
+        module,fields = densho.filemodule,densho.FILE_FIELDS
+    fields = [f for f in fields if f['name'] != 'files']
+    with open(csv_path, 'w', newline='') as csvfile:
+        writer = densho.make_csv_writer(csvfile)
+        writer.writerow([f['name'] for f in fields])
+        for path in paths:
+            if model == 'entity':
+                obj = densho.DDRLocalEntity.from_json(os.path.dirname(path))
+            else:
+                obj = densho.DDRLocalFile.from_json(path)
+            values = []
+            for f in fields:
+                value = ''
+                if hasattr(obj, f['name']):
+                    value = modules.Module(module).function(
+                        'csvexport_%s' % f['name'], getattr(obj, f['name'])
+                    )
+                    if not isinstance(value, str):
+                        value = str(value)
+                values.append(value)
+            writer.writerow(values)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=description, epilog=epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('-e', '--entities', type=int, default=2000, help='Number of entities.')
+    parser.add_argument('-f', '--files', type=int, default=4, help='Files per entity.')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='Pool size.')
+    parser.add_argument('-i', '--iterations', type=int, default=3, help='Number of timed runs.')
+    parser.add_argument('-o', '--output', help='Write JSON results to this file.')
+    args = parser.parse_args()
+    
+    setup_django()
+    from migration import densho
+    
+    tmp = tempfile.mkdtemp(prefix='ddrlocal-benchmark-')
+    try:
+        collection_path = make_collection(
+            tmp, 'ddr-test-123', args.entities, args.files,
+            densho.ENTITY_FIELDS, densho.FILE_FIELDS
+        )
+        csv_path = os.path.join(tmp, 'export.csv')
+        results = {'entities': args.entities, 'files': args.entities * args.files}
+        for model,count in [
+                ('entity', args.entities),
+                ('file', args.entities * args.files),
+        ]:
+            paths = []
+            for dirpath,dirnames,filenames in os.walk(collection_path):
+                for filename in filenames:
+                    if (model == 'entity') and (filename == 'entity.json'):
+                        paths.append(os.path.join(dirpath, filename))
+                    elif (model == 'file') and (os.path.basename(dirpath) == 'files') \
+                    and filename.endswith('.json'):
+                        paths.append(os.path.join(dirpath, filename))
+            paths = sorted(paths)
+            fieldnames = [name for name,function,export in densho.export_table(model)]
+            
+            def compiled(workers):
+                def run():
+                    densho.write_rows(
+                        csv_path, fieldnames, densho.export_rows(model, paths, workers)
+                    )
+                return run
+            
+            results[model] = {}
+            for name,func in [
+                    ('before', lambda: before(densho, model, paths, csv_path)),
+                    ('compiled', compiled(1)),
+                    ('parallel', compiled(args.workers)),
+            ]:
+                results[model][name] = stats(timeit(func, args.iterations), count)
+    finally:
+        shutil.rmtree(tmp)
+    
+    report('export', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+description = """Times formatting of search hits for the API (format_object_detail)."""
+
+epilog = """
+Formats synthetic Elasticsearch hits with the reverse()-per-link
+formatter that format_object_detail used to be and with the current
+URLTemplates-based single-pass formatter.  Does not need Elasticsearch.
+
+    $ python -m benchmarks.format_hits -n 1000 -i 20
+"""
+
+from collections import OrderedDict
+import argparse
+
+from benchmarks import report, setup_django, stats, timeit
+
+
+def synthetic_hits(num):
+    """Entity-like list documents similar to what Searcher returns
+    
+    @param num: int
+    @returns: list of dicts
+    """
+    hits = []
+    for n in range(num):
+        oid = 'ddr-densho-1000-%s' % n
+        hits.append({
+            'id': oid,
+            'model': 'entity',
+            'index': n,
+            'links_html': oid,
+            'links_json': oid,
+            'links_img': 'ddr-densho-1000/%s/%s-mezzanine-abc123-a.jpg' % (oid, oid),
+            'links_thumb': 'ddr-densho-1000/%s/%s-mezzanine-abc123-a.jpg' % (oid, oid),
+            'links_parent': 'ddr-densho-1000',
+            'links_children': oid,
+            'parent_id': 'ddr-densho-1000',
+            'collection_id': 'ddr-densho-1000',
+            'organization_id': 'ddr-densho',
+            'signature_id': '%s-mezzanine-abc123' % oid,
+            'title': 'Synthetic entity %s' % n,
+            'description': 'Lorem ipsum dolor sit amet ' * 10,
+            'lineage': [
+                {'id': oid, 'title': 'Synthetic entity %s' % n},
+                {'id': 'ddr-densho-1000', 'title': 'Collection'},
+            ],
+            'repo': 'ddr', 'org': 'densho', 'cid': 1000, 'eid': n,
+            'genre': 'photograph', 'format': 'img', 'status': 'completed',
+        })
+    return hits
+
+def format_baseline(document, request, listitem=False):
+    """format_object_detail as it was before URLTemplates (for comparison)
+    """
+    from django.conf import settings
+    from rest_framework.reverse import reverse
+    from webui import docstore
+    from webui.models import CHILDREN
+    oid = document.pop('id')
+    model = document.pop('model').replace(docstore.INDEX_PREFIX, '')
+    d = OrderedDict()
+    d['id'] = oid
+    d['model'] = model
+    if document.get('index'): d['index'] = document.pop('index')
+    if not listitem:
+        d['collection_id'] = document.get('collection_id')
+    d['links'] = OrderedDict()
+    d['links']['html'] = reverse(
+        'webui-detail', args=[document.pop('links_html')], request=request
+    )
+    d['links']['json'] = reverse(
+        'api-object', args=[document.pop('links_json')], request=request
+    )
+    d['links']['img'] = '%s%s' % (settings.MEDIA_URL, document.pop('links_img'))
+    d['links']['thumb'] = '%s%s' % (settings.MEDIA_URL, document.pop('links_thumb'))
+    if not listitem:
+        if document.get('parent_id'):
+            d['links']['parent'] = reverse(
+                'api-object', args=[document.pop('links_parent')], request=request
+            )
+        if CHILDREN[model]:
+            d['links']['children-objects'] = reverse(
+                'api-object-children', args=[document['links_children']], request=request
+            )
+            d['links']['children-files'] = reverse(
+                'api-object-nodes', args=[document['links_children']], request=request
+            )
+            document.pop('links_children')
+        d['parent_id'] = document.get('parent_id', '')
+        d['organization_id'] = document.get('organization_id', '')
+        d['signature_id'] = document.get('signature_id', '')
+    d['title'] = document['title']
+    d['description'] = document['description']
+    if not listitem:
+        if document.get('lineage'):
+            crumbs = [c for c in document.pop('lineage')[::-1]]
+            for c in crumbs:
+                c['api_url'] = reverse('api-object', args=[c['id']], request=request)
+                c['url'] = reverse('webui-detail', args=[c['id']], request=request)
+            d['breadcrumbs'] = crumbs
+    for key in document.keys():
+        if key not in ['repo','org','cid','eid','sid','sha1']:
+            d[key] = document[key]
+    return d
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=description, epilog=epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('-n', '--num', type=int, default=1000, help='Number of hits.')
+    parser.add_argument('-i', '--iterations', type=int, default=10, help='Number of timed runs.')
+    parser.add_argument('-o', '--output', help='Write JSON results to this file.')
+    args = parser.parse_args()
+    
+    setup_django()
+    from copy import deepcopy
+    from django.conf import settings
+    from django.test import RequestFactory
+    from webui import models
+    
+    hits = synthetic_hits(args.num)
+    host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost'
+    factory = RequestFactory(HTTP_HOST=host)
+    
+    def run(function, listitem):
+        request = factory.get('/api/1.0/search')
+        for document in deepcopy(hits):
+            function(document=document, request=request, listitem=listitem)
+    
+    results = {}
+    for listitem in [True, False]:
+        label = 'listitem' if listitem else 'detail'
+        results['%s before' % label] = stats(
+            timeit(lambda: run(format_baseline, listitem), args.iterations),
+            args.num
+        )
+        results['%s after' % label] = stats(
+            timeit(lambda: run(models.format_object_detail, listitem), args.iterations),
+            args.num
+        )
+    
+    report('format_hits', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
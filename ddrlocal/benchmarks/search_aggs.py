@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+description = """Compares search latency with and without aggregations."""
+
+epilog = """
+Runs the same fulltext query against the configured Elasticsearch
+cluster with each aggregations policy, then times the cached
+facet-counts lookup.
+
+    $ python -m benchmarks.search_aggs -q seattle -i 20
+"""
+
+import argparse
+
+from benchmarks import report, setup_django, stats, timeit
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=description, epilog=epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('-q', '--query', default='seattle', help='Fulltext query.')
+    parser.add_argument('-i', '--iterations', type=int, default=10, help='Number of timed runs.')
+    parser.add_argument('-l', '--limit', type=int, default=25, help='Page size.')
+    parser.add_argument('-o', '--output', help='Write JSON results to this file.')
+    args = parser.parse_args()
+    
+    setup_django()
+    from django.core.cache import cache
+    from webui import search
+    
+    params = {'fulltext': args.query}
+    
+    def run(policy):
+        searcher = search.Searcher()
+        searcher.prepare(params=params, aggs=policy)
+        searcher.execute(args.limit, 0)
+    
+    results = {}
+    for policy in search.AGGS_POLICIES:
+        results['aggs=%s' % policy] = stats(
+            timeit(lambda: run(policy), args.iterations)
+        )
+    
+    key = search.aggs_cache_key(params)
+    def facets_cold():
+        cache.delete(key)
+        search.cached_aggregations(params)
+    def facets_warm():
+        search.cached_aggregations(params)
+    results['facets (uncached)'] = stats(timeit(facets_cold, args.iterations))
+    results['facets (cached)'] = stats(timeit(facets_warm, args.iterations))
+    
+    report('search_aggs', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
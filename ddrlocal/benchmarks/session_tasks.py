@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+description = """Times task status lookup for the notifications area (session_tasks)."""
+
+epilog = """
+Stores results for N fake tasks in the Celery result backend (Redis)
+and compares one AsyncResult lookup per task (the old session_tasks)
+with batched lookups plus session caching of finished tasks.
+Needs the Redis result backend from settings.
+
+    $ python -m benchmarks.session_tasks -n 50 -i 20
+"""
+
+from datetime import datetime, timedelta
+import argparse
+import uuid
+
+from benchmarks import report, setup_django, stats, timeit
+
+
+class FakeRequest(object):
+    def __init__(self, tasks):
+        self.session = {}
+        self.tasks = tasks
+    
+    def reset(self, settings):
+        self.session = {
+            settings.CELERY_TASKS_SESSION_KEY: {
+                task_id: dict(task) for task_id,task in self.tasks.items()
+            }
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=description, epilog=epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('-n', '--num', type=int, default=50, help='Number of tasks in session.')
+    parser.add_argument('-p', '--pending', type=int, default=5, help='Number of tasks still pending.')
+    parser.add_argument('-i', '--iterations', type=int, default=10, help='Number of timed runs.')
+    parser.add_argument('-o', '--output', help='Write JSON results to this file.')
+    args = parser.parse_args()
+    
+    setup_django()
+    from celery import current_app, states
+    from celery.result import AsyncResult
+    from django.conf import settings
+    from DDR import converters
+    from webui.tasks import common
+    
+    backend = current_app.backend
+    now = datetime.now(settings.TZ)
+    tasks = {}
+    for n in range(args.num):
+        task_id = 'benchmark-%s' % uuid.uuid4()
+        tasks[task_id] = {
+            'task_id': task_id,
+            'action': 'collection-sync',
+            'collection_id': 'ddr-test-%s' % n,
+            'collection_url': '/ui/ddr-test-%s/' % n,
+            'start': converters.datetime_to_text(now - timedelta(minutes=n)),
+        }
+        if n >= args.pending:
+            backend.store_result(task_id, {'id': 'ddr-test-%s' % n}, states.SUCCESS)
+    request = FakeRequest(tasks)
+    
+    def before():
+        # one AsyncResult (two GETs) per task, as session_tasks used to
+        for task_id in tasks.keys():
+            result = AsyncResult(task_id)
+            # properties; each one reads the result backend
+            _ = result.state
+            _ = result.result
+    
+    def after_cold():
+        request.reset(settings)
+        common.session_tasks(request)
+    
+    def after_warm():
+        common.session_tasks(request)
+    
+    results = {
+        'before': stats(timeit(before, args.iterations), args.num),
+        'after (first request)': stats(timeit(after_cold, args.iterations), args.num),
+    }
+    request.reset(settings)
+    common.session_tasks(request)
+    results['after (finished tasks cached)'] = stats(
+        timeit(after_warm, args.iterations), args.num
+    )
+    for task_id in tasks.keys():
+        backend.forget(task_id)
+    
+    report('session_tasks', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+description = """Times signature selection (webui.signatures) on a synthetic collection."""
+
+epilog = """
+Writes a synthetic collection (see benchmarks.synthetic; default 5000
+entities with 10 small files each) to a temporary directory and times
+DDR.signatures.find_updates, which reads the whole collection, against
+an incremental run of webui.signatures.find_updates.  Signatures are
+chosen and committed first; then the title of a few entities and the
+sort of their last file are edited, so the incremental run re-reads those
+entities and runs DDR's selection on them.  Only the find step is timed.
+
+    $ python -m benchmarks.signatures -e 5000 -f 10 -t 10 -i 5
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+
+from benchmarks import report, setup_django, stats, timeit
+from benchmarks import synthetic
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=description, epilog=epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('-e', '--entities', type=int, default=5000, help='Number of entities.')
+    parser.add_argument('-f', '--files', type=int, default=10, help='Files per entity.')
+    parser.add_argument('-t', '--touched', type=int, default=10, help='Entities edited before incremental run.')
+    parser.add_argument('-i', '--iterations', type=int, default=5, help='Number of timed runs.')
+    parser.add_argument('-o', '--output', help='Write JSON results to this file.')
+    args = parser.parse_args()
+    
+    setup_django()
+    from DDR import signatures as ddr_signatures
+    from webui import signatures
+    from webui.identifier import Identifier
+    from webui.models import Collection
+    from webui.util import load_json
+    
+    tmp = tempfile.mkdtemp(prefix='ddrlocal-benchmark-')
+    try:
+        collection_path = synthetic.make_store(
+            tmp, collections=1, entities=args.entities, files=args.files, file_size=64
+        )[0]
+        collection = Collection.from_identifier(Identifier(path=collection_path))
+        objects = args.entities * (args.files + 1) + 1
+        updates = ddr_signatures.find_updates(collection)
+        ddr_signatures.write_updates(updates)
+        synthetic.git(collection_path, 'commit', '-a', '-m', 'Signatures')
+        index = {
+            'commit': signatures.head(collection_path),
+            'entities': signatures.scan(collection_path),
+        }
+        
+        def full():
+            ddr_signatures.find_updates(collection)
+        
+        # edit a few entities, uncommitted, so git reports them
+        touched = random.sample(
+            sorted(index['entities'].keys()), min(args.touched, len(index['entities']))
+        )
+        for reldir in touched:
+            json_path = os.path.join(collection_path, reldir, 'entity.json')
+            data = load_json(json_path)
+            data['title'] = '%s (edited)' % data.get('title', '')
+            synthetic.write_object(json_path, data)
+            role,sort,file_id = max(index['entities'][reldir]['files'], key=lambda f: f[1])
+            json_path = os.path.join(collection_path, reldir, 'files', '%s.json' % file_id)
+            data = load_json(json_path)
+            data['sort'] = sort + 1000
+            synthetic.write_object(json_path, data)
+        
+        def incremental():
+            signatures.find_updates(collection, index=index)
+        
+        results = {
+            'entities': args.entities,
+            'files': args.entities * args.files,
+            'updates': len(updates),
+            'full scan': stats(timeit(full, args.iterations), objects),
+            'incremental (%s entities touched)' % len(touched): stats(
+                timeit(incremental, args.iterations)
+            ),
+        }
+    finally:
+        shutil.rmtree(tmp)
+    
+    report('signatures', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
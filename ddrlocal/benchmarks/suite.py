@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+description = """Times the main ddr-local paths on a synthetic Store of real git/git-annex repos."""
+
+epilog = """
+Writes a synthetic Store (see benchmarks.synthetic) to a temporary
+directory: --collections collections of --entities entities with --files
+annexed master files of --file-size bytes each.  MEDIA_BASE points at it
+for the run and Elasticsearch is not used.  Then times:
+- generate:     writing and committing the Store
+- csv-export:   entity and file CSV of one collection (webui.csvio.export_rows)
+- csv-import:   re-import of the entity CSV with changed titles, one commit
+- file-add:     --add files of --file-size added to one entity (webui.ingest.batch)
+- check:        full and incremental collection check (webui.checker)
+- signatures:   full signature scan (DDR.signatures.find_updates)
+- gitstatus:    git/annex status of every collection (webui.gitstatus.update)
+- collections:  collections page render
+- children:     first and last page of a collection's children, cold and cached
+Steps that write (csv-import, file-add) run last so the others see the
+Store as generated.  Reports JSON; save it with -o to compare runs.
+
+    $ python -m benchmarks.suite -c 3 -e 500 -f 2 -s 65536
+    $ python -m benchmarks.suite --steps csv-export check -o before.json
+"""
+
+import argparse
+import csv
+import inspect
+import math
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks import report, setup_django, stats, timeit
+from benchmarks import synthetic
+
+STEPS = [
+    'csv-export', 'check', 'signatures', 'gitstatus', 'collections', 'children',
+    'csv-import', 'file-add',
+]
+
+
+def request(path, query={}):
+    """GET request with a logged-in session; no middleware
+    """
+    from django.contrib.auth.models import AnonymousUser
+    from django.test import RequestFactory
+    req = RequestFactory().get(path, query)
+    req.session = {'git_name': synthetic.GIT_NAME, 'git_mail': synthetic.GIT_MAIL}
+    req.user = AnonymousUser()
+    return req
+
+def view(func):
+    """View function without its decorators (login, storage, gitolite checks)
+    """
+    return inspect.unwrap(func)
+
+def retitle(src_path, dest_path, n):
+    """Copy of entity CSV with a changed title in every row, so import commits
+    """
+    with open(src_path, 'r', encoding='utf-8', newline='') as src:
+        reader = csv.DictReader(src)
+        with open(dest_path, 'w', encoding='utf-8', newline='') as dest:
+            writer = csv.DictWriter(dest, fieldnames=reader.fieldnames)
+            writer.writeheader()
+            for row in reader:
+                row['title'] = '%s (%s)' % (row['title'], n)
+                writer.writerow(row)
+    return dest_path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=description, epilog=epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('-c', '--collections', type=int, default=3, help='Number of collections.')
+    parser.add_argument('-e', '--entities', type=int, default=200, help='Entities per collection.')
+    parser.add_argument('-f', '--files', type=int, default=2, help='Files per entity.')
+    parser.add_argument('-s', '--file-size', type=int, default=64*1024, help='Bytes per file.')
+    parser.add_argument('-a', '--add', type=int, default=10, help='Files added in file-add.')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='Pool size.')
+    parser.add_argument('-i', '--iterations', type=int, default=3, help='Number of timed runs.')
+    parser.add_argument('--steps', nargs='+', choices=STEPS, default=STEPS, help='Steps to run.')
+    parser.add_argument('--keep', action='store_true', help='Keep the synthetic Store.')
+    parser.add_argument('-o', '--output', help='Write JSON results to this file.')
+    args = parser.parse_args()
+    
+    setup_django()
+    from django.conf import settings
+    from django.core.cache import cache
+    from django.test.utils import override_settings, setup_test_environment
+    from DDR import signatures as ddr_signatures
+    from DDR.ingest import addfile_logger
+    from webui import checker, csvio, gitolite, gitstatus, ingest
+    from webui.identifier import Identifier
+    from webui.models import Collection, Entity
+    from webui.views import collections as collection_views
+    setup_test_environment()
+    
+    tmp = tempfile.mkdtemp(prefix='ddrlocal-benchmark-')
+    store = os.path.join(tmp, 'ddr')
+    work = os.path.join(tmp, 'work')
+    os.makedirs(work)
+    results = {
+        'collections': args.collections,
+        'entities': args.entities,
+        'files': args.entities * args.files,
+        'file_size': args.file_size,
+        'workers': args.workers,
+    }
+    objects = args.entities * (args.files + 1) + 1
+    try:
+        with override_settings(MEDIA_BASE=store, DOCSTORE_ENABLED=False):
+            start = time.perf_counter()
+            paths = synthetic.make_store(
+                store, args.collections, args.entities, args.files, args.file_size
+            )
+            results['generate'] = stats(
+                [time.perf_counter() - start], args.collections * objects
+            )
+            collection_path = paths[0]
+            collection = Collection.from_identifier(Identifier(path=collection_path))
+            
+            for step in [step for step in STEPS if step in args.steps]:
+                
+                if step == 'csv-export':
+                    results[step] = {}
+                    for model,count in [
+                            ('entity', args.entities),
+                            ('file', args.entities * args.files),
+                    ]:
+                        def run():
+                            for text in csvio.export_rows(
+                                    collection_path, model, workers=args.workers
+                            ):
+                                pass
+                        results[step][model] = stats(timeit(run, args.iterations), count)
+                
+                elif step == 'check':
+                    results[step] = {}
+                    for name,incremental in [('full', False), ('incremental', True)]:
+                        def run():
+                            checker.check_collection(
+                                collection_path, incremental=incremental,
+                                workers=args.workers, base_dir=store
+                            )
+                        results[step][name] = stats(timeit(run, args.iterations), objects)
+                
+                elif step == 'signatures':
+                    def run():
+                        ddr_signatures.find_updates(collection)
+                    results[step] = stats(timeit(run, args.iterations), objects)
+                
+                elif step == 'gitstatus':
+                    def run():
+                        for path in paths:
+                            gitstatus.update(store, path)
+                    results[step] = stats(timeit(run, args.iterations), len(paths))
+                
+                elif step == 'collections':
+                    # no Gitolite server; list the synthetic organization
+                    get_repos_orgs = gitolite.get_repos_orgs
+                    gitolite.get_repos_orgs = lambda force=False: [
+                        '%s-%s' % (synthetic.REPO, synthetic.ORG)
+                    ]
+                    try:
+                        def run():
+                            view(collection_views.collections)(request('/ui/collections/'))
+                        results[step] = stats(timeit(run, args.iterations), len(paths))
+                    finally:
+                        gitolite.get_repos_orgs = get_repos_orgs
+                
+                elif step == 'children':
+                    results[step] = {}
+                    last = max(1, math.ceil(args.entities / settings.RESULTS_PER_PAGE))
+                    for name,page,cold in [
+                            ('first page', 1, True),
+                            ('last page', last, True),
+                            ('first page cached', 1, False),
+                    ]:
+                        def run():
+                            if cold:
+                                cache.clear()
+                            view(collection_views.children)(
+                                request('/ui/collection/%s/children/' % collection.id,
+                                        {'page': page}),
+                                collection.id
+                            )
+                        results[step][name] = stats(timeit(run, args.iterations))
+                
+                elif step == 'csv-import':
+                    exported = os.path.join(work, 'entities.csv')
+                    with open(exported, 'w', encoding='utf-8', newline='') as f:
+                        for text in csvio.export_rows(collection_path, 'entity'):
+                            f.write(text)
+                    csv_paths = [
+                        retitle(exported, os.path.join(work, 'import-%s.csv' % n), n)
+                        for n in range(args.iterations)
+                    ]
+                    def run():
+                        csvio.import_entities(
+                            csv_paths.pop(), collection,
+                            synthetic.GIT_NAME, synthetic.GIT_MAIL,
+                            workers=args.workers
+                        )
+                    results[step] = stats(
+                        timeit(run, args.iterations, warmup=0), args.entities
+                    )
+                
+                elif step == 'file-add':
+                    entity = Entity.from_identifier(Identifier(
+                        path=os.path.join(collection_path, 'files', '%s-1' % collection.id)
+                    ))
+                    batches = [
+                        synthetic.make_sources(
+                            os.path.join(work, 'src-%s' % n), args.add, args.file_size
+                        )
+                        for n in range(args.iterations)
+                    ]
+                    data = {
+                        'id': entity.id, 'external': False, 'role': 'master',
+                        'public': 1, 'sort': args.files + 1,
+                    }
+                    def run():
+                        ingest.batch(
+                            entity, batches.pop(), 'master', data,
+                            synthetic.GIT_NAME, synthetic.GIT_MAIL, 'benchmark',
+                            addfile_logger(entity.identifier)
+                        )
+                    results[step] = stats(
+                        timeit(run, args.iterations, warmup=0), args.add
+                    )
+    finally:
+        if args.keep:
+            results['store'] = store
+        else:
+            shutil.rmtree(tmp)
+    
+    report('suite', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Synthetic Stores for benchmarks
+
+Writes collections as real git repositories with git-annex: metadata
+JSON for the collection, its entities and files, plus binary master
+files of a given size, annexed and committed.  Field values are the
+defaults from the model modules (repo_models), so the objects load like
+real ones.
+
+>>> from benchmarks import synthetic
+>>> paths = synthetic.make_store('/tmp/store', collections=2, entities=100, files=2)
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+
+GIT_VERSION = [{'application': 'benchmark', 'git_version': 'git version 2.20.1'}]
+GIT_NAME = 'benchmark'
+GIT_MAIL = 'benchmark@example.com'
+REPO = 'ddr'
+ORG = 'test'
+TEXT_FIELDS = ['title', 'description', 'notes', 'label']
+
+
+def write_object(path, data):
+    with open(path, 'w') as f:
+        f.write(json.dumps(GIT_VERSION + [{k: v} for k,v in data.items()], indent=4))
+
+def field_values(fields, n):
+    """Default value of each field, with text in the text fields
+    """
+    data = {}
+    for f in fields:
+        if f['name'] in TEXT_FIELDS:
+            data[f['name']] = '%s %s %s' % (f['name'], n, 'lorem ipsum ' * 8)
+        else:
+            data[f['name']] = f.get('default', '')
+    return data
+
+def git(path, *args):
+    subprocess.check_call(
+        ['git'] + list(args), cwd=path,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+def init_repo(path):
+    """git init and git annex init, with benchmark committer
+    """
+    os.makedirs(path)
+    git(path, 'init')
+    git(path, 'config', 'user.name', GIT_NAME)
+    git(path, 'config', 'user.email', GIT_MAIL)
+    git(path, 'annex', 'init', 'benchmark')
+
+def make_file(entity_dir, eid, role, n, size, fields):
+    """Random binary master file and its metadata
+    
+    @returns: file ID
+    """
+    content = os.urandom(size)
+    sha1 = hashlib.sha1(content).hexdigest()
+    fid = '%s-%s-%s' % (eid, role, sha1[:10])
+    basename = '%s.bin' % fid
+    with open(os.path.join(entity_dir, 'files', basename), 'wb') as f:
+        f.write(content)
+    data = field_values(fields, n)
+    data.update({
+        'id': fid,
+        'sort': n + 1,
+        'sha1': sha1,
+        'sha256': hashlib.sha256(content).hexdigest(),
+        'md5': hashlib.md5(content).hexdigest(),
+        'size': size,
+        'basename_orig': 'IMG_%04d.bin' % n,
+        'path_rel': basename,
+    })
+    write_object(os.path.join(entity_dir, 'files', '%s.json' % fid), data)
+    return fid
+
+def make_collection(base_dir, cid, entities, files, file_size, modules):
+    """Collection repo with entities, files, and annexed binaries; one commit
+    
+    @param base_dir: str Store
+    @param cid: str Collection ID
+    @param entities: int
+    @param files: int Files per entity
+    @param file_size: int Bytes per binary
+    @param modules: dict {model: repo_models module} (webui.identifier.MODULES)
+    @returns: collection_path
+    """
+    collection_path = os.path.join(base_dir, cid)
+    init_repo(collection_path)
+    data = field_values(modules['collection'].FIELDS, 0)
+    data['id'] = cid
+    write_object(os.path.join(collection_path, 'collection.json'), data)
+    for e in range(1, entities+1):
+        eid = '%s-%s' % (cid, e)
+        entity_dir = os.path.join(collection_path, 'files', eid)
+        os.makedirs(os.path.join(entity_dir, 'files'))
+        data = field_values(modules['entity'].FIELDS, e)
+        data.update({'id': eid, 'sort': e})
+        write_object(os.path.join(entity_dir, 'entity.json'), data)
+        for n in range(files):
+            make_file(entity_dir, eid, 'master', n, file_size, modules['file'].FIELDS)
+    git(collection_path, 'annex', 'add', '--include=*.bin', '.')
+    git(collection_path, 'add', '.')
+    git(collection_path, 'commit', '-m', 'Synthetic collection %s' % cid)
+    return collection_path
+
+def make_store(base_dir, collections=2, entities=100, files=2, file_size=64*1024, modules=None):
+    """Store with collections REPO-ORG-1 ... REPO-ORG-N
+    
+    @returns: list of collection paths
+    """
+    if not modules:
+        from webui.identifier import MODULES as modules
+    os.makedirs(base_dir, exist_ok=True)
+    return [
+        make_collection(
+            base_dir, '%s-%s-%s' % (REPO, ORG, c),
+            entities, files, file_size, modules
+        )
+        for c in range(1, collections+1)
+    ]
+
+def make_sources(src_dir, count, size):
+    """Random files to add to an entity
+    
+    @returns: list of paths
+    """
+    os.makedirs(src_dir, exist_ok=True)
+    paths = []
+    for n in range(count):
+        path = os.path.join(src_dir, 'IMG_%04d.bin' % n)
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+        paths.append(path)
+    return paths
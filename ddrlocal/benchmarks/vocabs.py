@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+description = """Times controlled-vocabulary validation of CSV import rows (webui.vocabs)."""
+
+epilog = """
+Makes a synthetic entity CSV (official values, labels, variant spellings,
+and a few invalid values in every choice field of the entity model) and
+validates and normalizes it two ways:
+- before:  per row and per field, rebuild the list of choices and scan it,
+           then replace variants cell by cell (migration.densho style)
+- index:   webui.vocabs.VocabIndex, built once, one column at a time
+Reports rows/sec for each, and the time to build the index.
+
+Vocabulary fields (topics, facility) are only checked if --vocabs-url
+is given, since fetching them needs the network.
+
+    $ python -m benchmarks.vocabs -n 50000
+    $ python -m benchmarks.vocabs -n 50000 --vocabs-url http://partner.densho.org/vocab/api/0.2/
+"""
+
+import argparse
+import random
+
+from benchmarks import report, setup_django, stats, timeit
+
+# Share of cells with a value that is not valid
+INVALID_RATE = 0.01
+
+
+def make_rows(fields, choices_alt, count, seed=0):
+    """Rows for every choice field, using official values, labels, and variants
+    
+    @returns: (headers, list of dicts)
+    """
+    rnd = random.Random(seed)
+    options = {}
+    for field in fields:
+        choices = (field.get('form') or {}).get('choices')
+        if choices:
+            values = [str(value) for value,label in choices]
+            values += [str(label) for value,label in choices]
+            for variants in choices_alt.get(field['name'], {}).values():
+                values += variants
+            options[field['name']] = values
+    headers = ['id'] + sorted(options.keys())
+    rowds = []
+    for n in range(count):
+        rowd = {'id': 'ddr-test-123-%s' % (n + 1)}
+        for name,values in options.items():
+            if rnd.random() < INVALID_RATE:
+                rowd[name] = 'invalid-%s' % rnd.randint(0, 9)
+            else:
+                rowd[name] = rnd.choice(values)
+        rowds.append(rowd)
+    return headers, rowds
+
+def before(fields, choices_alt, headers, rowds):
+    """Per-row, per-field list scans and cell-by-cell replacement
+    """
+    errors = []
+    for n,rowd in enumerate(rowds):
+        for field in fields:
+            choices = (field.get('form') or {}).get('choices')
+            if not choices or field['name'] not in rowd:
+                continue
+            alt = {}
+            for key,variants in choices_alt.get(field['name'], {}).items():
+                for v in variants:
+                    alt[v] = key
+            value = alt.get(rowd[field['name']], rowd[field['name']])
+            valid = [str(v) for v,label in choices] + [str(label) for v,label in choices]
+            if value not in valid:
+                errors.append((n, field['name'], value))
+            else:
+                rowd[field['name']] = value
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=description, epilog=epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('-n', '--count', type=int, default=50000, help='Rows.')
+    parser.add_argument('-i', '--iterations', type=int, default=3, help='Number of timed runs.')
+    parser.add_argument('--vocabs-url', help='Also check vocabulary fields from this URL.')
+    parser.add_argument('-o', '--output', help='Write JSON results to this file.')
+    args = parser.parse_args()
+    
+    setup_django()
+    from webui.identifier import MODULES
+    from webui import vocabs
+    
+    fields = MODULES['entity'].FIELDS
+    headers,rowds = make_rows(fields, vocabs.CHOICES_ALT, args.count)
+    
+    def build():
+        if args.vocabs_url:
+            return vocabs.VocabIndex.from_model('entity', args.vocabs_url)
+        return vocabs.VocabIndex(fields)
+    index = build()
+    
+    def copy():
+        return [dict(rowd) for rowd in rowds]
+    
+    results = {
+        'rows': args.count,
+        'fields': index.fields(),
+        'build': stats(timeit(build, iterations=args.iterations, warmup=0)),
+    }
+    for name,func in [
+            ('before', lambda rows: before(fields, vocabs.CHOICES_ALT, headers, rows)),
+            ('index', lambda rows: index.normalize(headers, rows)),
+    ]:
+        batches = [copy() for n in range(args.iterations + 1)]
+        def run():
+            return func(batches.pop())
+        data = stats(timeit(run, iterations=args.iterations), args.count)
+        data['errors'] = len(func(copy()))
+        results[name] = data
+    
+    report('vocabs', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+#
+# This file is part of ddr-local
+#
+#
+
+description = """Exports entity and file metadata of every collection in a Store as one dataset."""
+
+epilog = """
+Writes gzipped JSON Lines partitioned by collection (see webui.dataset):
+
+/OUT/entity/collection_id=REPO-ORG-CID/part-0.jsonl.gz
+/OUT/file/collection_id=REPO-ORG-CID/part-0.jsonl.gz
+/OUT/manifest.json
+
+Run again to refresh: only collections changed since their last export
+are rewritten.
+
+    $ python bin/store_export.py -b /var/www/media/ddr -o /var/www/media/ddr/tmp/dataset
+"""
+
+import argparse
+import json
+import os
+import sys
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=description, epilog=epilog,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-b', '--base', help='Absolute path to Store (default: MEDIA_BASE).')
+    parser.add_argument('-o', '--output', help='Absolute path to dataset (default: STORE/tmp/dataset).')
+    parser.add_argument('-w', '--workers', type=int, default=4, help='Collections exported at once.')
+    parser.add_argument('-f', '--force', action='store_true', help='Rewrite every collection, changed or not.')
+    
+    args = parser.parse_args()
+    
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ddrlocal.settings')
+    import django
+    django.setup()
+    from webui import dataset
+    
+    stats = dataset.export_store(
+        base_dir=args.base, out_dir=args.output,
+        force=args.force, workers=args.workers
+    )
+    print(json.dumps(stats, indent=4))
+    if stats['errors']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -92,6 +92,9 @@ DOCSTORE_TIMEOUT     = int(CONFIG.get('local', 'docstore_timeout'))
 RESULTS_PER_PAGE = 25
 ELASTICSEARCH_MAX_SIZE = 10000
 ELASTICSEARCH_DEFAULT_LIMIT = RESULTS_PER_PAGE
+# SQLite full-text index, used for search if Elasticsearch is disabled or down
+# See webui.fulltext.
+FULLTEXT_INDEX_PATH = os.path.join(MEDIA_BASE, '.fulltext.sqlite3')
 
 GITOLITE_INFO_CACHE_TIMEOUT = int(CONFIG.get('local', 'gitolite_info_cache_timeout'))
 GITOLITE_INFO_CACHE_CUTOFF  = int(CONFIG.get('local', 'gitolite_info_cache_cutoff'))
@@ -224,6 +227,14 @@ CACHES = {
 
 # celery
 CELERY_TASKS_SESSION_KEY = 'celery-tasks'
+# Finished tasks are removed from session after this many seconds,
+# and only this many finished tasks are kept.
+CELERY_TASKS_SESSION_EXPIRE = 60 * 60 * 24 * 7
+CELERY_TASKS_SESSION_MAX = 50
+# Task state change events (webui.views.task_events): seconds before the
+# stream is closed and seconds before the browser reconnects.
+CELERY_TASKS_EVENTS_TIMEOUT = 60
+CELERY_TASKS_EVENTS_RETRY = 5
 CELERY_RESULT_BACKEND = 'redis://{}:{}/{}'.format(
     REDIS_HOST, str(REDIS_PORT), str(REDIS_DB_CELERY_RESULT)
 )
@@ -231,6 +242,16 @@ CELERY_BROKER_URL     = 'redis://{}:{}/{}'.format(
     REDIS_HOST, str(REDIS_PORT), str(REDIS_DB_CELERY_BROKER)
 )
 BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 60 * 60}  # 1 hour
+# Tasks that write to collection repos run in per-collection serial lanes;
+# other tasks go to dedicated queues.  See webui.tasks.routing.
+# IMPORTANT: one worker runs per lane.  make install-daemons-configs
+# sets numprocs of the celery-lane program in celeryd.conf from this
+# value and make runworker-lane checks LANE against it; restart
+# supervisor after changing it.  The Debian package installs
+# conf/celeryd.conf as-is, so keep its numprocs equal to this default.
+CELERY_COLLECTION_LANES = 4
+CELERY_TASK_ROUTES = ('webui.tasks.routing.route_task',)
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
 CELERYD_HIJACK_ROOT_LOGGER = False
 CELERY_ACCEPT_CONTENT = ['pickle', 'json', 'msgpack', 'yaml']
 CELERYBEAT_SCHEDULER = None
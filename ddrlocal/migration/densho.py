@@ -103,6 +103,7 @@ Run the export.::
 """
 
 from __future__ import division
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 import csv
 from datetime import datetime
@@ -118,9 +119,10 @@ from django.conf import settings
 from DDR import commands
 from DDR import converters
 from DDR import fileio
-from DDR import modules
 from DDR import util
 from webui.models import Collection, Entity
+from webui.util import pool_map
+from webui.vocabs import CHOICES_ALT, variant_index
 from ddrlocal.models import DDRLocalEntity, DDRLocalFile
 
 if settings.REPO_MODELS_PATH not in sys.path:
@@ -157,6 +159,13 @@ CSV_DELIMITER = ','
 CSV_QUOTECHAR = '"'
 CSV_QUOTING = csv.QUOTE_ALL
 
+# Threads for pre-flight stats, opens, and entity loads (I/O bound)
+PREFLIGHT_WORKERS = 16
+# Objects decoded by an export worker at a time
+EXPORT_CHUNK_SIZE = 100
+# Bytes buffered by the export writer
+EXPORT_BUFFER_SIZE = 1024 * 1024
+
 # These are lists of alternative forms of controlled-vocabulary terms.
 # From these indexes are build that will be used to replace variant terms with the official term.
 ENTITY_HEADER_FIELDS_ALT = {
@@ -165,90 +174,16 @@ ENTITY_HEADER_FIELDS_ALT = {
 FILE_HEADER_FIELDS_ALT = {
     'basename_orig': ['file',],
 }
-STATUS_CHOICES_ALT = {
-    'inprocess': ['In Process', 'In Progress', 'inprogress',],
-    'completed': ['Completed', 'complete', 'Complete',],
-}
-PERMISSIONS_CHOICES_ALT = {
-    '1': ['public', 'Public',],
-    '0': ['private', 'Private',],
-}
-LANGUAGE_CHOICES_ALT = {
-    'eng': ['english', 'English', 'eng:English',],
-    'jpn': ['japanese', 'Japanese', 'jpn:Japanese',],
-    'chi': ['chinese', 'Chinese', 'chi:Chinese',],
-    'fre': ['french', 'French', 'fre:French',],
-    'ger': ['german', 'German', 'ger:German',], 
-    'ita': ['italian', 'Italian', 'ita:Italian',],
-    'kor': ['korean', 'Korean', 'kor:Korean',],
-    'por': ['portuguese', 'Portuguese', 'por:Portuguese',],
-    'rus': ['russian', 'Russian', 'rus:Russian',],
-    'spa': ['spanish', 'Spanish', 'spa:Spanish',],
-    'tgl': ['tagalog', 'Tagalog', 'tgl:Tagalog',],
-}
-GENRE_CHOICES_ALT = {
-    'advertisement': ['Advertisements', 'Advertisement',],
-    'album': ['Albums', 'Album',],
-    'architecture': ['Architecture',],
-    'baseball_card': ['Baseball Cards', 'Baseball Card',],
-    'blank_form': ['Blank Forms', 'Blank Form',],
-    'book': ['Books', 'Book',],
-    'broadside': ['Broadsides', 'Broadside',],
-    'cartoon': ['Cartoons (Commentary)', 'Cartoon (Commentary)',],
-    'catalog': ['Catalogs', 'Catalog',],
-    'cityscape': ['Cityscapes', 'Cityscape',],
-    'clipping': ['Clippings', 'Clipping',],
-    'correspondence': ['Correspondence',],
-    'diary': ['Diaries', 'Diary',],
-    'drawing': ['Drawings', 'Drawing',],
-    'ephemera': ['Ephemera',],
-    'essay': ['Essays', 'Essay',],
-    'ethnography': ['Ethnographies', 'Ethnography',],
-    'fieldnotes': ['Fieldnotes', 'Fieldnote',],
-    'illustration': ['Illustrations', 'Illustration',],
-    'interview': ['Interviews', 'Interview',],
-    'landscape': ['Landscapes', 'Landscape',],
-    'leaflet': ['Leaflets', 'Leaflet',],
-    'manuscript': ['Manuscripts', 'Manuscript',],
-    'map': ['Maps', 'Map',],
-    'misc_document': ['Miscellaneous Documents', 'Miscellaneous Document',],
-    'motion_picture': ['Motion Pictures', 'Motion Picture',],
-    'music': ['Music',],
-    'narrative': ['Narratives', 'Narrative',],
-    'painting': ['Paintings', 'Painting',],
-    'pamphlet': ['Pamphlets', 'Pamphlet',],
-    'periodical': ['Periodicals', 'Periodical',],
-    'petition': ['Petitions', 'Petition',],
-    'photograph': ['Photographs', 'Photograph',],
-    'physical_object': ['Physical Objects', 'Physical Object',],
-    'poetry': ['Poetry',],
-    'portrait': ['Portraits', 'Portrait',],
-    'postcard': ['Postcards', 'Postcard',],
-    'poster': ['Posters', 'Poster',],
-    'print': ['Prints', 'Print',],
-    'program': ['Programs', 'Program',],
-    'rec_log': ['Recording Logs', 'Recording Log',],
-    'score': ['Scores', 'Score',],
-    'sheet_music': ['Sheet Music',],
-    'timetable': ['Timetables', 'Timetable',],
-    'transcription': ['Transcriptions', 'Transcription',],
-}
-FORMAT_CHOICES_ALT = {
-    'av': ['Audio/Visual',],
-    'ds': ['Datasets', 'Dataset',],
-    'doc': ['Documents', 'Document',],
-    'img': ['Still Images', 'Still Image',],
-    'vh': ['Oral Histories', 'Oral History',],
-}
+STATUS_CHOICES_ALT = CHOICES_ALT['status']
+PERMISSIONS_CHOICES_ALT = CHOICES_ALT['public']
+LANGUAGE_CHOICES_ALT = CHOICES_ALT['language']
+GENRE_CHOICES_ALT = CHOICES_ALT['genre']
+FORMAT_CHOICES_ALT = CHOICES_ALT['format']
 
 def make_choices_alt_index(choices_alt):
     """Make index from *_CHOICES_ALT dict
     """
-    index = {}
-    for key,value in choices_alt.items():
-        for v in value:
-            index[v] = key
-    return index
+    return variant_index(choices_alt)
 ENTITY_HEADER_FIELDS_ALT_INDEX = make_choices_alt_index(ENTITY_HEADER_FIELDS_ALT)
 FILE_HEADER_FIELDS_ALT_INDEX = make_choices_alt_index(FILE_HEADER_FIELDS_ALT)
 STATUS_CHOICES_ALT_INDEX = make_choices_alt_index(STATUS_CHOICES_ALT)
@@ -399,9 +334,9 @@ def valid_choice_values( choices ):
     """Return list of valid values for list of tuples.
     
     @param choices: List of value:descriptor tuples from MODEL_FIELDS doc.
-    @returns list of values
+    @returns frozenset of values
     """
-    return [value for value,descriptor in choices]
+    return frozenset([value for value,descriptor in choices])
 
 STATUS_CHOICES_VALUES = valid_choice_values(STATUS_CHOICES)
 PUBLIC_CHOICES_VALUES = valid_choice_values(PERMISSIONS_CHOICES)
@@ -413,7 +348,7 @@ FORMAT_CHOICES_VALUES = valid_choice_values(FORMAT_CHOICES)
 def choice_is_valid( valid_choices, choice ):
     """Indicates whether choice is valid for CHOICES
     
-    @param choices: List of valid choice values.
+    @param choices: Set of valid choice values.
     @param choice: A particular choice value.
     @returns True for good, False for bad
     """
@@ -495,6 +430,91 @@ def all_rows_valid( object_class, headers, required_fields, rows ):
             if invalid:
                 raise Exception('INVALID VALUES: %s' % invalid)
 
+def _load_entity( entity_id ):
+    """Loads one Entity; returns (entity_id, Entity or None)
+    """
+    repo,org,cid,eid = entity_id.split('-')
+    entity_path = Entity.entity_path(None, repo, org, cid, eid)
+    try:
+        entity = Entity.from_json(entity_path)
+    except:
+        entity = None
+    return entity_id,entity
+
+def _check_source( src_path ):
+    """Stats and opens one source file; returns (src_path, size, status)
+    
+    status is 'ok', 'missing', or 'unreadable'; size is None unless ok.
+    """
+    try:
+        size = os.path.getsize(src_path)
+    except OSError:
+        return src_path,None,'missing'
+    try:
+        f = open(src_path, 'rb')
+        f.close()
+    except:
+        return src_path,None,'unreadable'
+    return src_path,size,'ok'
+
+def preflight( csv_dir, headers, rows, entities=True, files=True, workers=PREFLIGHT_WORKERS ):
+    """Checks entities and source files for a files import, concurrently
+    
+    Each entity and each source file is checked once, however many rows
+    mention it.  Stats, opens, and JSON loads wait on the disk (or on a
+    VirtualBox shared folder) so a thread pool runs many at once.
+    The loaded entities are returned so the import need not load them again.
+    
+    @param csv_dir: Absolute path to dir
+    @param headers: List of field names
+    @param rows: List of rows (each with list of fields, not dict)
+    @param entities: boolean Load entities
+    @param files: boolean Check source files
+    @param workers: int Number of threads
+    @returns: dict {
+        'entities': {entity_id: Entity},
+        'bad_entities': [entity_id, ...],
+        'missing_files': [src_path, ...],
+        'unreadable_files': [src_path, ...],
+        'sizes': {src_path: bytes},
+        'bytes': int,
+    }
+    """
+    # dicts keep the order of first mention
+    entity_ids = {}
+    src_paths = {}
+    for row in rows:
+        rowd = make_row_dict(headers, row)
+        if entities:
+            entity_ids[rowd['entity_id']] = None
+        if files:
+            src_paths[os.path.join(csv_dir, rowd['basename_orig'])] = None
+    report = {
+        'entities': {},
+        'bad_entities': [],
+        'missing_files': [],
+        'unreadable_files': [],
+        'sizes': {},
+        'bytes': 0,
+    }
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        loaded = pool.map(_load_entity, entity_ids)
+        sources = pool.map(_check_source, src_paths)
+        for entity_id,entity in loaded:
+            if entity:
+                report['entities'][entity_id] = entity
+            else:
+                report['bad_entities'].append(entity_id)
+        for src_path,size,status in sources:
+            if status == 'missing':
+                report['missing_files'].append(src_path)
+            elif status == 'unreadable':
+                report['unreadable_files'].append(src_path)
+            else:
+                report['sizes'][src_path] = size
+    report['bytes'] = sum(report['sizes'].values())
+    return report
+
 def test_entities( headers, rows ):
     """Test-loads Entities mentioned in rows; crashes if any are missing.
     
@@ -502,19 +522,7 @@ def test_entities( headers, rows ):
     @param rows: List of rows (each with list of fields, not dict)
     @returns list of invalid entities
     """
-    bad_entities = []
-    for row in rows:
-        rowd = make_row_dict(headers, row)
-        entity_id = rowd.pop('entity_id')
-        repo,org,cid,eid = entity_id.split('-')
-        entity_path = Entity.entity_path(None, repo, org, cid, eid)
-        try:
-            entity = Entity.from_json(entity_path)
-        except:
-            entity = None
-        if not entity:
-            bad_entities.append(entity_id)
-    return bad_entities
+    return preflight(None, headers, rows, files=False)['bad_entities']
 
 def find_missing_files( csv_dir, headers, rows ):
     """checks for missing files
@@ -524,13 +532,7 @@ def find_missing_files( csv_dir, headers, rows ):
     @param rows: List of rows (each with list of fields, not dict)
     @returns list of missing files
     """
-    missing_files = []
-    for row in rows:
-        rowd = make_row_dict(headers, row)
-        src_path = os.path.join(csv_dir, rowd.pop('basename_orig'))
-        if not os.path.exists(src_path):
-            missing_files.append(src_path)
-    return missing_files
+    return preflight(csv_dir, headers, rows, entities=False)['missing_files']
 
 def find_unreadable_files( csv_dir, headers, rows ):
     """checks for unreadable files
@@ -540,16 +542,8 @@ def find_unreadable_files( csv_dir, headers, rows ):
     @param rows: List of rows (each with list of fields, not dict)
     @returns list of unreadable files
     """
-    unreadable_files = []
-    for row in rows:
-        rowd = make_row_dict(headers, row)
-        src_path = os.path.join(csv_dir, rowd.pop('basename_orig'))
-        try:
-            f = open(src_path, 'r')
-            f.close()
-        except:
-            unreadable_files.append(src_path)
-    return unreadable_files
+    report = preflight(csv_dir, headers, rows, entities=False)
+    return report['missing_files'] + report['unreadable_files']
 
 def humanize_bytes(bytes, precision=1):
     """Return a humanized string representation of a number of bytes.
@@ -580,11 +574,11 @@ def humanize_bytes(bytes, precision=1):
     @returns: str
     """
     abbrevs = (
-        (1<<50L, 'PB'),
-        (1<<40L, 'TB'),
-        (1<<30L, 'GB'),
-        (1<<20L, 'MB'),
-        (1<<10L, 'kB'),
+        (1<<50, 'PB'),
+        (1<<40, 'TB'),
+        (1<<30, 'GB'),
+        (1<<20, 'MB'),
+        (1<<10, 'kB'),
         (1, 'bytes')
     )
     if bytes == 1:
@@ -618,22 +612,20 @@ def replace_variant_cv_field_values( object_class, headers, rows ):
     @param rows: List of rows (each with list of fields, not dict)
     @returns: list rows
     """
-    def replace(fieldname, row, headers, rowd, index):
-        """This does the actual work.
-        """
-        value = rowd.get(fieldname, None)
-        # if value appears in index, it is a variant
-        if value and index.get(value, None):
-            row[headers.index(fieldname)] = index[value]
-        return row
-    
-    for row in rows:
-        rowd = make_row_dict(headers, row)
-        row = replace('status', row, headers, rowd, STATUS_CHOICES_ALT_INDEX)
-        row = replace('permissions', row, headers, rowd, PERMISSIONS_CHOICES_ALT_INDEX)
-        row = replace('language', row, headers, rowd, LANGUAGE_CHOICES_ALT_INDEX)
-        row = replace('genre', row, headers, rowd, GENRE_CHOICES_ALT_INDEX)
-        row = replace('format', row, headers, rowd, FORMAT_CHOICES_ALT_INDEX)
+    for fieldname,index in [
+            ('status', STATUS_CHOICES_ALT_INDEX),
+            ('permissions', PERMISSIONS_CHOICES_ALT_INDEX),
+            ('language', LANGUAGE_CHOICES_ALT_INDEX),
+            ('genre', GENRE_CHOICES_ALT_INDEX),
+            ('format', FORMAT_CHOICES_ALT_INDEX),
+    ]:
+        if fieldname not in headers:
+            continue
+        # one pass down the column; if value appears in index, it is a variant
+        col = headers.index(fieldname)
+        for row in rows:
+            if row[col] and index.get(row[col], None):
+                row[col] = index[row[col]]
     return rows
 
 
@@ -772,14 +764,16 @@ def import_files( csv_path, collection_path, git_name, git_mail ):
         
         #def prep_creators( data ): return [x.strip() for x in data.strip().split(';') if x]
         
-        # load entities - if any Entities are missing this will error out
-        bad_entities = test_entities(headers, rows)
+        # load entities and check source files, all at once
+        report = preflight(csv_dir, headers, rows)
+        bad_entities = report['bad_entities']
+        missing_files = report['missing_files']
+        unreadable_files = report['unreadable_files']
         if bad_entities:
             print('ONE OR MORE OBJECTS ARE COULD NOT BE LOADED! - IMPORT CANCELLED!')
             for f in bad_entities:
                 print('    %s' % f)
         # check for missing files
-        missing_files = find_missing_files(csv_dir, headers, rows)
         if missing_files:
             print('ONE OR MORE SOURCE FILES ARE MISSING! - IMPORT CANCELLED!')
             for f in missing_files:
@@ -787,7 +781,6 @@ def import_files( csv_path, collection_path, git_name, git_mail ):
         else:
             print('Source files present')
         # check for unreadable files
-        unreadable_files = find_unreadable_files(csv_dir, headers, rows)
         if unreadable_files:
             print('ONE OR MORE SOURCE FILES COULD NOT BE OPENED! - IMPORT CANCELLED!')
             for f in unreadable_files:
@@ -798,21 +791,19 @@ def import_files( csv_path, collection_path, git_name, git_mail ):
         
         # files are all accounted for, let's import
         if not (bad_entities or missing_files or unreadable_files):
-            print('Data file looks ok and files are present')
+            print('Data file looks ok and files are present (%s)' % humanize_bytes(report['bytes']))
             print('"$ tail -f /var/log/ddr/local.log" in a separate console for more details')
             started = datetime.now(settings.TZ)
             print('%s starting import' % started)
             print('')
             for n,row in enumerate(rows):
                 rowd = make_row_dict(headers, row)
-                entity_id = rowd.pop('entity_id')
-                repo,org,cid,eid = entity_id.split('-')
-                entity_path = Entity.entity_path(None, repo, org, cid, eid)
-                entity = Entity.from_json(entity_path)
+                # entities were loaded by preflight
+                entity = report['entities'][rowd.pop('entity_id')]
                 src_path = os.path.join(csv_dir, rowd.pop('basename_orig'))
                 role = rowd.pop('role')
                 rowstarted = datetime.now(settings.TZ)
-                print('%s %s/%s %s %s (%s)' % (dtfmt(rowstarted), n+1, len(rows), entity.id, src_path, humanize_bytes(os.path.getsize(src_path))))
+                print('%s %s/%s %s %s (%s)' % (dtfmt(rowstarted), n+1, len(rows), entity.id, src_path, humanize_bytes(report['sizes'][src_path])))
                 #print('add_file(%s, %s, %s, %s, %s, %s)' % (git_name, git_mail, entity, src_path, role, rowd))
                 entity.add_local_file( git_name, git_mail, src_path, role, rowd, agent=AGENT )
                 rowfinished = datetime.now(settings.TZ)
@@ -837,58 +828,134 @@ def export_csv_path( collection_path, model ):
     csv_path = os.path.join(CSV_TMPDIR, csv_filename)
     return csv_path
 
-def export_entities( collection_path, csv_path ):
+def export_functions( module, fields, form_only=False ):
+    """Resolves the csvexport_* function of each field, once per model
+    
+    Same result as calling DDR.modules.Module(module).function for each
+    field of each row, without making a Module every time.
+    
+    @param module: A repo_models module
+    @param fields: List of field dicts (module.FIELDS)
+    @param form_only: boolean Fields without 'form' are exported blank
+    @returns: list of (fieldname, function or None, boolean export)
+    """
+    table = []
+    for f in fields:
+        function = getattr(module, 'csvexport_%s' % f['name'], None)
+        table.append((
+            f['name'],
+            function if callable(function) else None,
+            bool(f.get('form', None)) or not form_only,
+        ))
+    return table
+
+EXPORT_TABLES = {}
+
+def export_table( model ):
+    """Cached function table for 'entity' or 'file'
+    
+    Entity 'files' are left out; they are in the files export.
+    """
+    if model not in EXPORT_TABLES:
+        if model == 'entity':
+            fields = [f for f in ENTITY_FIELDS if f['name'] != 'files']
+            EXPORT_TABLES[model] = export_functions(entitymodule, fields, form_only=True)
+        elif model == 'file':
+            EXPORT_TABLES[model] = export_functions(filemodule, FILE_FIELDS)
+    return EXPORT_TABLES[model]
+
+def export_row( obj, table ):
+    """Formats one object as a list of CSV values
+    
+    @param obj: Entity or File
+    @param table: list from export_functions
+    @returns: list of str
+    """
+    values = []
+    for name,function,export in table:
+        value = ''
+        if export and hasattr(obj, name):
+            value = getattr(obj, name)
+            # run csvexport_* functions on field data if present
+            if function:
+                value = function(value)
+            if not isinstance(value, str):
+                value = str(value)
+        values.append(value)
+    return values
+
+def _export_chunk( args ):
+    """Loads and formats a chunk of objects (runs in pool workers)
+    
+    @param args: (model, list of JSON paths)
+    @returns: list of rows; None for paths that could not be loaded
+    """
+    model,paths = args
+    table = export_table(model)
+    rows = []
+    for path in paths:
+        if model == 'entity':
+            obj = DDRLocalEntity.from_json(os.path.dirname(path))
+        else:
+            obj = DDRLocalFile.from_json(path)
+        if obj:
+            rows.append(export_row(obj, table))
+        else:
+            logger.error('NO FILE FOR %s' % path)
+            rows.append(None)
+    return rows
+
+def export_rows( model, paths, workers=None ):
+    """Yields CSV rows for paths, in order; objects are decoded in a process pool
+    
+    @param model: 'entity' or 'file'
+    @param paths: List of JSON paths
+    @param workers: int Pool size (default os.cpu_count()); 1 disables pool
+    """
+    chunks = [
+        (model, paths[n:n+EXPORT_CHUNK_SIZE])
+        for n in range(0, len(paths), EXPORT_CHUNK_SIZE)
+    ]
+    for rows in pool_map(_export_chunk, chunks, workers):
+        for row in rows:
+            if row is not None:
+                yield row
+
+def write_rows( csv_path, fieldnames, rows ):
+    """Writes header and rows through a large buffer
+    
+    @returns: int Number of rows written
+    """
+    n = 0
+    with open(csv_path, 'w', newline='', buffering=EXPORT_BUFFER_SIZE) as csvfile:
+        writer = make_csv_writer(csvfile)
+        writer.writerow(fieldnames)
+        for row in rows:
+            writer.writerow(row)
+            n += 1
+    return n
+
+def export_entities( collection_path, csv_path, workers=None ):
     """
     @param collection_path: Absolute path to collection repo.
     @param csv_path: Absolute path to CSV data file.
+    @param workers: int Pool size (default os.cpu_count()); 1 disables pool
     """
     started = datetime.now(settings.TZ)
-    print('%s starting import' % started)
+    print('%s starting export' % started)
     make_tmpdir(CSV_TMPDIR)
-    fieldnames = [field['name'] for field in entitymodule.ENTITY_FIELDS]
-    # exclude 'files' bc not hard to convert to CSV and not different from files export.
-    fieldnames.remove('files')
+    fieldnames = [name for name,function,export in export_table('entity')]
     print(fieldnames)
     paths = []
     for path in util.find_meta_files(basedir=collection_path, recursive=True):
         if os.path.basename(path) == 'entity.json':
             paths.append(path)
     
-    with open(csv_path, 'wb') as csvfile:
-        writer = make_csv_writer(csvfile)
-        # headers
-        writer.writerow(fieldnames)
-        # everything else
-        for n,path in enumerate(paths):
-            rowstarted = datetime.now(settings.TZ)
-            
-            entity_dir = os.path.dirname(path)
-            entity_id = os.path.basename(entity_dir)
-            entity = DDRLocalEntity.from_json(entity_dir)
-            # seealso DDR.modules.Module.function
-            values = []
-            for f in entitymodule.ENTITY_FIELDS:
-                value = ''
-                if hasattr(entity, f['name']) and f.get('form',None):
-                    key = f['name']
-                    label = f['form']['label']
-                    # run csvexport_* functions on field data if present
-                    val = modules.Module(entitymodule).function(
-                        'csvexport_%s' % key,
-                        getattr(entity, f['name'])
-                    )
-                    if not (isinstance(val, str) or isinstance(val, str)):
-                        val = str(val)
-                values.append(value)
-            writer.writerow(values)
-            
-            rowfinished = datetime.now(settings.TZ)
-            rowelapsed = rowfinished - rowstarted
-            print('%s %s/%s %s (%s)' % (dtfmt(rowfinished), n+1, len(paths), entity_id, rowelapsed))
+    n = write_rows(csv_path, fieldnames, export_rows('entity', paths, workers))
     
     finished = datetime.now(settings.TZ)
     elapsed = finished - started
-    print('%s DONE (%s entities)' % (dtfmt(finished), len(paths)))
+    print('%s DONE (%s entities)' % (dtfmt(finished), n))
     print('%s elapsed' % elapsed)
     if os.path.exists(csv_path):
         return csv_path
@@ -897,59 +964,27 @@ def export_entities( collection_path, csv_path ):
 
 # export files ---------------------------------------------------------
 
-def export_files( collection_path, csv_path ):
+def export_files( collection_path, csv_path, workers=None ):
     """
     @param collection_path: Absolute path to collection repo.
     @param csv_path: Absolute path to CSV data file.
+    @param workers: int Pool size (default os.cpu_count()); 1 disables pool
     """
     started = datetime.now(settings.TZ)
-    print('%s starting import' % started)
+    print('%s starting export' % started)
     make_tmpdir(CSV_TMPDIR)
-    fieldnames = [field['name'] for field in filemodule.FILE_FIELDS]
+    fieldnames = [name for name,function,export in export_table('file')]
     print(fieldnames)
     paths = []
     for path in util.find_meta_files(basedir=collection_path, recursive=True):
         if ('master' in path) or ('mezzanine' in path):
             paths.append(path)
     
-    with open(csv_path, 'wb') as csvfile:
-        writer = make_csv_writer(csvfile)
-        # headers
-        writer.writerow(fieldnames)
-        # everything else
-        for n,path in enumerate(paths):
-            rowstarted = datetime.now(settings.TZ)
-            
-            # load file object
-            filename = os.path.basename(path)
-            file_id = os.path.splitext(filename)[0]
-            file_ = DDRLocalFile.from_json(path)
-            if file_:
-                # seealso DDR.modules.Module.function
-                values = []
-                for f in filemodule.FILE_FIELDS:
-                    value = ''
-                    if hasattr(file_, f['name']):
-                        key = f['name']
-                        # run csvexport_* functions on field data if present
-                        val = modules.Module(filemodule).function(
-                            'csvexport_%s' % key,
-                            getattr(file_, f['name'])
-                        )
-                        if not (isinstance(val, str) or isinstance(val, str)):
-                            val = str(val)
-                    values.append(value)
-                writer.writerow(values)
-            
-                rowfinished = datetime.now(settings.TZ)
-                rowelapsed = rowfinished - rowstarted
-                print('%s %s/%s %s (%s)' % (dtfmt(rowfinished), n+1, len(paths), file_id, rowelapsed))
-            else:
-                print('NO FILE FOR %s' % path)
+    n = write_rows(csv_path, fieldnames, export_rows('file', paths, workers))
     
     finished = datetime.now(settings.TZ)
     elapsed = finished - started
-    print('%s DONE (%s files)' % (dtfmt(finished), len(paths)))
+    print('%s DONE (%s files)' % (dtfmt(finished), n))
     print('%s elapsed' % elapsed)
     if os.path.exists(csv_path):
         return csv_path
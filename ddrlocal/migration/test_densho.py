@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import types
+from unittest import mock
+
+from django.test import TestCase
+
+from migration import densho
+
+
+class FakeEntity(object):
+    """Stands in for webui.models.Entity: entities ending in 9 do not load
+    """
+    loaded = []
+
+    @staticmethod
+    def entity_path(request, repo, org, cid, eid):
+        return '/var/www/media/ddr/%s-%s-%s/files/%s-%s-%s-%s' % (
+            repo, org, cid, repo, org, cid, eid
+        )
+
+    @classmethod
+    def from_json(cls, entity_path):
+        cls.loaded.append(entity_path)
+        if entity_path.endswith('9'):
+            raise Exception('no entity.json')
+        return entity_path
+
+
+class Preflight(TestCase):
+
+    def setUp(self):
+        self.csv_dir = tempfile.mkdtemp()
+        for name,size in [('IMG_0001.TIF', 3), ('IMG_0002.TIF', 5)]:
+            with open(os.path.join(self.csv_dir, name), 'wb') as f:
+                f.write(b'x' * size)
+        # exists but cannot be opened as a file, even by root
+        os.makedirs(os.path.join(self.csv_dir, 'IMG_0003.TIF'))
+        self.headers = ['entity_id', 'basename_orig', 'role']
+        self.rows = [
+            ['ddr-test-123-1', 'IMG_0001.TIF', 'master'],
+            ['ddr-test-123-1', 'IMG_0001.TIF', 'mezzanine'],
+            ['ddr-test-123-2', 'IMG_0002.TIF', 'master'],
+            ['ddr-test-123-9', 'IMG_0003.TIF', 'master'],
+            ['ddr-test-123-2', 'IMG_0004.TIF', 'master'],
+        ]
+        FakeEntity.loaded = []
+
+    def tearDown(self):
+        shutil.rmtree(self.csv_dir)
+
+    def path(self, name):
+        return os.path.join(self.csv_dir, name)
+
+    def test_preflight(self):
+        with mock.patch('migration.densho.Entity', FakeEntity):
+            report = densho.preflight(self.csv_dir, self.headers, self.rows, workers=4)
+        # each entity and source is checked once
+        self.assertEqual(len(FakeEntity.loaded), 3)
+        self.assertEqual(sorted(report['entities'].keys()), ['ddr-test-123-1', 'ddr-test-123-2'])
+        self.assertEqual(report['bad_entities'], ['ddr-test-123-9'])
+        self.assertEqual(report['missing_files'], [self.path('IMG_0004.TIF')])
+        self.assertEqual(report['unreadable_files'], [self.path('IMG_0003.TIF')])
+        self.assertEqual(report['sizes'], {
+            self.path('IMG_0001.TIF'): 3, self.path('IMG_0002.TIF'): 5,
+        })
+        self.assertEqual(report['bytes'], 8)
+
+    def test_preflight_files_only(self):
+        with mock.patch('migration.densho.Entity', FakeEntity):
+            self.assertEqual(
+                densho.find_missing_files(self.csv_dir, self.headers, self.rows),
+                [self.path('IMG_0004.TIF')]
+            )
+            self.assertEqual(
+                densho.find_unreadable_files(self.csv_dir, self.headers, self.rows),
+                [self.path('IMG_0004.TIF'), self.path('IMG_0003.TIF')]
+            )
+        self.assertEqual(FakeEntity.loaded, [])
+
+
+class Export(TestCase):
+
+    def test_export_row(self):
+        # stands in for a repo_models module
+        module = types.SimpleNamespace(
+            csvexport_topics=lambda data: ';'.join(data),
+            csvexport_title='not a function',
+        )
+        fields = [
+            {'name': 'id', 'form': {'label': 'ID'}},
+            {'name': 'title', 'form': {'label': 'Title'}},
+            {'name': 'topics', 'form': {'label': 'Topics'}},
+            {'name': 'record_created'},
+            {'name': 'sort', 'form': {'label': 'Sort'}},
+            {'name': 'notes', 'form': {'label': 'Notes'}},
+        ]
+        obj = types.SimpleNamespace(
+            id='ddr-test-123-1', title='Title', topics=['a', 'b'],
+            record_created='2020-01-01', sort=3,
+        )
+        table = densho.export_functions(module, fields, form_only=True)
+        self.assertEqual(
+            [(name, function is not None, export) for name,function,export in table], [
+                ('id', False, True), ('title', False, True), ('topics', True, True),
+                ('record_created', False, False), ('sort', False, True), ('notes', False, True),
+            ]
+        )
+        # fields without form are blank, non-str values are str, missing attributes blank
+        self.assertEqual(
+            densho.export_row(obj, table),
+            ['ddr-test-123-1', 'Title', 'a;b', '', '3', '']
+        )
+        table = densho.export_functions(module, fields)
+        self.assertEqual(densho.export_row(obj, table)[3], '2020-01-01')
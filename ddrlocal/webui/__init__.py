@@ -11,6 +11,12 @@ COLLECTION_FETCH_TIMEOUT = 0
 COLLECTION_STATUS_TIMEOUT = 60 * 10
 COLLECTION_ANNEX_STATUS_TIMEOUT = 60 * 10
 
+SEARCH_AGGS_CACHE_KEY = 'webui:search:aggs:%s'
+SEARCH_AGGS_TIMEOUT = 60 * 10
+
+FS_DETAIL_CACHE_KEY = 'webui:fs:detail:%s'
+FS_DETAIL_TIMEOUT = 60 * 60
+
 
 WEBUI_MESSAGES = {
     
@@ -0,0 +1,315 @@
+"""
+access
+
+Makes access files (JPEG derivatives) for many master/mezzanine files at once.
+
+DDR makes an access file inline when a file is added, one image at a time.
+This module runs many jobs in parallel, for backfilling access files that
+are missing across a collection.  ImageMagick does the work in its own
+process so a thread pool is enough to keep several convert processes
+running; unlike a multiprocessing pool this also works inside daemonic
+Celery workers.
+
+A job is a dict {'src': path, 'dest': path, 'sha1': str, 'geometry': str}.
+- Identical jobs are run once.
+- Jobs for identical sources (same sha1 and geometry) generate once and copy.
+- Results are cached by source sha1 in STORE/tmp/access/ so running the
+  same job again (re-added file, retry of a failed backfill) only copies.
+  Cached files not used for CACHE_MAX_AGE are removed (see prune).
+
+>>> from webui import access
+>>> jobs = access.missing('/var/www/media/ddr/ddr-test-123')
+>>> results,stats = access.generate(jobs)
+>>> stats['formats']
+{'TIFF': {'files': 120, 'made': 118, 'cached': 2, 'errors': 0, 'MB': 5821.3, 'seconds': 402.1, 'files_per_sec': 0.3}, ...}
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import logging
+logger = logging.getLogger(__name__)
+import os
+import shutil
+import time
+
+from django.conf import settings
+
+from DDR import config
+from DDR import dvcs
+from DDR import imaging
+
+from webui import checksums
+from webui import gitstatus
+from webui.util import load_json
+
+# File roles that get access files
+ACCESS_ROLES = ['master', 'mezzanine']
+FORMATS = {
+    '.tif': 'TIFF', '.tiff': 'TIFF',
+    '.jpg': 'JPEG', '.jpeg': 'JPEG',
+    '.pdf': 'PDF',
+}
+# Paths per git annex add (command-line length)
+ANNEX_ADD_CHUNK = 500
+# Cached access files unused this long (seconds) are removed
+CACHE_MAX_AGE = 7 * 24 * 60 * 60
+
+
+def access_path(src_path):
+    """
+    >>> access_path('/var/www/media/ddr/ddr-test-123/files/ddr-test-123-4/files/ddr-test-123-4-master-a1b2c3d4e5.tif')
+    '/var/www/media/ddr/ddr-test-123/files/ddr-test-123-4/files/ddr-test-123-4-master-a1b2c3d4e5-a.jpg'
+    """
+    return '%s%s%s' % (
+        os.path.splitext(src_path)[0],
+        config.ACCESS_FILE_APPEND, config.ACCESS_FILE_EXTENSION
+    )
+
+def cache_dir(base_dir=None):
+    """
+    - STORE/tmp/access
+    """
+    return os.path.join(gitstatus.tmp_dir(base_dir or settings.MEDIA_BASE), 'access')
+
+def cache_path(sha1, geometry, base_dir=None):
+    """
+    - STORE/tmp/access/a1b2c3d4e5...-1a2b3c4d.jpg
+    """
+    return os.path.join(
+        cache_dir(base_dir),
+        '%s-%s%s' % (
+            sha1,
+            hashlib.md5(geometry.encode('utf-8')).hexdigest()[:8],
+            config.ACCESS_FILE_EXTENSION
+        )
+    )
+
+def prune(base_dir=None, max_age=CACHE_MAX_AGE):
+    """Remove cached access files not used for max_age seconds
+    
+    Also removes temp files left by interrupted convert runs.
+    """
+    now = time.time()
+    path = cache_dir(base_dir)
+    if not os.path.exists(path):
+        return
+    for filename in os.listdir(path):
+        cached = os.path.join(path, filename)
+        try:
+            if now - os.path.getmtime(cached) > max_age:
+                logger.debug('Removing old access file %s' % cached)
+                os.remove(cached)
+        except OSError:
+            # used or removed by another worker
+            pass
+
+def file_format(path):
+    """
+    >>> file_format('ddr-test-123-4-master-a1b2c3d4e5.tif')
+    'TIFF'
+    """
+    ext = os.path.splitext(path)[1].lower()
+    return FORMATS.get(ext, ext.replace('.', '').upper())
+
+def job(src_path, sha1=None, dest_path=None, geometry=None):
+    """Access file job; sha1 is computed if not given
+    
+    @param src_path: str Master or mezzanine binary
+    @param sha1: str (optional)
+    @param dest_path: str (optional) Defaults to DDR access filename
+    @param geometry: str (optional) Defaults to DDR config
+    @returns: dict
+    """
+    if not sha1:
+        sha1 = checksums.file_checksums(src_path, ['sha1'])['sha1']
+    return {
+        'src': src_path,
+        'dest': dest_path or access_path(src_path),
+        'sha1': sha1,
+        'geometry': geometry or config.ACCESS_FILE_GEOMETRY,
+    }
+
+def _copy(src, dest):
+    if not os.path.exists(os.path.dirname(dest)):
+        os.makedirs(os.path.dirname(dest))
+    shutil.copyfile(src, dest)
+
+def make(job, base_dir=None):
+    """Make one access file, from cache if possible
+    
+    @param job: dict
+    @param base_dir: str (optional) Defaults to settings.MEDIA_BASE
+    @returns: dict job plus 'status' (made, cached, error), 'seconds', 'error'
+    """
+    result = dict(job)
+    result['status'] = 'cached'
+    start = time.time()
+    cached = cache_path(job['sha1'], job['geometry'], base_dir)
+    try:
+        if not os.path.exists(cached):
+            result['status'] = 'made'
+            if not os.path.exists(os.path.dirname(cached)):
+                os.makedirs(os.path.dirname(cached), exist_ok=True)
+            # convert picks the output format from the extension
+            tmp = '%s.%s%s' % (
+                os.path.splitext(cached)[0], os.getpid(), config.ACCESS_FILE_EXTENSION
+            )
+            imaging.thumbnail(job['src'], tmp, job['geometry'])
+            if not (os.path.exists(tmp) and os.path.getsize(tmp)):
+                raise Exception('No access file made from %s' % job['src'])
+            os.rename(tmp, cached)
+        else:
+            # keep it from being pruned while it is in use
+            os.utime(cached)
+        _copy(cached, job['dest'])
+    except Exception as err:
+        logger.error('%s: %s' % (job['src'], err))
+        result['status'] = 'error'
+        result['error'] = str(err)
+    result['seconds'] = time.time() - start
+    return result
+
+def format_stats(results, elapsed=None):
+    """Throughput per source format
+    
+    seconds is the time spent on each format's jobs; with several workers
+    the jobs overlap, so files_per_sec is per worker.
+    
+    @param results: list of results from make()
+    @param elapsed: float (optional) Wall-clock seconds for the whole run
+    @returns: dict
+    """
+    formats = {}
+    for r in results:
+        f = formats.setdefault(file_format(r['src']), {
+            'files': 0, 'made': 0, 'cached': 0, 'errors': 0, 'bytes': 0, 'seconds': 0.0,
+        })
+        f['files'] += 1
+        f['made' if r['status'] == 'made' else 'cached' if r['status'] == 'cached' else 'errors'] += 1
+        if os.path.exists(r['src']):
+            f['bytes'] += os.path.getsize(r['src'])
+        f['seconds'] += r['seconds']
+    for f in formats.values():
+        f['MB'] = round(f.pop('bytes') / (1024.0 * 1024), 1)
+        f['files_per_sec'] = round(f['files'] / f['seconds'], 2) if f['seconds'] else None
+        f['seconds'] = round(f['seconds'], 2)
+    stats = {'formats': formats, 'files': len(results)}
+    if elapsed is not None:
+        stats['elapsed'] = round(elapsed, 2)
+        stats['files_per_sec'] = round(len(results) / elapsed, 2) if elapsed else None
+    return stats
+
+def generate(jobs, workers=None, progress=None, base_dir=None):
+    """Make access files for jobs in parallel
+    
+    Old files are pruned from the cache first.
+    
+    @param jobs: list of job dicts
+    @param workers: int Parallel convert processes (default os.cpu_count())
+    @param progress: webui.tasks.common.TaskProgress (optional)
+    @param base_dir: str (optional) Defaults to settings.MEDIA_BASE
+    @returns: (list of results, stats dict)
+    """
+    workers = workers or os.cpu_count() or 1
+    prune(base_dir)
+    # identical jobs run once; identical sources are made once
+    unique = {}
+    for j in jobs:
+        unique.setdefault((j['src'], j['dest'], j['geometry']), j)
+    groups = {}
+    for j in unique.values():
+        groups.setdefault((j['sha1'], j['geometry']), []).append(j)
+    
+    if progress:
+        progress.start('access', total=len(unique))
+    start = time.time()
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(make, group[0], base_dir): key
+            for key,group in groups.items()
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if progress:
+                progress.step()
+            for j in groups[futures[future]][1:]:
+                if result['status'] == 'error':
+                    results.append(dict(j, status='error', error=result['error'], seconds=0.0))
+                else:
+                    results.append(make(j, base_dir))
+                if progress:
+                    progress.step()
+    return results, format_stats(results, time.time() - start)
+
+def missing(collection_path):
+    """Jobs for files in the collection that have no access file
+    
+    Files whose binary is not present (e.g. annex content not copied)
+    are skipped.
+    
+    @param collection_path: str Absolute path to collection repo
+    @returns: list of job dicts
+    """
+    jobs = []
+    for dirpath,dirnames,filenames in os.walk(collection_path):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        if os.path.basename(dirpath) != 'files':
+            continue
+        binaries = {}
+        for filename in filenames:
+            stem,ext = os.path.splitext(filename)
+            if ext != '.json':
+                binaries[stem] = filename
+        for filename in filenames:
+            fid,ext = os.path.splitext(filename)
+            if (ext != '.json') or (fid not in binaries):
+                continue
+            if fid.split('-')[-2] not in ACCESS_ROLES:
+                continue
+            src_path = os.path.join(dirpath, binaries[fid])
+            if not os.path.exists(src_path) or os.path.exists(access_path(src_path)):
+                continue
+            data = load_json(os.path.join(dirpath, filename))
+            jobs.append(job(src_path, sha1=data.get('sha1')))
+    return jobs
+
+def backfill(collection, git_name, git_mail, agent='ddr-local', workers=None, progress=None, base_dir=None):
+    """Make missing access files for a collection and commit them together
+    
+    DDR finds access files by filename so file JSON is not changed.
+    
+    @param collection: webui.models.Collection
+    @param git_name: str
+    @param git_mail: str
+    @param agent: str
+    @param workers: int (optional)
+    @param progress: webui.tasks.common.TaskProgress (optional)
+    @param base_dir: str (optional) Defaults to settings.MEDIA_BASE
+    @returns: (list of results, stats dict)
+    """
+    if progress:
+        progress.start('find')
+    jobs = missing(collection.path)
+    results,stats = generate(
+        jobs, workers=workers, progress=progress, base_dir=base_dir
+    )
+    made = sorted([
+        os.path.relpath(r['dest'], collection.path)
+        for r in results if r['status'] != 'error'
+    ])
+    if made:
+        if progress:
+            progress.start('commit', total=len(made))
+        repo = dvcs.repository(collection.path)
+        for n in range(0, len(made), ANNEX_ADD_CHUNK):
+            repo.git.annex('add', *made[n:n+ANNEX_ADD_CHUNK])
+            if progress:
+                progress.step(len(made[n:n+ANNEX_ADD_CHUNK]))
+        repo.git.commit(
+            '--author=%s <%s>' % (git_name, git_mail),
+            '-m', 'Added %s access files\n\n@agent: %s' % (len(made), agent),
+        )
+    stats['committed'] = len(made)
+    return results,stats
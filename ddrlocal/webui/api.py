@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from collections import OrderedDict
+import hashlib
 import json
 import os
 
@@ -11,7 +12,10 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from django.conf import settings
-from django.http import HttpResponse
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 
 import elasticsearch_dsl
 
@@ -20,6 +24,8 @@ from webui import docstore
 from webui import identifier
 from webui import models
 from webui import search
+from webui import FS_DETAIL_CACHE_KEY
+from webui import FS_DETAIL_TIMEOUT
 
 
 DOCSTORE = docstore.Docstore()
@@ -36,6 +42,9 @@ DETAIL_EXCLUDE = [
     'id', 'model', 'collection_id',
 ]
 
+# Max number of objects in one api-fs-bulk request
+FS_BULK_MAX = 1000
+
 
 @api_view(['GET'])
 def index(request, format=None):
@@ -45,6 +54,9 @@ def index(request, format=None):
     data['browse (filesystem)'] = reverse('api-fs-detail', args=(['ddr']), request=request)
     data['browse (elasticsearch)'] = reverse('api-es-detail', args=(['ddr']), request=request)
     data['search (elasticsearch)'] = reverse('api-search', args=(), request=request)
+    data['search facets (elasticsearch)'] = reverse('api-search-facets', args=(), request=request)
+    data['search export (elasticsearch)'] = reverse('api-search-export', args=(), request=request)
+    data['bulk (filesystem)'] = reverse('api-fs-bulk', args=(), request=request)
     return Response(data)
 
 
@@ -62,14 +74,34 @@ def ui_state(request):
     return Http404()
 
 
-@api_view(['GET'])
-def fs_detail(request, oid, format=None):
-    """Object detail (filesystem)
+def _fs_stat(oi):
+    """os.stat of object JSON, or None if it does not exist
     """
-    oi = identifier.Identifier(oid)
-    if not os.path.exists(oi.path_abs('json')):
-        return Response(status=status.HTTP_404_NOT_FOUND)
+    try:
+        return os.stat(oi.path_abs('json'))
+    except OSError:
+        return None
+
+def _fs_etag(oi, st):
+    """ETag for object JSON based on (path, mtime, size)
+    """
+    text = '%s:%s:%s' % (oi.path_abs('json'), st.st_mtime_ns, st.st_size)
+    return '"%s"' % hashlib.md5(text.encode('utf-8')).hexdigest()
+
+def _fs_data(oi, st):
+    """Object JSON flattened into an OrderedDict, without links
     
+    Cached by (path, mtime, size) so a changed file is never served
+    from cache and unchanged files are not re-read or re-parsed.
+    
+    @param oi: Identifier
+    @param st: os.stat_result
+    @returns: OrderedDict
+    """
+    key = FS_DETAIL_CACHE_KEY % _fs_etag(oi, st).strip('"')
+    data = cache.get(key)
+    if data is not None:
+        return data
     data = OrderedDict()
     # these fields are always at the top
     data['id'] = oi.id
@@ -93,10 +125,75 @@ def fs_detail(request, oid, format=None):
         elif isinstance(d, dict):
             for key,val in d.items():
                 data[key] = val
+    cache.set(key, data, FS_DETAIL_TIMEOUT)
+    return data
+
+def _fs_detail(oi, st, request):
+    data = _fs_data(oi, st)
     # didn't have the data we need before
     data['links'] = models.make_links(
         oi, data, request, source='fs', is_detail=True
     )
+    return data
+
+@api_view(['GET'])
+def fs_detail(request, oid, format=None):
+    """Object detail (filesystem)
+    
+    Supports conditional requests (If-None-Match, If-Modified-Since).
+    """
+    oi = identifier.Identifier(oid)
+    st = _fs_stat(oi)
+    if not st:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+    etag = _fs_etag(oi, st)
+    last_modified = int(st.st_mtime)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response:
+        return response
+    response = Response(_fs_detail(oi, st, request))
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+@api_view(['GET', 'POST'])
+def fs_bulk(request, format=None):
+    """Details for many objects in one request (filesystem)
+    
+    GET:  ?ids=ddr-densho-10,ddr-densho-10-1
+    POST: {"ids": ["ddr-densho-10", "ddr-densho-10-1"]}
+    
+    Returns {id: object detail} in order requested;
+    objects that do not exist are null.
+    """
+    if request.method == 'POST':
+        oids = search.list_param(request.data.get('ids'))
+    else:
+        oids = search.list_param(request.GET.get('ids'))
+    if not oids:
+        return Response(
+            {'error': 'ids is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(oids) > FS_BULK_MAX:
+        return Response(
+            {'error': 'Max %s ids per request' % FS_BULK_MAX},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    data = OrderedDict()
+    for oid in oids:
+        try:
+            oi = identifier.Identifier(oid)
+        except:
+            data[oid] = None
+            continue
+        st = _fs_stat(oi)
+        if st:
+            data[oid] = _fs_detail(oi, st, request)
+        else:
+            data[oid] = None
     return Response(data)
 
 @api_view(['GET'])
@@ -150,6 +247,35 @@ def es_children(request, oid, limit=None, offset=None):
     )
     return Response(data)
 
+def es_children_export(request, oid):
+    """Stream all children of object as newline-delimited JSON (Elasticsearch)
+    
+    Unlike api-es-children this is not paged; every child is returned
+    in a single response, read from an Elasticsearch scroll.
+    
+    fields - comma-separated list of fields to return (default: all)
+    """
+    oi = identifier.Identifier(oid)
+    try:
+        child_models = oi.child_models(stubs=False)
+    except:
+        child_models = oi.child_models(stubs=True)
+    
+    s = elasticsearch_dsl.Search(
+        using=DOCSTORE.es,
+        index=[DOCSTORE.index_name(model) for model in child_models]
+    )
+    s = s.query("match", parent_id=oi.id)
+    return _ndjson_response(s, search.list_param(request.GET.get('fields')))
+
+def _ndjson_response(s, fields=[]):
+    """StreamingHttpResponse with documents from Search as NDJSON
+    """
+    return StreamingHttpResponse(
+        search.scan_ndjson(s, fields),
+        content_type=search.NDJSON_CONTENT_TYPE
+    )
+
 
 SEARCH_HELP_FULLTEXT = 'Search string using Elasticsearch query_string syntax.'
 SEARCH_HELP_TOPICS   = 'Topic term ID(s) from http://partner.densho.org/vocab/api/0.2/topics.json.'
@@ -253,6 +379,15 @@ class Search(APIView):
         offset = reget(request, 'offset')
         limit = reget(request, 'limit')
         page = reget(request, 'page')
+        # aggregations are expensive and not needed to page through
+        # results; clients should use api-search-facets instead
+        aggs = reget(request, 'aggs') or search.AGGS_NONE
+        facets = search.list_param(reget(request, 'facets'))
+        if aggs not in search.AGGS_POLICIES:
+            return Response(
+                {'error': 'aggs must be one of: %s' % ', '.join(search.AGGS_POLICIES)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         if offset:
             # limit and offset args take precedence over page
@@ -275,16 +410,64 @@ class Search(APIView):
             fields=search.SEARCH_INCLUDE_FIELDS,
             fields_nested=search.SEARCH_NESTED_FIELDS,
             fields_agg=search.SEARCH_AGG_FIELDS,
+            aggs=aggs,
+            aggs_requested=facets,
         )
         results = searcher.execute(limit, offset)
         results_dict = results.ordered_dict(
             request=request,
             format_functions=models.FORMATTERS,
         )
-        results_dict.pop('aggregations')
+        if aggs == search.AGGS_NONE:
+            results_dict.pop('aggregations')
         return Response(results_dict)
 
 
+def search_export(request):
+    """Stream all results of a search as newline-delimited JSON
+    
+    Takes the same query params as api-search but is not paged; every
+    matching document is returned in a single response, read from an
+    Elasticsearch scroll.  Sort params are ignored.
+    
+    fields - comma-separated list of fields to return (default: all)
+    """
+    if not request.GET.get('fulltext'):
+        return HttpResponse(
+            json.dumps({'error': 'fulltext is required'}),
+            content_type="application/json",
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    searcher = search.Searcher()
+    searcher.prepare(
+        params=request.GET.dict(),
+        params_whitelist=search.SEARCH_PARAM_WHITELIST,
+        search_models=search.SEARCH_MODELS,
+        fields=search.SEARCH_INCLUDE_FIELDS,
+        fields_nested=search.SEARCH_NESTED_FIELDS,
+        fields_agg=search.SEARCH_AGG_FIELDS,
+        aggs=search.AGGS_NONE,
+    )
+    return _ndjson_response(
+        searcher.s, search.list_param(request.GET.get('fields'))
+    )
+
+@api_view(['GET'])
+def search_facets(request, format=None):
+    """Facet counts (aggregations) for a search
+    
+    Takes the same query params as api-search.  Pagination and sort
+    params are ignored, and results are cached so that paging through
+    a search does not recompute facet counts.
+    """
+    params = request.query_params.dict()
+    response = Response(
+        search.cached_aggregations(params, search.SEARCH_MODELS)
+    )
+    patch_cache_control(response, max_age=search.SEARCH_AGGS_TIMEOUT)
+    return response
+
+
 @api_view(['GET'])
 def object_nodes(request, object_id):
     return files(request._request, object_id)
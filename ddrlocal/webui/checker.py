@@ -0,0 +1,201 @@
+"""
+checker
+
+Validates a collection's metadata files in parallel.
+
+Paths are split into chunks and validated by a process pool.  Errors are
+written to a JSON-lines report in the Store's tmp/ dir (next to the
+gitstatus files) as soon as each chunk comes back.
+
+In incremental mode only files that changed since they last passed a check
+are validated.  Files are keyed by git blob sha (from the index), so a
+file that has been committed unchanged is skipped.  Modified or untracked
+files are always validated.  Validation depends on the model definitions
+and ddr-cmdln too, so the state is discarded when either commit changes.
+
+Report format (one JSON object per line):
+    {"type": "error", "path": "ddr-test-123-1/entity.json", "error": "..."}
+    ...
+    {"type": "summary", "collection_id": "ddr-test-123", "checked": 123, ...}
+
+>>> from webui import checker
+>>> checker.check_collection('/var/www/media/ddr/ddr-test-123', incremental=True)
+{'collection_id': 'ddr-test-123', 'checked': 12, 'skipped': 4321, 'errors': 0, ...}
+"""
+
+from datetime import datetime
+import json
+import logging
+logger = logging.getLogger(__name__)
+import os
+
+from django.conf import settings
+
+from DDR import converters
+from DDR import dvcs
+from DDR import util
+
+from webui import gitstatus
+from webui.util import chunked, pool_map
+
+# Number of files validated by a worker at a time
+CHECK_CHUNK_SIZE = 500
+# Max error lines returned in the summary (all are in the report)
+CHECK_SUMMARY_ERRORS = 100
+
+
+def report_path(base_dir, collection_path):
+    """
+    - STORE/tmp/ddr-test-123.check.jsonl
+    """
+    return os.path.join(
+        gitstatus.tmp_dir(base_dir),
+        '%s.check.jsonl' % os.path.basename(os.path.normpath(collection_path))
+    )
+
+def state_path(base_dir, collection_path):
+    """Blob shas of files that passed their last check
+    
+    - STORE/tmp/ddr-test-123.check.json
+    """
+    return os.path.join(
+        gitstatus.tmp_dir(base_dir),
+        '%s.check.json' % os.path.basename(os.path.normpath(collection_path))
+    )
+
+def state_versions():
+    """Commits of the code a check depends on
+    """
+    return {
+        'defs': dvcs.APP_COMMITS.get('def'),
+        'cmd': dvcs.APP_COMMITS.get('cmd'),
+    }
+
+def read_state(base_dir, collection_path):
+    """
+    @returns: dict {relpath: blob_sha}, empty if checked with other versions
+    """
+    path = state_path(base_dir, collection_path)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            try:
+                data = json.loads(f.read())
+            except ValueError:
+                return {}
+        if data.get('versions') == state_versions():
+            return data.get('files', {})
+    return {}
+
+def write_state(base_dir, collection_path, state):
+    with open(state_path(base_dir, collection_path), 'w') as f:
+        f.write(json.dumps({'versions': state_versions(), 'files': state}))
+
+def blob_shas(collection_path):
+    """Blob shas of committed, unmodified JSON files
+    
+    Uses the git index (ls-files --stage) so no file contents are read.
+    Files modified in the working tree are left out.
+    
+    @param collection_path: str
+    @returns: dict {relpath: blob_sha}
+    """
+    repo = dvcs.repository(collection_path)
+    shas = {}
+    for line in repo.git.ls_files('--stage', '--', '*.json').splitlines():
+        # <mode> <sha> <stage>\t<path>
+        info,relpath = line.split('\t', 1)
+        shas[relpath] = info.split()[1]
+    for relpath in repo.git.ls_files('--modified', '--', '*.json').splitlines():
+        shas.pop(relpath, None)
+    return shas
+
+def _validate_chunk(paths):
+    """Validate a chunk of paths; runs in a pool worker
+    
+    @param paths: list of absolute paths
+    @returns: (paths, list of (path, err))
+    """
+    return paths, [
+        (path, str(err))
+        for n,path,err in util.validate_paths(paths)
+    ]
+
+def check_collection(collection_path, incremental=False, workers=None, progress=None, base_dir=None, chunk_size=CHECK_CHUNK_SIZE):
+    """Validate collection metadata files, writing errors to report
+    
+    @param collection_path: str Absolute path to collection repo
+    @param incremental: bool Skip files unchanged since they last passed
+    @param workers: int Pool size (default os.cpu_count()); 1 disables pool
+    @param progress: webui.tasks.common.TaskProgress (optional)
+    @param base_dir: str (optional) Defaults to settings.MEDIA_BASE
+    @param chunk_size: int Files per pool job
+    @returns: dict summary
+    """
+    if not base_dir:
+        base_dir = settings.MEDIA_BASE
+    workers = workers or os.cpu_count() or 1
+    collection_id = os.path.basename(os.path.normpath(collection_path))
+    started = datetime.now(settings.TZ)
+    
+    if progress:
+        progress.start('find')
+    paths = util.find_meta_files(
+        collection_path, recursive=1,
+        model=None, files_first=False, force_read=False
+    )
+    shas = {}
+    try:
+        shas = blob_shas(collection_path)
+    except Exception as err:
+        # not a git repo etc: check everything, remember nothing
+        logger.error('Could not get blob shas for %s: %s' % (collection_path, err))
+    relpath = lambda path: os.path.relpath(path, collection_path)
+    passed = read_state(base_dir, collection_path) if incremental else {}
+    todo = [
+        path for path in paths
+        if not (passed.get(relpath(path)) and (passed[relpath(path)] == shas.get(relpath(path))))
+    ]
+    
+    if progress:
+        progress.start('validate', total=len(todo))
+    chunks = list(chunked(todo, chunk_size))
+    errors = []
+    state = {
+        rel: sha for rel,sha in passed.items()
+        if shas.get(rel) == sha
+    }
+    with open(report_path(base_dir, collection_path), 'w') as report:
+        for chunk,bad in pool_map(_validate_chunk, chunks, workers, ordered=False):
+            bad_paths = set(path for path,err in bad)
+            for path,err in bad:
+                errors.append((relpath(path), err))
+                report.write(json.dumps({
+                    'type': 'error', 'path': relpath(path), 'error': err,
+                }) + '\n')
+            report.flush()
+            for path in chunk:
+                rel = relpath(path)
+                if (path not in bad_paths) and shas.get(rel):
+                    state[rel] = shas[rel]
+            if progress:
+                progress.step(len(chunk))
+        summary = {
+            'type': 'summary',
+            'collection_id': collection_id,
+            'incremental': incremental,
+            'started': converters.datetime_to_text(started),
+            'finished': converters.datetime_to_text(datetime.now(settings.TZ)),
+            'files': len(paths),
+            'checked': len(todo),
+            'skipped': len(paths) - len(todo),
+            'errors': len(errors),
+        }
+        report.write(json.dumps(summary) + '\n')
+    write_state(base_dir, collection_path, state)
+    summary.pop('type')
+    summary['report'] = report_path(base_dir, collection_path)
+    summary['bad_files'] = [
+        '%s ERROR %s' % (path, err)
+        for path,err in sorted(errors)[:CHECK_SUMMARY_ERRORS]
+    ]
+    return summary
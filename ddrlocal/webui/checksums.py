@@ -0,0 +1,151 @@
+"""
+checksums
+
+Computes several file checksums in a single read.
+
+DDR.util.file_hash reads the whole file once per algorithm, in small
+blocks.  For a multi-gigabyte master file on a USB Store that is three
+slow passes (md5, sha1, sha256).  file_checksums reads the file once into
+large reusable buffers, feeds every digest from the same buffer, and reads
+the next chunk while the digests of the current one are computed.
+hashlib releases the GIL for large buffers so the digests run in parallel.
+
+Checksums computed while a file is written (e.g. by webui.uploads) can be
+saved next to it with save_checksums; known_checksums returns them as long
+as the file's size and mtime have not changed, so it is not read again.
+
+>>> from webui import checksums
+>>> checksums.file_checksums('/tmp/IMG_0001.TIF')
+{'size': 12345678, 'md5': '...', 'sha1': '...', 'sha256': '...'}
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import mmap
+import os
+
+CHECKSUM_ALGORITHMS = ['md5', 'sha1', 'sha256']
+# Read size; a multiple of the page size (and of disk block sizes)
+CHECKSUM_CHUNK_SIZE = 4 * 1024 * 1024
+# Saved checksums of FILE are in FILE.checksums.json
+CHECKSUMS_SUFFIX = '.checksums.json'
+
+
+class MultiHash(object):
+    """Feeds the same data to several hashlib digests
+    
+    >>> h = MultiHash(['md5', 'sha1'])
+    >>> h.update(b'abc')
+    >>> h.hexdigests()
+    {'size': 3, 'md5': '900150983cd24fb0d6963f7d28e17f72', 'sha1': 'a9993e364706816aba3e25717850c26c9cd0d89d'}
+    
+    @param algorithms: list of hashlib algorithm names
+    @param pool: concurrent.futures.Executor (optional) Update digests in parallel
+    """
+    
+    def __init__(self, algorithms=CHECKSUM_ALGORITHMS, pool=None):
+        self.algorithms = list(algorithms)
+        self.hashes = [hashlib.new(algorithm) for algorithm in self.algorithms]
+        self.pool = pool
+        self.size = 0
+    
+    def update(self, data):
+        self.size += len(data)
+        if self.pool:
+            for future in [self.pool.submit(h.update, data) for h in self.hashes]:
+                future.result()
+        else:
+            for h in self.hashes:
+                h.update(data)
+    
+    def update_async(self, data):
+        """Start updating digests; returns list of futures (pool only)
+        """
+        self.size += len(data)
+        return [self.pool.submit(h.update, data) for h in self.hashes]
+    
+    def hexdigests(self):
+        data = {'size': self.size}
+        for algorithm,h in zip(self.algorithms, self.hashes):
+            data[algorithm] = h.hexdigest()
+        return data
+
+
+def _read_buffered(f, hashes, chunk_size):
+    """Double-buffered: read the next chunk while hashing this one
+    """
+    buffers = [bytearray(chunk_size), bytearray(chunk_size)]
+    n = 0
+    length = f.readinto(buffers[n])
+    while length:
+        view = memoryview(buffers[n])[:length]
+        futures = hashes.update_async(view)
+        n = 1 - n
+        length = f.readinto(buffers[n])
+        for future in futures:
+            future.result()
+
+def _read_mmap(f, hashes, chunk_size):
+    size = os.fstat(f.fileno()).st_size
+    if not size:
+        return
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        if hasattr(m, 'madvise'):
+            m.madvise(mmap.MADV_SEQUENTIAL)
+        view = memoryview(m)
+        try:
+            for offset in range(0, size, chunk_size):
+                hashes.update(view[offset:offset+chunk_size])
+        finally:
+            view.release()
+
+def file_checksums(path, algorithms=CHECKSUM_ALGORITHMS, chunk_size=CHECKSUM_CHUNK_SIZE, use_mmap=False):
+    """Size and checksums of a file, reading it once
+    
+    @param path: str
+    @param algorithms: list of hashlib algorithm names
+    @param chunk_size: int Bytes per read
+    @param use_mmap: bool Map the file instead of reading into buffers
+    @returns: dict {'size': int, algorithm: hexdigest, ...}
+    """
+    with ThreadPoolExecutor(max_workers=len(algorithms)) as pool:
+        hashes = MultiHash(algorithms, pool=pool)
+        with open(path, 'rb', buffering=0) as f:
+            if use_mmap:
+                _read_mmap(f, hashes, chunk_size)
+            else:
+                _read_buffered(f, hashes, chunk_size)
+    return hashes.hexdigests()
+
+def save_checksums(path, data):
+    """Save size and checksums of a file next to it
+    
+    @param path: str
+    @param data: dict {'size': int, algorithm: hexdigest, ...}
+    """
+    data = dict(data)
+    data['mtime'] = os.path.getmtime(path)
+    with open(path + CHECKSUMS_SUFFIX, 'w') as f:
+        f.write(json.dumps(data))
+
+def known_checksums(path, algorithms=CHECKSUM_ALGORITHMS):
+    """Saved checksums of a file, if it has not changed since; else None
+    
+    >>> known_checksums('/tmp/IMG_0001.TIF') or file_checksums('/tmp/IMG_0001.TIF')
+    
+    @param path: str
+    @param algorithms: list of hashlib algorithm names that must be present
+    @returns: dict {'size': int, algorithm: hexdigest, ...} or None
+    """
+    try:
+        with open(path + CHECKSUMS_SUFFIX, 'r') as f:
+            data = json.loads(f.read())
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    if (data.get('size') != stat.st_size) or (data.pop('mtime', None) != stat.st_mtime):
+        return None
+    if [algorithm for algorithm in algorithms if algorithm not in data]:
+        return None
+    return data
@@ -34,6 +34,7 @@ def sitewide(request):
         'git_mail': request.session.get('git_mail', None),
         'celery_tasks': tasks_common.session_tasks_list(request),
         'celery_status_url': reverse("webui-task-status"),
+        'celery_events_url': reverse("webui-task-events"),
         'celery_status_update': request.session.get('celery_status_update', False),
         'STATIC_URL': settings.STATIC_URL,
         'supervisord_url': settings.SUPERVISORD_URL,
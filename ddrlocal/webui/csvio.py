@@ -1,47 +1,357 @@
 import csv
+import hashlib
+import json
 import logging
 logger = logging.getLogger(__name__)
+import os
 from pathlib import Path
+import re
+import shutil
+import sqlite3
+import tempfile
 
 from django.conf import settings
 from django.urls import reverse
 
 from DDR.batch import Exporter, Importer
+from DDR import changelog
 from DDR import commands
 from DDR import dvcs
-from DDR import fileio
-from DDR import util
+
+from webui import checker
+from webui import checksums
+from webui import gitstatus
+from webui import vocabs
+from webui.identifier import Identifier, MODULES
+from webui.util import chunked, pool_map
 
 CSV_MODELS = {'entity':'objects', 'file':'files'}
 
-CSV_IMPORT_FILE = '/tmp/import-{cid}-{model}.csv'
+# Objects formatted by a worker at a time
+EXPORT_CHUNK_SIZE = 200
+# Chunks in flight per worker; bounds memory when the reader is slow
+EXPORT_CHUNKS_AHEAD = 2
+# Rows validated or built by a worker at a time
+IMPORT_CHUNK_SIZE = 250
+# Dry-run plan of FILE.csv is saved in FILE.csv.import-MODEL.json
+PLAN_SUFFIX = '.import-%s.json'
+# Paths per git add (command-line length)
+IMPORT_ADD_CHUNK = 500
+# Reads of each new file by DDR's importer to hash it (sha1, sha256, md5)
+IMPORT_HASH_READS = 3
+# Object models each import model may name in its id column
+IMPORT_ID_MODELS = {
+    'entity': ['entity', 'segment'],
+    'file': ['file', 'file-role'],
+}
+# Fields that are computed rather than imported
+REQUIRED_FIELDS_EXCEPTIONS = {
+    'entity': ['record_created', 'record_lastmod', 'files',],
+    'file': ['thumb', 'sha1', 'sha256', 'md5', 'size', 'access_rel', 'xmp', 'links'],
+}
 
 
-def export_to_csv(collection, model, logger=logger):
-    """Write collection to CSV, then read
+def _walk_sorted(path):
+    """Yield file paths under path in sorted order, without listing it all
+    
+    Same order as sorting the full list of paths.
     """
-    logger.info('All paths in %s' % collection.path_abs)
-    paths = util.find_meta_files(
-        basedir=collection.path_abs, model=model, recursive=1, force_read=1
+    entries = sorted(
+        os.scandir(path),
+        key=lambda e: e.name + ('/' if e.is_dir() else '')
     )
-    logger.info('Exporting %s paths' % len(paths))
+    for entry in entries:
+        if entry.name.startswith('.'):
+            continue
+        if entry.is_dir():
+            yield from _walk_sorted(entry.path)
+        else:
+            yield entry.path
+
+def meta_paths(collection_path, model):
+    """Yield metadata JSON paths for model, lazily, in sorted order
+    
+    @param collection_path: str
+    @param model: str 'entity' or 'file'
+    """
+    for path in _walk_sorted(collection_path):
+        dirname,filename = os.path.split(path)
+        if model == 'entity':
+            if filename == 'entity.json':
+                yield path
+        elif filename.endswith('.json') and (os.path.basename(dirname) == 'files'):
+            yield path
+
+def export_key(collection_path, model):
+    """Everything an export depends on
+    
+    Model definitions and ddr-cmdln decide the columns and formatting;
+    the collection's HEAD and working tree decide the rows.
+    
+    @param collection_path: str
+    @param model: str 'entity' or 'file'
+    @returns: dict
+    """
+    repo = dvcs.repository(collection_path)
+    return {
+        'collection_id': os.path.basename(os.path.normpath(collection_path)),
+        'model': model,
+        'commit': repo.git.rev_parse('HEAD'),
+        'defs': dvcs.APP_COMMITS.get('def'),
+        'cmd': dvcs.APP_COMMITS.get('cmd'),
+        'changes': changes_digest(repo, collection_path),
+    }
+
+def changes_digest(repo, collection_path):
+    """Hash of uncommitted changes, paths and content
+    
+    git status only lists paths, so editing a file that is already
+    modified would not change it.  The content of each modified or
+    untracked JSON file is hashed as well.
+    
+    @param repo: GitPython Repo
+    @param collection_path: str
+    @returns: str or None if the working tree is clean
+    """
+    status = repo.git.status('--porcelain')
+    if not status:
+        return None
+    h = hashlib.sha1(status.encode('utf-8'))
+    changed = repo.git.ls_files('--modified', '--others', '--exclude-standard')
+    for relpath in sorted(set(changed.splitlines())):
+        path = os.path.join(collection_path, relpath)
+        if relpath.endswith('.json') and os.path.isfile(path):
+            h.update(relpath.encode('utf-8'))
+            with open(path, 'rb') as f:
+                h.update(hashlib.sha1(f.read()).digest())
+    return h.hexdigest()
+
+def key_path(path):
+    """Export key is kept next to the CSV file
+    """
+    return path.with_name(path.name + '.key')
+
+def cached_export(collection, model):
+    """Path to existing export if the collection has not changed since
+    
+    @param collection: Collection
+    @param model: str 'entity' or 'file'
+    @returns: Path or None
+    """
     path = csv_path(collection, model)
-    result = Exporter.export(
-        paths, model, path, required_only=False
-    )
-    logger.info(result)
-    return path
+    kpath = key_path(path)
+    if not (path.exists() and kpath.exists()):
+        return None
+    try:
+        key = json.loads(kpath.read_text())
+    except ValueError:
+        return None
+    if key == export_key(collection.path_abs, model):
+        return path
+    return None
 
-def csv_rows(path):
-    """Read CSV from filesystem and write to HttpResponse
+def rows_db_path(base_dir, collection_path, model):
+    """Cache of formatted rows for incremental exports
     
-    See https://docs.djangoproject.com/en/3.0/howto/outputting-csv/
+    - STORE/tmp/ddr-test-123.csv-entity.db
+    """
+    return os.path.join(
+        gitstatus.tmp_dir(base_dir),
+        '%s.csv-%s.db' % (os.path.basename(os.path.normpath(collection_path)), model)
+    )
+
+def rows_connect(path, version):
+    """Open rows cache; emptied if formatting may have changed
     
     @param path: str
-    @param response: HttpResponse
-    @returns: HttpResponse
+    @param version: str Model definitions and ddr-cmdln commits
+    @returns: sqlite3.Connection
+    """
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)'
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS rows (path TEXT PRIMARY KEY, sha TEXT, row TEXT)'
+    )
+    found = conn.execute("SELECT value FROM meta WHERE key='version'").fetchone()
+    if (not found) or (found[0] != version):
+        with conn:
+            conn.execute('DELETE FROM rows')
+            conn.execute('DELETE FROM meta')
+            conn.execute("INSERT INTO meta VALUES ('version', ?)", (version,))
+    return conn
+
+def _split_rows(text):
+    """Split CSV text into the raw text of each row
+    
+    Rows may contain newlines, so let csv find the row boundaries.
+    """
+    lines = iter(re.split(r'(?<=\n)', text))
+    consumed = []
+    def feed():
+        for line in lines:
+            if line:
+                consumed.append(line)
+                yield line
+    rows = []
+    for record in csv.reader(feed()):
+        rows.append(''.join(consumed))
+        del consumed[:]
+    return rows
+
+def _export_chunk(args):
+    """Format a chunk of objects with DDR Exporter
+    
+    With a row cache, only objects without a cached row are exported and
+    the raw text of each new row is returned so it can be cached.
+    
+    @param args: (list of json paths, model, dict {path: row} or None)
+    @returns: (number of paths, header line or None, CSV text of rows, dict {path: row})
     """
-    return fileio.read_csv(path)
+    paths,model,cached = args
+    todo = [path for path in paths if path not in (cached or {})]
+    if paths and not todo:
+        return len(paths), None, ''.join(cached[path] for path in paths), {}
+    fd,tmp = tempfile.mkstemp(prefix='ddrlocal-export-', suffix='.csv')
+    os.close(fd)
+    try:
+        Exporter.export(todo, model, tmp, required_only=False)
+        with open(tmp, 'r', encoding='utf-8', newline='') as f:
+            # field names have no newlines so the header is one line
+            header = f.readline()
+            body = f.read()
+    finally:
+        os.remove(tmp)
+    if cached is None:
+        return len(paths), header, body, {}
+    rows = _split_rows(body)
+    if len(rows) != len(todo):
+        # rows do not line up with paths; cannot merge or cache
+        if len(todo) == len(paths):
+            return len(paths), header, body, {}
+        return _export_chunk((paths, model, {}))
+    new = dict(zip(todo, rows))
+    return len(paths), header, ''.join(cached.get(path) or new[path] for path in paths), new
+
+def export_rows(collection_path, model, workers=None, chunk_size=EXPORT_CHUNK_SIZE, progress=None, rows_db=None):
+    """Yield collection metadata as CSV text: header, then blocks of rows
+    
+    Walks the collection lazily and formats chunks of objects in a
+    process pool, in order.  Memory use does not grow with the size of
+    the collection.  Suitable for StreamingHttpResponse.
+    
+    With rows_db, formatted rows are cached by git blob sha and only
+    objects changed since the last export are formatted again.
+    
+    >>> for text in export_rows('/var/www/media/ddr/ddr-test-123', 'entity'):
+    ...     out.write(text)
+    
+    @param collection_path: str
+    @param model: str 'entity' or 'file'
+    @param workers: int Pool size (default os.cpu_count()); 1 disables pool
+    @param chunk_size: int
+    @param progress: webui.tasks.common.TaskProgress (optional)
+    @param rows_db: str (optional) Path to rows cache (see rows_db_path)
+    """
+    workers = workers or os.cpu_count() or 1
+    conn = None
+    shas = {}
+    if rows_db:
+        conn = rows_connect(rows_db, '%s %s' % (
+            dvcs.APP_COMMITS.get('def'), dvcs.APP_COMMITS.get('cmd')
+        ))
+        shas = checker.blob_shas(collection_path)
+    
+    def relpath(path):
+        return os.path.relpath(path, collection_path)
+    
+    def cached_rows(chunk):
+        if not conn:
+            return None
+        rows = {}
+        for path in chunk:
+            sha = shas.get(relpath(path))
+            if sha:
+                found = conn.execute(
+                    'SELECT row FROM rows WHERE path=? AND sha=?', (relpath(path), sha)
+                ).fetchone()
+                if found:
+                    rows[path] = found[0]
+        return rows
+    
+    chunks = (
+        (chunk, model, cached_rows(chunk))
+        for chunk in chunked(meta_paths(collection_path, model), chunk_size)
+    )
+    results = pool_map(
+        _export_chunk, chunks, workers, ahead=workers * EXPORT_CHUNKS_AHEAD
+    )
+    header_sent = False
+    try:
+        for n,header,body,new in results:
+            if conn:
+                if header:
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES ('header', ?)", (header,))
+                else:
+                    header = conn.execute("SELECT value FROM meta WHERE key='header'").fetchone()[0]
+                conn.executemany(
+                    'INSERT OR REPLACE INTO rows VALUES (?,?,?)',
+                    [
+                        (relpath(path), shas[relpath(path)], row)
+                        for path,row in new.items() if shas.get(relpath(path))
+                    ]
+                )
+                conn.commit()
+            if not header_sent:
+                yield header
+                header_sent = True
+            yield body
+            if progress:
+                progress.step(n)
+        if not header_sent:
+            n,header,body,new = _export_chunk(([], model, None))
+            yield header
+    finally:
+        results.close()
+        if conn:
+            conn.close()
+
+def export_to_csv(collection, model, logger=logger, progress=None, base_dir=None):
+    """Write collection to CSV file, streaming
+    
+    Written to a temp file and renamed so downloads never see part of a file.
+    Rows of objects unchanged since the last export come from the rows
+    cache.  The export key is saved with the file (see cached_export).
+    
+    @returns: Path
+    """
+    key = export_key(collection.path_abs, model)
+    path = csv_path(collection, model)
+    logger.info('Exporting %s %s to %s' % (collection.path_abs, model, path))
+    if not path.parent.exists():
+        path.parent.mkdir(parents=True)
+    rows_db = rows_db_path(
+        base_dir or settings.MEDIA_BASE, collection.path_abs, model
+    )
+    tmp = path.with_name(path.name + '.tmp')
+    with tmp.open('w', encoding='utf-8', newline='') as f:
+        for text in export_rows(
+                collection.path_abs, model, progress=progress, rows_db=rows_db
+        ):
+            f.write(text)
+    tmp.rename(path)
+    key_path(path).write_text(json.dumps(key))
+    return path
+
+def csv_bytes(path, chunk_size=64*1024):
+    """Yield bytes of a CSV file, for StreamingHttpResponse
+    
+    @param path: Path
+    """
+    with path.open('rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            yield chunk
 
 def import_from_csv(csv_path, collection, model, git_name, git_mail):
     if model == 'entity':
@@ -49,26 +359,448 @@ def import_from_csv(csv_path, collection, model, git_name, git_mail):
     elif model == 'file':
         return import_files(csv_path, collection, git_name, git_mail)
 
-def import_entities(csv_path, collection, git_name, git_mail):
-    imported = Importer.import_entities(
-        csv_path=csv_path,
-        cidentifier=collection.identifier,
-        vocabs_url=settings.VOCABS_URL,
-        git_name=git_name,
-        git_mail=git_mail,
-        agent='ddrlocal-csv-import-entity',
-        dryrun=False,
-    )
-    imported_rel = sorted([o.identifier.path_rel() for o in imported])
-    result = commands.commit_files(
-        repo=dvcs.repository(collection.identifier.path_abs()),
-        message='Imported by ddr-local from file "%s"' % csv_path,
-        git_files=imported_rel,
-        annex_files=[]
-    )
+def read_rows(csv_path):
+    """Read import CSV into a header list and a list of row dicts
+    
+    @param csv_path: str or Path
+    @returns: (list of field names, list of dicts)
+    """
+    with open(str(csv_path), 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.DictReader(f)
+        rowds = [
+            {key.strip(): (value or '').strip() for key,value in rowd.items() if key}
+            for rowd in reader
+        ]
+        return [name.strip() for name in (reader.fieldnames or [])], rowds
+
+def field_specs(model):
+    """Field names and required fields from the model's FIELDS
+    
+    Plain data, so it can be sent to pool workers.  Controlled values
+    are checked by webui.vocabs.VocabIndex.
+    
+    @param model: str
+    @returns: dict {'names': [], 'required': [], 'models': []}
+    """
+    specs = {'names': ['id'], 'required': ['id'], 'models': IMPORT_ID_MODELS[model]}
+    for field in MODULES[model].FIELDS:
+        specs['names'].append(field['name'])
+        if (field.get('form') or {}).get('required') \
+        and (field['name'] not in REQUIRED_FIELDS_EXCEPTIONS[model]):
+            specs['required'].append(field['name'])
+    return specs
+
+def validate_row(rowd, specs, collection_id):
+    """Check the ID and required fields of one row; does not touch the repo
+    
+    >>> validate_row({'id': 'ddr-test-123-4', 'title': ''}, specs, 'ddr-test-123')
+    ['title: required']
+    
+    @param rowd: dict
+    @param specs: dict from field_specs()
+    @param collection_id: str
+    @returns: list of error strings
+    """
+    errors = []
+    try:
+        oid = Identifier(id=rowd.get('id', ''))
+        if oid.model not in specs.get('models', IMPORT_ID_MODELS['entity']):
+            errors.append('id: "%s" is not a %s ID' % (rowd['id'], ' or '.join(specs['models'])))
+        elif oid.collection_id() != collection_id:
+            errors.append('id: "%s" is not in %s' % (rowd['id'], collection_id))
+    except Exception:
+        errors.append('id: "%s" is not a valid ID' % rowd.get('id', ''))
+    for name in specs['required']:
+        if not rowd.get(name):
+            errors.append('%s: required' % name)
+    return errors
+
+def _validate_chunk(args):
+    """@returns: list of (row number, id, error)
+    """
+    rows,specs,collection_id = args
+    return [
+        (n, rowd.get('id'), err)
+        for n,rowd in rows
+        for err in validate_row(rowd, specs, collection_id)
+    ]
+
+def _build_chunk(args):
+    """Load rows into entities and write their JSON and changelogs
+    
+    Rows must already be valid.  Writes files only; nothing is staged.
+    
+    @param args: (collection path, list of (row number, dict), git_name, git_mail, agent)
+    @returns: list of paths relative to the collection
+    """
+    collection_path,rows,git_name,git_mail,agent = args
+    from webui.models import Collection, Entity
+    collection = Collection.from_identifier(Identifier(path=collection_path))
+    written = []
+    for n,rowd in rows:
+        eidentifier = Identifier(id=rowd['id'])
+        if os.path.exists(eidentifier.path_abs('json')):
+            entity = Entity.from_identifier(eidentifier)
+            message = 'Updated entity file %s' % entity.json_path
+        else:
+            entity = Entity.new(eidentifier)
+            entity.inherit(collection)
+            message = 'Initialized entity %s' % entity.id
+            os.makedirs(os.path.dirname(entity.json_path), exist_ok=True)
+        entity.load_csv(rowd)
+        entity.write_json()
+        changelog.write_changelog_entry(
+            entity.changelog_path, [message, '@agent: %s' % agent],
+            user=git_name, email=git_mail
+        )
+        written.append(os.path.relpath(entity.json_path, collection_path))
+        written.append(os.path.relpath(entity.changelog_path, collection_path))
+    return written
+
+def _map_chunks(func, chunks, workers, progress=None):
+    """Run func on chunks in a thread pool; in order
+    
+    Threads, not processes: imports run in collection lanes, which are
+    single prefork Celery workers and cannot start a process pool.
+    Building is mostly file I/O.
+    
+    @param chunks: list of args tuples; the second item is the list of rows
+    """
+    results = []
+    for chunk,result in zip(chunks, pool_map(func, chunks, workers, threads=True)):
+        results.append(result)
+        if progress:
+            progress.step(len(chunk[1]))
+    return results
+
+def validate_rows(headers, rowds, collection, model='entity', workers=None, progress=None, index=None):
+    """Validate all rows up front, in parallel
+    
+    Controlled-vocabulary columns are checked and normalized in place
+    (variant spellings replaced with official values) using index.
+    
+    @param headers: list of field names
+    @param rowds: list of dicts
+    @param collection: webui.models.Collection
+    @param model: str
+    @param workers: int Pool size (default os.cpu_count()); 1 disables pool
+    @param progress: webui.tasks.common.TaskProgress (optional)
+    @param index: webui.vocabs.VocabIndex (optional) Built from model if absent
+    @returns: list of error strings; empty if all rows are valid
+    """
+    workers = workers or os.cpu_count() or 1
+    specs = field_specs(model)
+    if index is None:
+        index = vocabs.VocabIndex.from_model(model)
+    errors = [
+        'Unknown field "%s"' % name
+        for name in headers if name not in specs['names']
+    ]
+    if 'id' not in headers:
+        errors.append('No "id" field')
+        return errors
+    seen = {}
+    for n,rowd in enumerate(rowds, start=2):
+        if rowd.get('id') in seen:
+            errors.append('row %s: %s duplicates row %s' % (n, rowd['id'], seen[rowd['id']]))
+        seen.setdefault(rowd.get('id'), n)
+    errors += [
+        'row %s: %s %s: "%s" is not a valid choice' % (n + 2, rowds[n].get('id'), name, value)
+        for n,name,value in index.normalize(headers, rowds)
+    ]
+    chunks = [
+        (rows, specs, collection.id)
+        for rows in chunked(enumerate(rowds, start=2), IMPORT_CHUNK_SIZE)
+    ]
+    for result in _map_chunks(_validate_chunk, chunks, workers, progress):
+        errors += ['row %s: %s %s' % (n, oid, err) for n,oid,err in result]
+    return errors
+
+def plan_key(csv_path, collection, model):
+    """Everything a plan depends on: the CSV file and the collection
+    
+    @returns: dict
+    """
+    key = export_key(collection.path_abs, model)
+    key['csv'] = (
+        checksums.known_checksums(str(csv_path), ['sha1'])
+        or checksums.file_checksums(str(csv_path), ['sha1'])
+    )['sha1']
+    return key
+
+def plan_path(csv_path, model):
+    """Plan is kept next to the CSV, so each upload has its own
+    
+    - STORE/tmp/uploads/UPLOAD_ID/FILENAME.csv.import-entity.json
+    """
+    return Path('%s%s' % (csv_path, PLAN_SUFFIX % model))
+
+def _read_plan(csv_path, model):
+    path = plan_path(csv_path, model)
+    if not path.exists():
+        return None
+    try:
+        return json.loads(path.read_text())
+    except ValueError:
+        return None
+
+def read_plan(csv_path, model):
+    """Saved plan for this CSV, whether or not the collection has changed since
+    
+    @returns: dict (see plan_import) or None
+    """
+    data = _read_plan(csv_path, model)
+    if data:
+        return data['plan']
+    return None
+
+def cached_plan(csv_path, collection, model):
+    """Saved plan, if made from this CSV and the collection has not changed
+    
+    @returns: dict {'key', 'plan', 'headers', 'rowds'} or None
+    """
+    data = _read_plan(csv_path, model)
+    if not data:
+        return None
+    if data.get('key') != plan_key(csv_path, collection, model):
+        return None
+    return data
+
+def _source_path(csv_dir, rowd):
+    path = rowd.get('basename_orig', '')
+    if path and not os.path.isabs(path):
+        path = os.path.join(csv_dir, path)
+    return path
+
+def plan_import(csv_path, collection, model, src_dir=None, workers=None, progress=None):
+    """Report what importing a CSV file would do, without writing to the repo
+    
+    Reads the CSV once.  Reports invalid rows, which entities exist,
+    and for new files how many bytes DDR's importer will read to hash
+    and copy them and how much the annex will grow compared to free
+    space on the Store.  Access files are not included in the estimate.
+    
+    The plan and the validated rows are saved next to the CSV (see
+    plan_path) so an import of the same file can skip validation (see
+    cached_plan).  Run in the background (webui.tasks.collection.csv_plan).
+    
+    >>> plan = plan_import('/tmp/import-ddr-test-123-file.csv', collection, 'file')
+    >>> plan['valid'], plan['files']['new'], plan['annex_bytes'], plan['fits']
+    (True, 120, 5368709120, True)
+    
+    @param csv_path: str or Path
+    @param collection: webui.models.Collection
+    @param model: str 'entity' or 'file'
+    @param src_dir: str (optional) Source files are relative to this (default CSV dir)
+    @param workers: int (optional) Pool size for validation
+    @param progress: webui.tasks.common.TaskProgress (optional)
+    @returns: dict
+    """
+    csv_dir = src_dir or os.path.dirname(str(csv_path))
+    headers,rowds = read_rows(csv_path)
+    if progress:
+        progress.start('validate', total=len(rowds))
+    errors = validate_rows(headers, rowds, collection, model, workers, progress)
+    
+    if progress:
+        progress.start('plan', total=len(rowds))
+    entities = {}
+    files = {'new': 0, 'existing': 0, 'missing': []}
+    sources = {}
+    for n,rowd in enumerate(rowds, start=2):
+        if progress:
+            progress.step()
+        try:
+            oid = Identifier(id=rowd.get('id', ''))
+        except Exception:
+            continue
+        if model == 'entity':
+            if os.path.exists(oid.path_abs('json')):
+                entities[oid.id] = 'existing'
+            else:
+                entities[oid.id] = 'new'
+            continue
+        # files: the parent entity must exist
+        parent = oid.parent()
+        if parent and (parent.id not in entities):
+            if os.path.exists(parent.path_abs('json')):
+                entities[parent.id] = 'existing'
+            else:
+                entities[parent.id] = 'missing'
+        if parent and (entities[parent.id] == 'missing'):
+            errors.append('row %s: %s entity %s does not exist' % (n, oid.id, parent.id))
+        if oid.model == 'file':
+            if os.path.exists(oid.path_abs('json')):
+                files['existing'] += 1
+            else:
+                errors.append('row %s: %s does not exist' % (n, oid.id))
+            continue
+        files['new'] += 1
+        src = _source_path(csv_dir, rowd)
+        if not (src and os.path.exists(src) and os.access(src, os.R_OK)):
+            files['missing'].append(src)
+            errors.append('row %s: %s source file missing or unreadable: "%s"' % (n, oid.id, src))
+        else:
+            sources[os.path.realpath(src)] = os.path.getsize(src)
+    
+    new_bytes = sum(sources.values())
+    free = shutil.disk_usage(collection.path_abs).free
+    plan = {
+        'model': model,
+        'file_name': os.path.basename(str(csv_path)),
+        'rows': len(rowds),
+        'errors': errors,
+        'valid': not errors,
+        'entities': {
+            state: sorted([eid for eid,s in entities.items() if s == state])
+            for state in ['new', 'existing', 'missing']
+        },
+        'files': files,
+        # DDR.ingest reads each new file once per checksum, then copies it
+        'hash_bytes': new_bytes * IMPORT_HASH_READS,
+        'copy_bytes': new_bytes,
+        'read_bytes': new_bytes * (IMPORT_HASH_READS + 1),
+        'annex_bytes': new_bytes,
+        'free_bytes': free,
+        'fits': new_bytes < free,
+    }
+    path = plan_path(csv_path, model)
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_text(json.dumps({
+        'key': plan_key(csv_path, collection, model),
+        'plan': plan,
+        'headers': headers,
+        'rowds': rowds,
+    }))
+    tmp.rename(path)
+    return plan
+
+def _rollback(repo, collection_path, existing, new_dirs):
+    """Undo a failed import: unstage, restore changed files, remove new entities
+    
+    @param repo: git.Repo
+    @param collection_path: str
+    @param existing: list of relpaths of files that existed before the import
+    @param new_dirs: list of absolute paths of entity dirs made by the import
+    """
+    new_rel = [os.path.relpath(path, collection_path) for path in new_dirs]
+    for paths in chunked(existing + new_rel, IMPORT_ADD_CHUNK):
+        repo.git.reset('-q', 'HEAD', '--', *paths)
+    for paths in chunked(existing, IMPORT_ADD_CHUNK):
+        repo.git.checkout('--', *paths)
+    for path in new_dirs:
+        shutil.rmtree(path, ignore_errors=True)
+
+def import_entities(csv_path, collection, git_name, git_mail, workers=None, progress=None):
+    """Import entities from CSV in one commit
+    
+    All rows are validated before anything is written; any error fails
+    the whole import.  If the same file was planned (see plan_import) and
+    the collection has not changed since, the validated rows are reused.
+    Entity JSON is then built and written by a pool of workers, staged
+    with git add, and committed once.  If building or committing fails,
+    changed entities are checked out again and new ones removed.
+    
+    @param csv_path: str or Path
+    @param collection: webui.models.Collection
+    @param git_name: str
+    @param git_mail: str
+    @param workers: int Pool size (default os.cpu_count()); 1 disables pool
+    @param progress: webui.tasks.common.TaskProgress (optional)
+    @returns: (commit sha, list of entity JSON paths relative to collection)
+    """
+    workers = workers or os.cpu_count() or 1
+    agent = 'ddrlocal-csv-import-entity'
+    planned = cached_plan(csv_path, collection, 'entity')
+    if planned:
+        # validated and normalized by plan_import; nothing changed since
+        headers,rowds = planned['headers'],planned['rowds']
+        errors = planned['plan']['errors']
+    else:
+        headers,rowds = read_rows(csv_path)
+        if progress:
+            progress.start('validate', total=len(rowds))
+        errors = validate_rows(headers, rowds, collection, 'entity', workers, progress)
+    if errors:
+        raise Exception('%s errors in %s:\n%s' % (
+            len(errors), os.path.basename(str(csv_path)), '\n'.join(errors)
+        ))
+    
+    # what to restore if the import fails
+    existing = []
+    new_dirs = []
+    for rowd in rowds:
+        eidentifier = Identifier(id=rowd['id'])
+        if os.path.exists(eidentifier.path_abs('json')):
+            existing += [
+                os.path.relpath(path, collection.path_abs)
+                for path in [eidentifier.path_abs('json'), eidentifier.path_abs('changelog')]
+                if os.path.exists(path)
+            ]
+        elif not os.path.exists(eidentifier.path_abs()):
+            new_dirs.append(eidentifier.path_abs())
+    
+    repo = dvcs.repository(collection.path_abs)
+    try:
+        if progress:
+            progress.start('build', total=len(rowds))
+        chunks = [
+            (collection.path_abs, rows, git_name, git_mail, agent)
+            for rows in chunked(enumerate(rowds, start=2), IMPORT_CHUNK_SIZE)
+        ]
+        written = [
+            path
+            for paths in _map_chunks(_build_chunk, chunks, workers, progress)
+            for path in paths
+        ]
+        imported_rel = sorted([path for path in written if path.endswith('.json')])
+        
+        if progress:
+            progress.start('commit', total=len(written))
+        for paths in chunked(written, IMPORT_ADD_CHUNK):
+            repo.git.add(*paths)
+            if progress:
+                progress.step(len(paths))
+        result = None
+        if written:
+            repo.git.commit(
+                '--author=%s <%s>' % (git_name, git_mail),
+                '-m', 'Imported %s entities from file "%s"\n\n@agent: %s' % (
+                    len(imported_rel), os.path.basename(str(csv_path)), agent
+                ),
+            )
+            result = repo.head.commit.hexsha
+    except Exception:
+        logger.error('Import of %s failed, rolling back' % csv_path)
+        try:
+            _rollback(repo, collection.path_abs, existing, new_dirs)
+        except Exception as err:
+            logger.error('Could not roll back: %s' % err)
+        raise
     return result,imported_rel
 
 def import_files(csv_path, collection, git_name, git_mail):
+    """Import files from CSV with DDR's Importer, in one commit
+    
+    A saved plan (see plan_import) that found errors or too little space
+    stops the import before anything is written.  DDR.batch.Importer
+    reads the CSV itself and validates every row again; it takes a path,
+    not rows, so the rows validated by the plan cannot be passed through.
+    
+    @param csv_path: str or Path
+    @param collection: webui.models.Collection
+    @param git_name: str
+    @param git_mail: str
+    @returns: (commit sha, list of file JSON paths relative to collection)
+    """
+    planned = cached_plan(csv_path, collection, 'file')
+    if planned and not planned['plan']['valid']:
+        raise Exception('%s errors in %s:\n%s' % (
+            len(planned['plan']['errors']), planned['plan']['file_name'],
+            '\n'.join(planned['plan']['errors'])
+        ))
+    if planned and not planned['plan']['fits']:
+        raise Exception('Not enough space on the Store for %s' % planned['plan']['file_name'])
     imported = Importer.import_files(
         csv_path=csv_path,
         cidentifier=collection.identifier,
@@ -90,13 +822,18 @@ def import_files(csv_path, collection, git_name, git_mail):
         )
         for file_path_abs in imported_flat
     ]
-    result = commands.commit_files(
-        repo=dvcs.repository(collection.identifier.path_abs()),
+    repo = dvcs.repository(collection.identifier.path_abs())
+    commands.commit_files(
+        repo=repo,
         message='Imported by ddr-local from file "%s"' % csv_path,
         git_files=imported_rel,
         annex_files=[],
     )
-    return result
+    files_rel = sorted([
+        path for path in imported_rel
+        if os.path.basename(path) != 'entity.json'
+    ])
+    return repo.head.commit.hexsha,files_rel
 
 def models(model):
     return CSV_MODELS[model]
@@ -112,6 +849,3 @@ def csv_url(collection, model):
         return reverse('webui-collection-csv-entities', args=[collection.id])
     elif model == 'file':
         return reverse('webui-collection-csv-files', args=[collection.id])
-
-def csv_import_path(cid, model):
-    return Path(CSV_IMPORT_FILE.format(cid=cid, model=model))
@@ -0,0 +1,194 @@
+"""
+dataset
+
+Exports the metadata of every collection in a Store as one dataset.
+
+Reporting across collections used to mean one CSV export per collection.
+export_store walks MEDIA_BASE and writes compact JSON Lines (one object
+per line, gzipped), partitioned by collection, with one table for
+entities and one for files:
+
+    OUT/entity/collection_id=ddr-test-123/part-0.jsonl.gz
+    OUT/file/collection_id=ddr-test-123/part-0.jsonl.gz
+    OUT/manifest.json
+
+The partition layout is the one Spark, DuckDB, pandas, and pyarrow
+read as a partitioned dataset.  The manifest records each collection's
+export key (HEAD commit, uncommitted changes, model definitions; see
+webui.csvio.export_key).  A refresh only rewrites collections whose key
+has changed and removes collections no longer in the Store.
+
+>>> from webui import dataset
+>>> dataset.export_store('/var/www/media/ddr', '/var/www/media/ddr/tmp/dataset')
+{'exported': ['ddr-test-123'], 'unchanged': ['ddr-test-124'], 'removed': [], 'errors': {}, 'entities': 120, 'files': 480}
+"""
+
+from datetime import datetime
+import gzip
+import json
+import logging
+logger = logging.getLogger(__name__)
+import os
+import shutil
+
+from django.conf import settings
+
+from webui import csvio
+from webui.util import load_json, pool_map
+
+MODELS = ['entity', 'file']
+PARTITION = 'collection_id=%s'
+PART_FILENAME = 'part-0.jsonl.gz'
+MANIFEST_FILENAME = 'manifest.json'
+# Collections exported at once; bounded to spare the Store's disk
+EXPORT_WORKERS = 4
+
+
+def collection_paths(base_dir):
+    """Absolute paths of collection repos in a Store, sorted
+    """
+    paths = []
+    for dirname in sorted(os.listdir(base_dir)):
+        path = os.path.join(base_dir, dirname)
+        if os.path.exists(os.path.join(path, 'collection.json')):
+            paths.append(path)
+    return paths
+
+def partition_path(out_dir, model, collection_id):
+    """
+    >>> partition_path('/tmp/dataset', 'entity', 'ddr-test-123')
+    '/tmp/dataset/entity/collection_id=ddr-test-123'
+    """
+    return os.path.join(out_dir, model, PARTITION % collection_id)
+
+def read_manifest(out_dir):
+    path = os.path.join(out_dir, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return {'collections': {}}
+    with open(path, 'r') as f:
+        return json.loads(f.read())
+
+def write_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST_FILENAME)
+    with open(path + '.tmp', 'w') as f:
+        f.write(json.dumps(manifest, indent=1, sort_keys=True))
+    os.rename(path + '.tmp', path)
+
+def object_row(json_path, collection_id, model):
+    """One object's metadata as a flat dict, with partition columns
+    
+    @param json_path: str
+    @param collection_id: str
+    @param model: str 'entity' or 'file'
+    @returns: dict
+    """
+    row = load_json(json_path)
+    row['collection_id'] = collection_id
+    if model == 'file':
+        # ENTITY/files/FILE.json
+        row['entity_id'] = os.path.basename(os.path.dirname(os.path.dirname(json_path)))
+    return row
+
+def export_collection(collection_path, out_dir):
+    """Write the entity and file partitions of one collection
+    
+    Each partition is written to a temp file and renamed, so readers
+    never see part of one.
+    
+    @param collection_path: str
+    @param out_dir: str
+    @returns: dict {'collection_id', 'key', 'entity': int, 'file': int}
+    """
+    collection_id = os.path.basename(os.path.normpath(collection_path))
+    # key first: changes made during the export are picked up next time
+    result = {
+        'collection_id': collection_id,
+        'key': csvio.export_key(collection_path, 'dataset'),
+    }
+    for model in MODELS:
+        part_dir = partition_path(out_dir, model, collection_id)
+        os.makedirs(part_dir, exist_ok=True)
+        path = os.path.join(part_dir, PART_FILENAME)
+        n = 0
+        with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as f:
+            for json_path in csvio.meta_paths(collection_path, model):
+                f.write(json.dumps(
+                    object_row(json_path, collection_id, model),
+                    separators=(',', ':'), sort_keys=True
+                ))
+                f.write('\n')
+                n += 1
+        os.rename(path + '.tmp', path)
+        result[model] = n
+    return result
+
+def _export(args):
+    collection_path,out_dir = args
+    try:
+        return export_collection(collection_path, out_dir)
+    except Exception as err:
+        logger.error('%s: %s' % (collection_path, err))
+        return {
+            'collection_id': os.path.basename(os.path.normpath(collection_path)),
+            'error': str(err),
+        }
+
+def export_store(base_dir=None, out_dir=None, force=False, workers=EXPORT_WORKERS, progress=None):
+    """Export every collection in a Store; only changed ones if already exported
+    
+    @param base_dir: str (optional) Defaults to settings.MEDIA_BASE
+    @param out_dir: str (optional) Defaults to STORE/tmp/dataset
+    @param force: bool Rewrite every collection
+    @param workers: int Collections exported at once; 1 disables pool
+    @param progress: webui.tasks.common.TaskProgress (optional)
+    @returns: dict {'exported': [], 'unchanged': [], 'removed': [], 'errors': {}, 'entities': int, 'files': int}
+    """
+    base_dir = base_dir or settings.MEDIA_BASE
+    out_dir = out_dir or os.path.join(base_dir, 'tmp', 'dataset')
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = read_manifest(out_dir)
+    done = manifest['collections']
+    stats = {'exported': [], 'unchanged': [], 'removed': [], 'errors': {}}
+    
+    paths = collection_paths(base_dir)
+    todo = []
+    for path in paths:
+        collection_id = os.path.basename(path)
+        if (not force) and (collection_id in done) \
+        and (done[collection_id]['key'] == csvio.export_key(path, 'dataset')):
+            stats['unchanged'].append(collection_id)
+        else:
+            todo.append(path)
+    # collections no longer in the Store
+    present = [os.path.basename(path) for path in paths]
+    for collection_id in sorted(done.keys()):
+        if collection_id not in present:
+            for model in MODELS:
+                shutil.rmtree(partition_path(out_dir, model, collection_id), ignore_errors=True)
+            done.pop(collection_id)
+            stats['removed'].append(collection_id)
+    
+    if progress:
+        progress.start('export', total=len(todo))
+    args = [(path, out_dir) for path in todo]
+    for result in pool_map(_export, args, workers, ordered=False):
+        collection_id = result['collection_id']
+        if result.get('error'):
+            stats['errors'][collection_id] = result['error']
+        else:
+            done[collection_id] = {
+                'key': result['key'],
+                'entities': result['entity'],
+                'files': result['file'],
+                'exported': datetime.now(settings.TZ).isoformat(),
+            }
+            stats['exported'].append(collection_id)
+            # saved as it goes so an interrupted run is not lost
+            write_manifest(out_dir, manifest)
+        if progress:
+            progress.step()
+    write_manifest(out_dir, manifest)
+    stats['exported'] = sorted(stats['exported'])
+    stats['entities'] = sum(c['entities'] for c in done.values())
+    stats['files'] = sum(c['files'] for c in done.values())
+    return stats
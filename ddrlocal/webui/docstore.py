@@ -1,6 +1,7 @@
 from django.conf import settings
 
 from elasticsearch import Elasticsearch
+from elasticsearch import helpers
 
 from DDR import docstore
 
@@ -15,3 +16,21 @@ class Docstore(docstore.Docstore):
             self.es = connection
         else:
             self.es = Elasticsearch(hosts)
+
+    def post_bulk(self, objects, chunk_size=500):
+        """Index several objects in one bulk request
+        
+        For batches of new files; Docstore.post makes one request per object.
+        
+        @param objects: list of Collection, Entity, or File
+        @param chunk_size: int Max objects per request
+        @returns: (int number indexed, list of errors)
+        """
+        actions = []
+        for o in objects:
+            action = o.to_esobject().to_dict(include_meta=True)
+            action['_index'] = self.index_name(o.identifier.model)
+            actions.append(action)
+        return helpers.bulk(
+            self.es, actions, chunk_size=chunk_size, raise_on_error=False
+        )
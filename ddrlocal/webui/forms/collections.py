@@ -22,8 +22,17 @@ class SignaturesConfirmForm(forms.Form):
         help_text='Yes, I want to choose signatures for this collection.'
     )
 
+class AccessBackfillConfirmForm(forms.Form):
+    confirmed = forms.BooleanField(
+        help_text='Yes, I want to make missing access files for this collection.'
+    )
+
 class UploadFileForm(forms.Form):
     file = forms.FileField()
+    dryrun = forms.BooleanField(
+        required=False, label='Dry run',
+        help_text='Check the file and report what importing it would do; nothing is imported.'
+    )
 
 class ReindexConfirmForm(forms.Form):
     confirmed = forms.BooleanField(
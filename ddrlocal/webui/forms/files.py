@@ -8,8 +8,10 @@ from django.conf import settings
 from webui.forms import DDRForm
 
 
-def shared_folder_files():
+def shared_folder_files(path=None):
     d = settings.VIRTUALBOX_SHARED_FOLDER
+    if path:
+        d = os.path.join(d, path)
     files = []
     for f in os.listdir(d):
         fabs = os.path.join(d,f)
@@ -27,6 +29,25 @@ class NewFileDDRForm(DDRForm):
         if path_choices:
             self.fields['path'].choices = path_choices
 
+class BatchFileForm(forms.Form):
+    """Choose files from a shared folder dir to add in one batch
+    """
+    paths = forms.MultipleChoiceField(
+        label='Files', required=True, widget=forms.CheckboxSelectMultiple,
+    )
+    public = forms.BooleanField(
+        label='Public', required=False, initial=True,
+    )
+    sort = forms.IntegerField(
+        label='Sort', required=True, initial=1, min_value=1,
+        help_text='Sort of the first file; files are numbered in the order listed.',
+    )
+    
+    def __init__(self, *args, **kwargs):
+        path_choices = kwargs.pop('path_choices', [])
+        super(BatchFileForm, self).__init__(*args, **kwargs)
+        self.fields['paths'].choices = path_choices
+
 MIMETYPE_CHOICES = [
     ('text/html', 'text/html'),
     ('application/pdf', 'application/pdf'),
@@ -2,6 +2,8 @@ from collections import OrderedDict
 import logging
 logger = logging.getLogger(__name__)
 
+from elasticsearch.exceptions import TransportError
+
 from django import forms
 from django.conf import settings
 from django.core.cache import cache
@@ -23,13 +25,23 @@ FORMS_CHOICE_LABELS = {}
 
 def forms_choice_labels():
     """Lazy-load and keep human-readable labels for form choices
+    
+    Returns {} without keeping it if Elasticsearch is disabled or down
+    (results from the fulltext index); choices are then labelled with
+    their keys.
     """
     global FORMS_CHOICE_LABELS
     if not FORMS_CHOICE_LABELS:
-        forms_choices = docstore.Docstore().es.get(
-            index='forms',
-            id='forms-choices'
-        )['_source']
+        if not settings.DOCSTORE_ENABLED:
+            return {}
+        try:
+            forms_choices = docstore.Docstore().es.get(
+                index='forms',
+                id='forms-choices'
+            )['_source']
+        except TransportError as err:
+            logger.error('Could not load form choice labels: %s' % err)
+            return {}
         for key in forms_choices.keys():
             field = key.replace('-choices','')
             FORMS_CHOICE_LABELS[field] = {
@@ -93,7 +105,7 @@ class SearchForm(forms.Form):
             for fieldname,aggs in search_results.aggregations.items():
                 choices = []
                 for item in aggs:
-                    label = choice_labels[fieldname][item['key']]
+                    label = choice_labels.get(fieldname, {}).get(item['key'], item['key'])
                     choice = (
                         item['key'],
                         '%s (%s)' % (label, item['doc_count'])
@@ -0,0 +1,482 @@
+"""Local full-text index used when Elasticsearch is disabled or down
+
+Collection, entity, and segment JSON under MEDIA_BASE are indexed into
+an SQLite database (FTS5) at settings.FULLTEXT_INDEX_PATH.  The index is
+updated by the same hooks that post objects to the docstore, and can be
+(re)built for a whole collection or Store with index_collection/index_store.
+
+webui.search.Searcher falls back to search() when it cannot use
+Elasticsearch.  Supports fulltext, parent, and term filters; does not
+support sorting or the full Elasticsearch query_string syntax.
+
+>>> from webui import fulltext
+>>> fulltext.index_store('/var/www/media/ddr')
+>>> fulltext.search(fulltext='seattle', parent='ddr-densho-10')
+(12, [{'id': 'ddr-densho-10-1', 'model': 'entity', ...}, ...])
+"""
+
+from copy import deepcopy
+import json
+import logging
+logger = logging.getLogger(__name__)
+import os
+import re
+import sqlite3
+
+from django.conf import settings
+
+from webui import docstore
+from webui.identifier import Identifier
+from webui.util import load_json
+
+# models that are indexed (files are not searched)
+FULLTEXT_MODELS = ['collection', 'entity', 'segment']
+
+# JSON files that mark a directory as an indexable object
+OBJECT_JSON_FILES = ['collection.json', 'entity.json']
+
+# fields kept in the stored document and returned with hits
+DOCUMENT_FIELDS = [
+    'id', 'model', 'parent_id', 'collection_id', 'organization_id',
+    'signature_id', 'status', 'public', 'title', 'description',
+    'links_html', 'links_json', 'links_img', 'links_thumb', 'links_children',
+]
+
+# fields that can be used as term filters, and the key to use when
+# field values are dicts (e.g. {'id': 123, 'term': 'Activism'})
+TERM_FIELDS = {
+    'status': None,
+    'public': None,
+    'topics': 'id',
+    'facility': 'id',
+    'contributor': None,
+    'creators': 'namepart',
+    'format': None,
+    'genre': None,
+    'geography': 'term',
+    'language': None,
+    'location': None,
+    'mimetype': None,
+    'persons': None,
+    'rights': None,
+}
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS documents (
+        rowid INTEGER PRIMARY KEY,
+        id TEXT UNIQUE NOT NULL,
+        model TEXT NOT NULL,
+        mtime REAL NOT NULL,
+        document TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS terms (
+        docid INTEGER NOT NULL,
+        field TEXT NOT NULL,
+        term TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS terms_field_term ON terms (field, term)",
+    "CREATE INDEX IF NOT EXISTS terms_docid ON terms (docid)",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS fulltext USING fts5(
+        title, description, body, tokenize='unicode61 remove_diacritics 2'
+    )""",
+]
+
+# index paths whose schema has been set up by this process
+_SCHEMA_READY = set()
+
+
+def connect(path=None):
+    """Open (and if necessary create) the index database
+    
+    WAL mode and the schema are set up the first time a path is opened
+    in this process (or again if the file has gone), not on every search.
+    
+    @param path: str (optional) Defaults to settings.FULLTEXT_INDEX_PATH
+    @returns: sqlite3.Connection
+    """
+    if not path:
+        path = settings.FULLTEXT_INDEX_PATH
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    if not os.path.exists(path):
+        _SCHEMA_READY.discard(path)
+    conn = sqlite3.connect(path, timeout=30)
+    if path not in _SCHEMA_READY:
+        conn.execute('PRAGMA journal_mode=WAL')
+        for statement in SCHEMA:
+            conn.execute(statement)
+        _SCHEMA_READY.add(path)
+    return conn
+
+def _text(value):
+    """Concatenate all strings in (possibly nested) value
+    """
+    if isinstance(value, str):
+        return value
+    elif isinstance(value, dict):
+        return ' '.join(_text(v) for v in value.values())
+    elif isinstance(value, (list, tuple)):
+        return ' '.join(_text(v) for v in value)
+    elif value is None:
+        return ''
+    return str(value)
+
+def _terms(value, key=None):
+    """List of filter terms from a field value
+    
+    >>> _terms([{'id': 123, 'term': 'Activism'}], 'id')
+    ['123']
+    >>> _terms('photograph')
+    ['photograph']
+    
+    @param value: str, int, list, or dict
+    @param key: str Key to use if value contains dicts
+    @returns: list of str
+    """
+    if value in [None, '', [], {}]:
+        return []
+    if isinstance(value, dict):
+        value = value.get(key, '') if key else ''
+        return [str(value)] if value not in [None, ''] else []
+    if isinstance(value, (list, tuple)):
+        terms = []
+        for v in value:
+            terms += _terms(v, key)
+        return terms
+    return [str(value)]
+
+def _links_img(signature_id):
+    """Path of signature access file relative to MEDIA_URL
+    """
+    if not signature_id:
+        return ''
+    try:
+        path = Identifier(signature_id).path_abs()
+    except Exception:
+        return ''
+    return '%s%s' % (
+        path.replace(settings.MEDIA_ROOT, '').lstrip('/'),
+        settings.ACCESS_FILE_SUFFIX,
+    )
+
+def make_document(oid, model, data):
+    """Stored document and filter terms for an object
+    
+    @param oid: str Object ID
+    @param model: str
+    @param data: dict Flattened object JSON (see load_json)
+    @returns: (document, terms, text) dict, list of (field,term), dict
+    """
+    document = {
+        field: data.get(field, '')
+        for field in DOCUMENT_FIELDS
+    }
+    document['id'] = oid
+    document['model'] = model
+    parts = oid.split('-')
+    if not document['parent_id'] and len(parts) > 3:
+        document['parent_id'] = '-'.join(parts[:-1])
+    if not document['collection_id'] and len(parts) >= 3:
+        document['collection_id'] = '-'.join(parts[:3])
+    if not document['organization_id']:
+        document['organization_id'] = '-'.join(parts[:2])
+    document['links_html'] = oid
+    document['links_json'] = oid
+    document['links_children'] = oid
+    document['links_img'] = _links_img(document['signature_id'])
+    document['links_thumb'] = document['links_img']
+    
+    terms = [
+        (field, term)
+        for field,key in TERM_FIELDS.items()
+        for term in _terms(data.get(field), key)
+    ]
+    text = {
+        'title': _text(data.get('title')),
+        'description': _text(data.get('description')),
+        'body': _text({
+            key: val for key,val in data.items()
+            if key not in ['title', 'description']
+        }),
+    }
+    return document,terms,text
+
+def index_json(conn, oid, model, json_path, force=False):
+    """Add or update one object in the index, if its JSON has changed
+    
+    @param conn: sqlite3.Connection
+    @param oid: str Object ID
+    @param model: str
+    @param json_path: str Absolute path to object JSON file
+    @param force: bool Reindex even if mtime has not changed
+    @returns: bool True if indexed
+    """
+    mtime = os.path.getmtime(json_path)
+    row = conn.execute(
+        'SELECT rowid, mtime FROM documents WHERE id=?', (oid,)
+    ).fetchone()
+    if row and (row[1] == mtime) and not force:
+        return False
+    document,terms,text = make_document(oid, model, load_json(json_path))
+    if row:
+        _delete(conn, row[0])
+    cursor = conn.execute(
+        'INSERT INTO documents (id, model, mtime, document) VALUES (?,?,?,?)',
+        (oid, model, mtime, json.dumps(document))
+    )
+    docid = cursor.lastrowid
+    conn.execute(
+        'INSERT INTO fulltext (rowid, title, description, body) VALUES (?,?,?,?)',
+        (docid, text['title'], text['description'], text['body'])
+    )
+    conn.executemany(
+        'INSERT INTO terms (docid, field, term) VALUES (?,?,?)',
+        [(docid, field, term) for field,term in terms]
+    )
+    return True
+
+def _delete(conn, docid):
+    conn.execute('DELETE FROM documents WHERE rowid=?', (docid,))
+    conn.execute('DELETE FROM fulltext WHERE rowid=?', (docid,))
+    conn.execute('DELETE FROM terms WHERE docid=?', (docid,))
+
+def post(obj, path=None):
+    """Add or update a Collection/Entity in the index
+    
+    Called alongside docstore posts.  Errors are logged, not raised,
+    so a problem with the index never breaks saving an object.
+    
+    @param obj: Collection or Entity
+    @param path: str (optional) Index path
+    """
+    if obj.identifier.model not in FULLTEXT_MODELS:
+        return
+    try:
+        conn = connect(path)
+        with conn:
+            index_json(
+                conn, obj.id, obj.identifier.model,
+                obj.identifier.path_abs('json'), force=True
+            )
+        conn.close()
+    except (sqlite3.Error, IOError) as err:
+        logger.error('Could not update fulltext index: %s' % err)
+
+def delete(oid, path=None):
+    """Remove object (and any descendants) from the index
+    
+    @param oid: str Object ID
+    @param path: str (optional) Index path
+    """
+    try:
+        conn = connect(path)
+        with conn:
+            rows = conn.execute(
+                'SELECT rowid FROM documents WHERE id=? OR (id>? AND id<?)',
+                (oid, '%s-' % oid, '%s.' % oid)
+            ).fetchall()
+            for row in rows:
+                _delete(conn, row[0])
+        conn.close()
+    except sqlite3.Error as err:
+        logger.error('Could not update fulltext index: %s' % err)
+
+def _walk_objects(base_path):
+    """Yield (oid, model, json_path) for objects under base_path
+    """
+    for dirpath,dirnames,filenames in os.walk(base_path):
+        # skip git internals and file binaries
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for filename in OBJECT_JSON_FILES:
+            if filename in filenames:
+                oi = Identifier(path=dirpath)
+                if oi.model in FULLTEXT_MODELS:
+                    yield oi.id, oi.model, os.path.join(dirpath, filename)
+
+def index_collection(collection_path, path=None, force=False, progress=None):
+    """Index all changed objects in a collection; remove deleted ones
+    
+    @param collection_path: str Absolute path to collection repo
+    @param path: str (optional) Index path
+    @param force: bool Reindex even if mtime has not changed
+    @param progress: webui.tasks.common.TaskProgress (optional)
+    @returns: dict {'indexed': int, 'deleted': int}
+    """
+    cid = os.path.basename(os.path.normpath(collection_path))
+    stats = {'indexed': 0, 'deleted': 0}
+    conn = connect(path)
+    with conn:
+        found = set()
+        for oid,model,json_path in _walk_objects(collection_path):
+            found.add(oid)
+            if index_json(conn, oid, model, json_path, force=force):
+                stats['indexed'] += 1
+            if progress:
+                progress.step()
+        rows = conn.execute(
+            'SELECT rowid, id FROM documents WHERE id=? OR (id>? AND id<?)',
+            (cid, '%s-' % cid, '%s.' % cid)
+        ).fetchall()
+        for docid,oid in rows:
+            if oid not in found:
+                _delete(conn, docid)
+                stats['deleted'] += 1
+    conn.close()
+    return stats
+
+def post_collection(collection_path, path=None, progress=None):
+    """Update index for a collection after sync etc
+    
+    Like index_collection but errors are logged, not raised.
+    
+    @param collection_path: str Absolute path to collection repo
+    @param path: str (optional) Index path
+    @param progress: webui.tasks.common.TaskProgress (optional)
+    """
+    try:
+        return index_collection(collection_path, path, progress=progress)
+    except (sqlite3.Error, IOError) as err:
+        logger.error('Could not update fulltext index: %s' % err)
+
+def index_store(base_path=None, path=None, force=False):
+    """Index every collection in a Store
+    
+    @param base_path: str (optional) Defaults to settings.MEDIA_BASE
+    @param path: str (optional) Index path
+    @param force: bool Reindex even if mtime has not changed
+    @returns: dict {collection_id: stats}
+    """
+    if not base_path:
+        base_path = settings.MEDIA_BASE
+    results = {}
+    for dirname in sorted(os.listdir(base_path)):
+        collection_path = os.path.join(base_path, dirname)
+        if os.path.exists(os.path.join(collection_path, 'collection.json')):
+            results[dirname] = index_collection(collection_path, path, force)
+    return results
+
+def fts_query(text):
+    """Convert search string to FTS5 query
+    
+    Words are quoted (so FTS5 operators in user input are inert) and
+    ANDed, matching Searcher's default_operator.  Trailing * is kept
+    as a prefix search.
+    
+    >>> fts_query('seattle minidoka*')
+    '"seattle" AND "minidoka"*'
+    
+    @param text: str
+    @returns: str
+    """
+    words = re.findall(r'\w+\*?', text)
+    return ' AND '.join([
+        '"%s"%s' % (word.rstrip('*'), '*' if word.endswith('*') else '')
+        for word in words
+    ])
+
+def _where(fulltext=None, parent=None, models=[], terms={}):
+    """SQL FROM/WHERE clause and args for search
+    """
+    sql = ['FROM documents']
+    args = []
+    where = []
+    if fulltext:
+        sql.append('JOIN fulltext ON fulltext.rowid = documents.rowid')
+        where.append('fulltext MATCH ?')
+        args.append(fts_query(fulltext))
+    if models:
+        where.append('documents.model IN (%s)' % ','.join(['?'] * len(models)))
+        args += models
+    if parent:
+        where.append('documents.id > ? AND documents.id < ?')
+        args += ['%s-' % parent, '%s.' % parent]
+    for field,values in terms.items():
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        where.append(
+            'documents.rowid IN (SELECT docid FROM terms WHERE field=? AND term IN (%s))' % (
+                ','.join(['?'] * len(values))
+            )
+        )
+        args += [field] + [str(v) for v in values]
+    if where:
+        sql.append('WHERE ' + ' AND '.join(where))
+    return ' '.join(sql), args
+
+def search(fulltext=None, parent=None, models=[], terms={}, limit=25, offset=0, path=None):
+    """Search the index
+    
+    @param fulltext: str
+    @param parent: str Parent object ID
+    @param models: list Model names (e.g. 'entity')
+    @param terms: dict {field: value or list of values} See TERM_FIELDS
+    @param limit: int
+    @param offset: int
+    @param path: str (optional) Index path
+    @returns: (total, list of documents)
+    """
+    if fulltext and not fts_query(fulltext):
+        return 0, []
+    clause,args = _where(fulltext, parent, models, terms)
+    conn = connect(path)
+    total = conn.execute('SELECT COUNT(*) %s' % clause, args).fetchone()[0]
+    if fulltext:
+        order = 'ORDER BY bm25(fulltext)'
+    else:
+        order = 'ORDER BY documents.id'
+    rows = conn.execute(
+        'SELECT documents.document %s %s LIMIT ? OFFSET ?' % (clause, order),
+        args + [int(limit), int(offset)]
+    ).fetchall()
+    conn.close()
+    return total, [json.loads(row[0]) for row in rows]
+
+def aggregations(fulltext=None, parent=None, models=[], terms={}, fields=[], path=None):
+    """Term counts for a search, in the same format as search.parse_aggregations
+    
+    @param fulltext: str
+    @param parent: str Parent object ID
+    @param models: list Model names
+    @param terms: dict {field: value or list of values}
+    @param fields: list Fields to count
+    @param path: str (optional) Index path
+    @returns: dict {field: [{'key': term, 'doc_count': int}, ...]}
+    """
+    if fulltext and not fts_query(fulltext):
+        return {}
+    clause,args = _where(fulltext, parent, models, terms)
+    conn = connect(path)
+    data = {}
+    for field in fields:
+        rows = conn.execute(
+            'SELECT term, COUNT(*) FROM terms WHERE field=? AND docid IN ('
+            'SELECT documents.rowid %s) GROUP BY term ORDER BY COUNT(*) DESC' % clause,
+            [field] + args
+        ).fetchall()
+        data[field] = [{'key': term, 'doc_count': count} for term,count in rows]
+    conn.close()
+    return data
+
+
+class Meta(object):
+    def __init__(self, index, id):
+        self.index = index
+        self.id = id
+
+class Hit(object):
+    """Stands in for elasticsearch_dsl Hit in search.SearchResults
+    """
+    def __init__(self, document):
+        self._document = document
+        self.meta = Meta(docstore.INDEX_PREFIX + document['model'], document['id'])
+    
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._document[name]
+        except KeyError:
+            raise AttributeError(name)
+    
+    def to_dict(self):
+        return deepcopy(self._document)
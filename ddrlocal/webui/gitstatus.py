@@ -550,7 +550,7 @@ def next_repo( queue, local=False ):
                 next_available = timestamp
     return ('notready',next_available)
 
-def update_store( base_dir, delta, minimum, local=False ):
+def update_store( base_dir, delta, minimum, local=False, dispatch=None ):
     """
     
     - Ensures only one gitstatus_update task running at a time
@@ -560,6 +560,10 @@ def update_store( base_dir, delta, minimum, local=False ):
     - Triggers a gitstatus update/write
     - 
     
+    If dispatch is given the update is handed off (e.g. to the collection's
+    task lane, see webui.tasks.routing) so it never runs at the same time
+    as tasks that write to the repo.
+    
     Reference: Ensuring only one gitstatus_update runs at a time
     http://docs.celeryproject.org/en/latest/tutorials/task-cookbook.html#cookbook-task-serial
     
@@ -567,6 +571,7 @@ def update_store( base_dir, delta, minimum, local=False ):
     @param delta: int (seconds) Delta added to highest available timestamp
     @param minimum: int (seconds) Minimum delta
     @param local: boolean Use per-collection locks
+    @param dispatch: function(collection_path) (optional) Run instead of update()
     @returns: success/fail message
     """
     if not os.path.exists(base_dir):
@@ -599,13 +604,17 @@ def update_store( base_dir, delta, minimum, local=False ):
                     messages.append('next_repo %s' % str(response))
                 elif isinstance(response, str) and os.path.exists(response):
                     collection_path = response
-                if collection_path:
+                if collection_path and dispatch:
+                    dispatch(collection_path)
+                    messages.append('%s dispatched' % (collection_path))
+                elif collection_path:
                     timestamp,elapsed,status,annex_status,syncstatus = update(base_dir, collection_path)
+                    messages.append('%s updated' % (collection_path))
+                if collection_path:
                     # TODO use Identifier
                     collection_id = os.path.basename(collection_path)
                     queue = queue_mark_updated(queue, collection_id, delta, minimum)
                     queue_write(base_dir, queue)
-                    messages.append('%s updated' % (collection_path))
             
         finally:
             release_lock()
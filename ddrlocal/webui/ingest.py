@@ -0,0 +1,419 @@
+"""
+ingest
+
+Resumable pipeline for adding local files to entities.
+
+Adding a large file used to happen in one task: hash, copy into the annex,
+make access file, git add/commit, post to Elasticsearch.  A failure near the
+end meant starting over from the beginning, reading the whole file from
+(slow) removable storage again.
+
+The pipeline runs in stages.  After each stage a checkpoint is written to
+the entity's addfile log; a retry of the same source file (same path, size,
+mtime) skips the stages that are already done.
+
+    hash    Size and sha1 of source; sha1 names the file.  Fails if the
+            entity already has the file.  DDR computes md5 and sha256
+            itself when it stages (it cannot be given checksums).
+    copy    Chunked copy from source to STORE/tmp/ingest/, hashed as it is
+            written so the source is read once; the hash stage is done
+            with it.  A partial copy is continued rather than restarted.
+            Skipped when the source is already on the Store's filesystem
+            (uploads, tmp/file-upload): that file is hashed in one pass
+            (webui.checksums), or not at all if it was hashed as it was
+            uploaded (webui.uploads), and DDR copies it into the annex.
+    stage   Copy into annex, make access file, write metadata, git add
+            (DDR Entity.add_local_file).  Access files are made inside
+            add_local_file, which has no way to skip them, so there is no
+            separate access stage.
+    commit  git commit (DDR Entity.add_file_commit).
+    index   Post to Elasticsearch.
+
+hash and copy touch only the source and the staging dir so they can run
+for several files at once (webui.tasks.files.file_ingest_prepare, on the
+ingest queue).  stage/commit/index write to the repo and run in the
+collection's serial lane (webui.tasks.files.file_add_local), which is
+also the only part that locks the collection.
+
+batch() adds many files in one task (webui.tasks.files.file_add_batch):
+hash and copy for all files in a thread pool, stage each file, then a
+single git commit, a single bulk Elasticsearch request, and (in the task)
+a single gitstatus update.
+
+Checkpoint lines look like this:
+    [2020-01-01T12:00:00] ok - CHECKPOINT {"ingest": "a1b2c3d4e5", "stage": "copy", "data": {...}}
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import json
+import logging
+logger = logging.getLogger(__name__)
+import os
+import shutil
+
+from django.conf import settings
+
+from elasticsearch.exceptions import ConnectionError, RequestError
+
+from DDR import dvcs
+
+from webui import checksums
+from webui import docstore
+from webui import gitstatus
+from webui import uploads
+from webui.models import File
+from webui.identifier import Identifier
+
+INGEST_STAGES = ['hash', 'copy', 'stage', 'commit', 'index']
+# Only sha1 is used here; DDR Entity.add_local_file hashes the file itself
+HASH_ALGORITHMS = ['sha1']
+CHECKPOINT = 'CHECKPOINT'
+# Bytes read/written per chunk when copying
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# Files hashed/copied at once by batch(); source is usually one USB disk
+# so more threads mostly add seeking
+BATCH_WORKERS = 4
+
+
+def ingest_key(src_path):
+    """Identifies a source file across retries
+    
+    >>> ingest_key('/var/www/media/ddr/tmp/file-upload/ddr-test-123-4/IMG_0001.TIF')
+    'a1b2c3d4e5'
+    """
+    st = os.stat(src_path)
+    text = '%s:%s:%s' % (src_path, st.st_size, int(st.st_mtime))
+    return hashlib.md5(text.encode('utf-8')).hexdigest()[:10]
+
+def checkpoint(log, key, stage, data=None):
+    """Record that a stage is done
+    
+    @param log: DDR.ingest.AddFileLogger
+    @param key: str ingest_key
+    @param stage: str One of INGEST_STAGES
+    @param data: dict (optional)
+    """
+    log.ok('%s %s' % (CHECKPOINT, json.dumps({
+        'ingest': key, 'stage': stage, 'data': data or {},
+    })))
+
+def read_checkpoints(log):
+    """Stages done for every ingest in the log, with their data
+    
+    @param log: DDR.ingest.AddFileLogger
+    @returns: dict {key: {stage: data}}
+    """
+    done = {}
+    for line in log.log().splitlines():
+        if CHECKPOINT not in line:
+            continue
+        try:
+            entry = json.loads(line.split(CHECKPOINT, 1)[1])
+        except ValueError:
+            continue
+        done.setdefault(entry.get('ingest'), {})[entry['stage']] = entry['data']
+    return done
+
+def checkpoints(log, key):
+    """Stages done for this ingest, with their data
+    
+    @param log: DDR.ingest.AddFileLogger
+    @param key: str ingest_key
+    @returns: dict {stage: data}
+    """
+    return read_checkpoints(log).get(key, {})
+
+def staging_path(key, src_path, base_dir=None):
+    """Staged copy keeps the original filename; DDR records it.
+    
+    - STORE/tmp/ingest/a1b2c3d4e5/IMG_0001.TIF
+    """
+    return os.path.join(
+        gitstatus.tmp_dir(base_dir or settings.MEDIA_BASE),
+        'ingest', key, os.path.basename(src_path)
+    )
+
+def on_store(src_path, base_dir=None):
+    """True if src_path is on the same filesystem as the Store
+    
+    DDR copies the file into the annex anyway; staging a copy of a file
+    that is already on the Store's disk only doubles the writes.
+    """
+    try:
+        return os.stat(src_path).st_dev == os.stat(base_dir or settings.MEDIA_BASE).st_dev
+    except OSError:
+        return False
+
+def file_id(entity, role, sha1):
+    """ID the file will get: ddr-test-123-4-master-a1b2c3d4e5
+    """
+    return '%s-%s-%s' % (entity.id, role, sha1[:10])
+
+def copy_file(src_path, dest_path, progress=None, chunk_size=COPY_CHUNK_SIZE):
+    """Copy in chunks, continuing a partial copy if there is one
+    
+    Copies to dest_path + '.part' and renames when done.  The copy is
+    hashed as it is written, so the source is read only once.
+    
+    @param src_path: str
+    @param dest_path: str
+    @param progress: webui.tasks.common.TaskProgress (optional) Counts bytes
+    @param chunk_size: int
+    @returns: dict {'size': int, 'sha1': str} of the copy
+    """
+    part_path = dest_path + '.part'
+    if not os.path.exists(os.path.dirname(dest_path)):
+        os.makedirs(os.path.dirname(dest_path))
+    hashes = checksums.MultiHash(HASH_ALGORITHMS)
+    if os.path.exists(part_path):
+        # already-copied bytes are on the Store, cheaper to read than source
+        with open(part_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                hashes.update(chunk)
+        if progress:
+            progress.step(hashes.size)
+    with open(src_path, 'rb') as src, open(part_path, 'ab') as dest:
+        src.seek(hashes.size)
+        for chunk in iter(lambda: src.read(chunk_size), b''):
+            dest.write(chunk)
+            hashes.update(chunk)
+            if progress:
+                progress.step(len(chunk))
+    os.rename(part_path, dest_path)
+    return hashes.hexdigests()
+
+def _check_new(entity, role, done, log):
+    """Add file_id to the hash data; crash if entity already has the file
+    """
+    fid = file_id(entity, role, done['hash']['sha1'])
+    if os.path.exists(os.path.join(entity.files_path, '%s.json' % fid)):
+        log.crash('%s already has file %s' % (entity.id, fid))
+    done['hash']['file_id'] = fid
+
+def prepare(entity, src_path, role, log, progress=None, done=None):
+    """Run the hash and copy stages
+    
+    A source on the Store's filesystem is hashed (once, or not at all if
+    it was hashed when uploaded) and not copied.  Any other source is
+    hashed while it is copied to staging, so it is read only once; the
+    check for a file the entity already has happens after the copy.
+    
+    @param entity: webui.models.Entity
+    @param src_path: str
+    @param role: str File role
+    @param log: DDR.ingest.AddFileLogger
+    @param progress: webui.tasks.common.TaskProgress (optional)
+    @param done: dict (optional) Checkpoints of this ingest, if already read
+    @returns: dict {stage: data}
+    """
+    key = ingest_key(src_path)
+    if done is None:
+        done = checkpoints(log, key)
+    if 'stage' in done:
+        # file is in the repo; staged copy no longer needed
+        return done
+    
+    if on_store(src_path):
+        log.ok('%s is on the Store, not staging' % src_path)
+        if 'hash' not in done:
+            if progress:
+                progress.start('hash')
+            # uploads are hashed as they arrive (webui.uploads)
+            hashed = checksums.known_checksums(src_path, HASH_ALGORITHMS) \
+                or checksums.file_checksums(src_path, HASH_ALGORITHMS)
+            done['hash'] = {'size': hashed['size'], 'sha1': hashed['sha1']}
+            log.ok('| sha1: %s' % done['hash']['sha1'])
+            _check_new(entity, role, done, log)
+            checkpoint(log, key, 'hash', done['hash'])
+        else:
+            log.ok('resume: %s hash done' % key)
+        done['copy'] = {'path': src_path}
+        return done
+    
+    staged = staging_path(key, src_path)
+    if ('copy' not in done) or not os.path.exists(done['copy']['path']):
+        if progress:
+            progress.start('copy', total=os.path.getsize(src_path))
+        log.ok('Copying %s -> %s' % (src_path, staged))
+        hashed = copy_file(src_path, staged, progress=progress)
+        done['hash'] = {'size': hashed['size'], 'sha1': hashed['sha1']}
+        log.ok('| sha1: %s' % done['hash']['sha1'])
+        try:
+            _check_new(entity, role, done, log)
+        except Exception:
+            os.remove(staged)
+            raise
+        checkpoint(log, key, 'hash', done['hash'])
+        done['copy'] = {'path': staged}
+        checkpoint(log, key, 'copy', done['copy'])
+    else:
+        log.ok('resume: %s copy done' % key)
+    return done
+
+def _stage(entity, key, role, data, done, git_name, git_mail, agent, log):
+    """Run the stage stage (see finish)
+    
+    @returns: (webui.models.File, repo, log)
+    """
+    if 'stage' not in done:
+        file_,repo,log = entity.add_local_file(
+            done['copy']['path'], role, data,
+            git_name, git_mail, agent=agent
+        )
+        done['stage'] = {'file_id': file_.id}
+        checkpoint(log, key, 'stage', done['stage'])
+    else:
+        log.ok('resume: %s stage done' % key)
+        file_ = File.from_identifier(Identifier(id=done['stage']['file_id']))
+        repo = dvcs.repository(entity.collection_path)
+    return file_,repo,log
+
+def finish(entity, src_path, role, data, git_name, git_mail, agent, log, progress=None):
+    """Run the stage, commit, and index stages
+    
+    Runs prepare() first if it has not been done (e.g. retry of an older task).
+    
+    @returns: webui.models.File
+    """
+    key = ingest_key(src_path)
+    done = prepare(entity, src_path, role, log, progress=progress)
+    
+    if progress:
+        progress.start('stage')
+    file_,repo,log = _stage(
+        entity, key, role, data, done, git_name, git_mail, agent, log
+    )
+    
+    if 'commit' not in done:
+        if progress:
+            progress.start('commit')
+        file_,repo,log = entity.add_file_commit(
+            file_, repo, log,
+            git_name, git_mail, agent=agent
+        )
+        checkpoint(log, key, 'commit', {'file_id': file_.id})
+    else:
+        log.ok('resume: %s commit done' % key)
+    
+    if 'index' not in done:
+        if progress:
+            progress.start('index')
+        log.ok('Updating Elasticsearch')
+        if settings.DOCSTORE_ENABLED:
+            try:
+                result = file_.post_json()
+                log.ok('| %s' % result)
+            except ConnectionError as err:
+                log.not_ok("ConnectionError: {0}".format(err))
+            except RequestError as err:
+                log.not_ok("RequestError: {0}".format(err))
+        checkpoint(log, key, 'index', {'file_id': file_.id})
+    
+    shutil.rmtree(
+        os.path.dirname(staging_path(key, src_path)), ignore_errors=True
+    )
+    # source was a resumable upload; it is in the annex now
+    uploads.discard(src_path)
+    return file_
+
+def batch(entity, src_paths, role, data, git_name, git_mail, agent, log, progress=None, workers=BATCH_WORKERS):
+    """Add several files to an entity with one commit and one index request
+    
+    Files are hashed and copied to staging in a thread pool, then staged
+    one by one, committed together, and
+    posted to Elasticsearch in one bulk request.  Nothing is staged if any
+    file is already in the entity or if two of the files are identical.
+    Uses the same checkpoints as finish() so a retry skips finished work.
+    
+    Access files are still made one at a time: DDR makes each one inside
+    Entity.add_local_file, which cannot be handed access files made in
+    parallel by webui.access.
+    
+    @param entity: webui.models.Entity
+    @param src_paths: list of absolute paths
+    @param role: str File role
+    @param data: dict Form data for all files; sort is incremented per file
+    @param git_name: str
+    @param git_mail: str
+    @param agent: str
+    @param log: DDR.ingest.AddFileLogger
+    @param progress: webui.tasks.common.TaskProgress (optional)
+    @param workers: int Threads for hashing and copying
+    @returns: list of webui.models.File
+    """
+    keys = [ingest_key(src_path) for src_path in src_paths]
+    log.ok('Batch of %s files' % len(src_paths))
+    
+    if progress:
+        progress.start('prepare', total=len(src_paths))
+    # log is read once for the whole batch, not once per file
+    logged = read_checkpoints(log)
+    prepared = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(
+                prepare, entity, src_path, role, log,
+                done=dict(logged.get(keys[n], {}))
+            ): src_path
+            for n,src_path in enumerate(src_paths)
+        }
+        for future in as_completed(futures):
+            prepared[futures[future]] = future.result()
+            if progress:
+                progress.step()
+    file_ids = [prepared[src_path]['hash']['file_id'] for src_path in src_paths]
+    duplicates = sorted(set([fid for fid in file_ids if file_ids.count(fid) > 1]))
+    if duplicates:
+        log.crash('Batch contains identical files: %s' % ', '.join(duplicates))
+    
+    if progress:
+        progress.start('stage', total=len(src_paths))
+    sort = int(data.get('sort') or 1)
+    files = []
+    for n,src_path in enumerate(src_paths):
+        file_data = dict(data)
+        file_data['basename_orig'] = os.path.basename(src_path)
+        file_data['sort'] = sort + n
+        file_,repo,log = _stage(
+            entity, keys[n], role, file_data, prepared[src_path],
+            git_name, git_mail, agent, log
+        )
+        files.append(file_)
+        if progress:
+            progress.step()
+    
+    # one checkpoint for the whole batch
+    batch_key = hashlib.md5(':'.join(keys).encode('utf-8')).hexdigest()[:10]
+    done = logged.get(batch_key, {})
+    if 'commit' not in done:
+        if progress:
+            progress.start('commit')
+        # commits everything staged above
+        file_,repo,log = entity.add_file_commit(
+            files[-1], repo, log,
+            git_name, git_mail, agent=agent
+        )
+        checkpoint(log, batch_key, 'commit', {'files': file_ids})
+    else:
+        log.ok('resume: %s commit done' % batch_key)
+    
+    if 'index' not in done:
+        if progress:
+            progress.start('index')
+        log.ok('Updating Elasticsearch')
+        if settings.DOCSTORE_ENABLED:
+            try:
+                result = docstore.Docstore().post_bulk(files)
+                log.ok('| %s' % (result,))
+            except ConnectionError as err:
+                log.not_ok("ConnectionError: {0}".format(err))
+            except RequestError as err:
+                log.not_ok("RequestError: {0}".format(err))
+        checkpoint(log, batch_key, 'index', {'files': file_ids})
+    
+    for n,src_path in enumerate(src_paths):
+        shutil.rmtree(
+            os.path.dirname(staging_path(keys[n], src_path)), ignore_errors=True
+        )
+    return files
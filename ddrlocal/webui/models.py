@@ -16,6 +16,7 @@ from DDR import commands
 from DDR import dvcs
 from DDR import fileio
 from DDR import modules
+from DDR.identifier import CHILDREN
 from DDR.models.common import from_json
 from DDR.models.common import Stub as DDRStub
 from DDR.models import Collection as DDRCollection
@@ -23,6 +24,7 @@ from DDR.models import Entity as DDREntity
 from DDR.models import File as DDRFile
 
 from webui import docstore
+from webui import fulltext
 from webui import gitstatus
 from webui import WEBUI_MESSAGES
 from webui import COLLECTION_CHILDREN_CACHE_KEY
@@ -188,19 +190,20 @@ def make_links(oi, d, request, source='fs', is_detail=False):
         img_present = image_present(oi)
     
     links = OrderedDict()
+    urls = url_templates(request)
     
     try:
-        links['ui'] = reverse('webui-%s' % oi.model, args=([oi.id]), request=request)
+        links['ui'] = urls.url('webui-%s' % oi.model, oi.id)
     except NoReverseMatch:
         links['ui'] = ''
     
-    links['api'] = reverse('api-%s-detail' % source, args=([oi.id]), request=request)
+    links['api'] = urls.url('api-%s-detail' % source, oi.id)
     
     # links to opposite
     if source == 'es':
-        links['file'] = reverse('api-fs-detail', args=([oi.id]), request=request)
+        links['file'] = urls.url('api-fs-detail', oi.id)
     elif source == 'fs':
-        links['elastic'] = reverse('api-es-detail', args=([oi.id]), request=request)
+        links['elastic'] = urls.url('api-es-detail', oi.id)
     
     if is_detail:
         # objects above the collection level are stubs and do not have collection_id
@@ -211,10 +214,10 @@ def make_links(oi, d, request, source='fs', is_detail=False):
         else:
             parent_id = oi.parent_id(stubs=1)
         if parent_id:
-            links['parent'] = reverse('api-%s-detail' % source, args=[parent_id], request=request)
+            links['parent'] = urls.url('api-%s-detail' % source, parent_id)
      
         if child_models:
-            links['children'] = reverse('api-%s-children' % source, args=([oi.id]), request=request)
+            links['children'] = urls.url('api-%s-children' % source, oi.id)
         else:
             links['children'] = ''
 
@@ -325,6 +328,7 @@ class Collection( DDRCollection ):
         """
         return reverse('webui-collection', args=[self.id])
     
+    def access_backfill_url(self): return reverse('webui-collection-access-backfill', args=[self.id])
     def admin_url(self): return reverse('webui-collection-admin', args=[self.id])
     def changelog_url(self): return reverse('webui-collection-changelog', args=[self.id])
     def check_url(self): return reverse('webui-collection-check', args=[self.id])
@@ -400,6 +404,12 @@ class Collection( DDRCollection ):
         cache.delete(COLLECTION_STATUS_CACHE_KEY % self.id)
         cache.delete(COLLECTION_ANNEX_STATUS_CACHE_KEY % self.id)
     
+    def post_json(self):
+        """Post to docstore; also updates the local fulltext index
+        """
+        fulltext.post(self)
+        return super(Collection, self).post_json()
+    
     def repo_fetch( self ):
         key = COLLECTION_FETCH_CACHE_KEY % self.id
         data = cache.get(key)
@@ -475,6 +485,7 @@ class Collection( DDRCollection ):
         
         # [delete cache], update search index
         #collection.cache_delete()
+        fulltext.post(collection)
         if settings.DOCSTORE_ENABLED:
             try:
                 docstore.Docstore().post(collection)
@@ -504,6 +515,7 @@ class Collection( DDRCollection ):
         )
         
         self.cache_delete()
+        fulltext.post(self)
         if settings.DOCSTORE_ENABLED:
             try:
                 docstore.Docstore().post(self)
@@ -555,6 +567,12 @@ class Entity( DDREntity ):
     def absolute_url( self ):
         return reverse('webui-entity', args=[self.id])
     
+    def post_json(self):
+        """Post to docstore; also updates the local fulltext index
+        """
+        fulltext.post(self)
+        return super(Entity, self).post_json()
+    
     def addfilelog_url(self): return reverse('webui-entity-addfilelog', args=[self.id])
     def changelog_url(self): return reverse('webui-entity-changelog', args=[self.id])
     def delete_url(self): return reverse('webui-entity-delete', args=[self.id])
@@ -567,9 +585,11 @@ class Entity( DDREntity ):
         return reverse('webui-file-role', args=[ '-'.join([self.id, role]) ])
     
     def file_batch_url(self, role):
-        args = [a for a in self.idparts]
-        args.append(role)
-        return reverse('webui-file-batch', args=args)
+        idparts = self.identifier.idparts
+        idparts['model'] = 'file-role'
+        idparts['role'] = role
+        ri = Identifier(idparts)
+        return reverse('webui-file-batch', args=[ri.id])
     
     def file_browse_url(self, role):
         idparts = self.identifier.idparts
@@ -735,6 +755,7 @@ class Entity( DDREntity ):
 
         # delete cache, update search index
         collection.cache_delete()
+        fulltext.post(entity)
         if settings.DOCSTORE_ENABLED:
             try:
                 docstore.Docstore().post(entity)
@@ -768,6 +789,7 @@ class Entity( DDREntity ):
         )
         
         collection.cache_delete()
+        fulltext.post(self)
         if settings.DOCSTORE_ENABLED:
             try:
                 docstore.Docstore().post(self)
@@ -919,76 +941,110 @@ class File( DDRFile ):
         return exit,status,updated_files
 
 
+class URLTemplates(object):
+    """Absolute URLs for fixed route patterns without calling reverse() per object
+    
+    Each route is reversed once with a placeholder ID and split into
+    prefix and suffix; building a URL is then string concatenation.
+    Only for routes that take a single slug argument.
+    
+    >>> urls = URLTemplates(request)
+    >>> urls.url('api-object', 'ddr-densho-10-1')
+    'http://HOST/api/0.2/ddr-densho-10-1/'
+    """
+    PLACEHOLDER = 'URLTEMPLATEOID'
+    
+    def __init__(self, request):
+        self.request = request
+        self.templates = {}
+    
+    def url(self, name, oid):
+        """
+        @param name: str URL name
+        @param oid: str Object ID
+        @returns: str
+        """
+        if name not in self.templates:
+            url = reverse(name, args=[self.PLACEHOLDER], request=self.request)
+            self.templates[name] = url.split(self.PLACEHOLDER, 1)
+        prefix,suffix = self.templates[name]
+        return prefix + oid + suffix
+
+def url_templates(request):
+    """URLTemplates for request, created once per request
+    
+    @param request: HttpRequest or RestRequest
+    @returns: URLTemplates
+    """
+    if request is None:
+        return URLTemplates(request)
+    if not getattr(request, '_url_templates', None):
+        request._url_templates = URLTemplates(request)
+    return request._url_templates
+
+# don't hide role, used in file list-object
+DETAIL_HIDDEN_FIELDS = ['repo','org','cid','eid','sid','sha1']
+
 def format_object_detail(document, request, listitem=False):
     """Formats repository objects, adds list URLs,
+    
+    Fields consumed by the formatter are tracked rather than popped
+    so the source document is not modified and is only walked once.
+    URLs are built from URLTemplates rather than with reverse().
     """
     if document.get('_source'):
         oid = document['_id']
         model = document['_index']
         document = document['_source']
+        used = set()
     else:
-        oid = document.pop('id')
-        model = document.pop('model')
+        oid = document['id']
+        model = document['model']
+        used = {'id', 'model'}
     model = model.replace(docstore.INDEX_PREFIX, '')
+    urls = url_templates(request)
     
     d = OrderedDict()
     d['id'] = oid
     d['model'] = model
-    if document.get('index'): d['index'] = document.pop('index')
+    if document.get('index'):
+        d['index'] = document['index']
+        used.add('index')
     
     if not listitem:
         d['collection_id'] = document.get('collection_id')
     # links
-    d['links'] = OrderedDict()
-    d['links']['html'] = reverse(
-        'webui-detail', args=[document.pop('links_html')], request=request
-    )
-    d['links']['json'] = reverse(
-        'api-object', args=[document.pop('links_json')], request=request
-    )
+    links = d['links'] = OrderedDict()
+    links['html'] = urls.url('webui-detail', document['links_html'])
+    links['json'] = urls.url('api-object', document['links_json'])
+    used.update(['links_html', 'links_json', 'links_img'])
     if document.get('mimetype') and ('text' in document['mimetype']):
-        d['links']['download'] = '%s%s' % (
-            settings.MEDIA_URL, document.pop('links_img')
-        )
+        links['download'] = '%s%s' % (settings.MEDIA_URL, document['links_img'])
     else:
-        d['links']['img'] = '%s%s' % (
-            settings.MEDIA_URL, document.pop('links_img')
-        )
-        d['links']['thumb'] = '%s%s' % (
-            settings.MEDIA_URL, document.pop('links_thumb')
-        )
+        links['img'] = '%s%s' % (settings.MEDIA_URL, document['links_img'])
+        links['thumb'] = '%s%s' % (settings.MEDIA_URL, document['links_thumb'])
+        used.add('links_thumb')
         if document.get('links_download'):
-            d['links']['download'] = '%s%s' % (
-                settings.MEDIA_URL, document.pop('links_download')
-            )
+            links['download'] = '%s%s' % (settings.MEDIA_URL, document['links_download'])
+            used.add('links_download')
     
     if not listitem:
         if document.get('parent_id'):
-            d['links']['parent'] = reverse(
-                'api-object',
-                args=[document.pop('links_parent')],
-                request=request
-            )
-        if CHILDREN[model]:
+            links['parent'] = urls.url('api-object', document['links_parent'])
+            used.add('links_parent')
+        if CHILDREN.get(model):
             if model in ['entity', 'segment']:
-                d['links']['children-objects'] = reverse(
-                    'api-object-children',
-                    args=[document['links_children']],
-                    request=request
+                links['children-objects'] = urls.url(
+                    'api-object-children', document['links_children']
                 )
-                d['links']['children-files'] = reverse(
-                    'api-object-nodes',
-                    args=[document['links_children']],
-                    request=request
+                links['children-files'] = urls.url(
+                    'api-object-nodes', document['links_children']
                 )
-                document.pop('links_children')
             else:
-                d['links']['children'] = reverse(
-                    'api-object-children',
-                    args=[document['links_children']],
-                    request=request
+                links['children'] = urls.url(
+                    'api-object-children', document['links_children']
                 )
-                document.pop('links_children')
+            used.add('links_children')
         d['parent_id'] = document.get('parent_id', '')
         d['organization_id'] = document.get('organization_id', '')
         # gfroh: every object must have signature_id
@@ -999,23 +1055,17 @@ def format_object_detail(document, request, listitem=False):
     d['description'] = document['description']
     if not listitem:
         if document.get('lineage'):
-            crumbs = [c for c in document.pop('lineage')[::-1]]
+            # copies; the document's lineage is left as it is
+            crumbs = [dict(c) for c in document['lineage'][::-1]]
             for c in crumbs:
-                c['api_url'] = reverse(
-                    'api-object', args=[c['id']], request=request
-                )
-                c['url'] = reverse(
-                    'webui-detail', args=[c['id']], request=request
-                )
+                c['api_url'] = urls.url('api-object', c['id'])
+                c['url'] = urls.url('webui-detail', c['id'])
             d['breadcrumbs'] = crumbs
+            used.add('lineage')
     # everything else
-    HIDDEN_FIELDS = [
-        'repo','org','cid','eid','sid','sha1'
-         # don't hide role, used in file list-object
-    ]
-    for key in document.keys():
-        if key not in HIDDEN_FIELDS:
-            d[key] = document[key]
+    for key,val in document.items():
+        if (key not in used) and (key not in DETAIL_HIDDEN_FIELDS):
+            d[key] = val
     return d
 
 FORMATTERS = {
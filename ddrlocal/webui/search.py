@@ -2,6 +2,7 @@
 
 from collections import OrderedDict
 from copy import deepcopy
+import hashlib
 import json
 import logging
 logger = logging.getLogger(__name__)
@@ -9,6 +10,7 @@ import os
 import re
 from urllib.parse import urlparse, urlunsplit
 
+from elasticsearch.exceptions import TransportError
 from elasticsearch_dsl import Index, Search, A, Q
 from elasticsearch_dsl.query import Match, MultiMatch, QueryString
 from elasticsearch_dsl.connections import connections
@@ -17,11 +19,15 @@ from rest_framework.request import Request as RestRequest
 from rest_framework.reverse import reverse
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.paginator import Paginator
 from django.http.request import HttpRequest
 
 #from DDR import vocab
 from webui import docstore
+from webui import fulltext
+from webui import SEARCH_AGGS_CACHE_KEY
+from webui import SEARCH_AGGS_TIMEOUT
 #from ui import models
 
 #SEARCH_LIST_FIELDS = models.all_list_fields()
@@ -88,6 +94,23 @@ SEARCH_AGG_FIELDS = {
     'topics': 'topics.id',
 }
 
+# Aggregations policies for Searcher.prepare
+# none:      no aggregations (API default; facet counts are fetched separately)
+# requested: only the SEARCH_AGG_FIELDS named in the request
+# all:       every field in SEARCH_AGG_FIELDS
+AGGS_NONE = 'none'
+AGGS_REQUESTED = 'requested'
+AGGS_ALL = 'all'
+AGGS_POLICIES = [AGGS_NONE, AGGS_REQUESTED, AGGS_ALL]
+
+# params that do not change aggregations and are left out of cache keys
+AGGS_CACHE_IGNORE_PARAMS = ['page', 'limit', 'offset', 'aggs', 'facets', 'sort']
+
+# Streaming exports
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+SCROLL_KEEPALIVE = '5m'
+SCROLL_SIZE = 1000
+
 # TODO move to ddr-defs/repo_models/elastic.py?
 SEARCH_MODELS = [
     'ddrcollection',
@@ -240,6 +263,209 @@ def es_host_name(conn):
 def es_search():
     return Search(using=DOCSTORE.es)
 
+def agg_fields(policy, fields_agg=SEARCH_AGG_FIELDS, requested=[]):
+    """Fields from fields_agg to aggregate under the specified policy
+    
+    >>> agg_fields('none')
+    {}
+    >>> agg_fields('requested', requested=['genre', 'bogus'])
+    {'genre': 'genre'}
+    >>> agg_fields('all')
+    {'facility': 'facility.id', 'format': 'format', ...}
+    
+    @param policy: str One of AGGS_POLICIES
+    @param fields_agg: dict See SEARCH_AGG_FIELDS
+    @param requested: list Fieldnames (used with AGGS_REQUESTED)
+    @returns: dict
+    """
+    if policy == AGGS_NONE:
+        return {}
+    elif policy == AGGS_REQUESTED:
+        return {
+            fieldname: field
+            for fieldname,field in fields_agg.items()
+            if fieldname in requested
+        }
+    elif policy == AGGS_ALL:
+        return fields_agg
+    raise Exception('Unknown aggregations policy "%s"' % policy)
+
+def list_param(text):
+    """Parse list of fieldnames from comma-separated URL param
+    
+    >>> list_param('topics,genre')
+    ['topics', 'genre']
+    >>> list_param(['topics', 'genre'])
+    ['topics', 'genre']
+    
+    @param text: str or list
+    @returns: list
+    """
+    if not text:
+        return []
+    if isinstance(text, str):
+        text = text.split(',')
+    return [fieldname.strip() for fieldname in text if fieldname.strip()]
+
+def parse_aggregations(results):
+    """Extract buckets for each aggregation from search results
+    
+    Buckets are converted to plain dicts so they can be cached
+    and serialized by the API.
+    
+    @param results: elasticsearch_dsl.response.Response
+    @returns: dict {fieldname: [{'key': ..., 'doc_count': ...}, ...]}
+    """
+    aggregations = {}
+    if hasattr(results, 'aggregations'):
+        for field in results.aggregations.to_dict().keys():
+            
+            # nested aggregations
+            if field in ['topics', 'facility']:
+                field_ids = '{}_ids'.format(field)
+                aggs = results.aggregations[field]
+                buckets = aggs[field_ids].buckets
+             
+            # simple aggregations
+            else:
+                aggs = results.aggregations[field]
+                buckets = aggs.buckets
+            
+            aggregations[field] = [bucket.to_dict() for bucket in buckets]
+    return aggregations
+
+def scan_ndjson(s, fields=[], scroll=SCROLL_KEEPALIVE, size=SCROLL_SIZE):
+    """Stream every document matched by a Search as newline-delimited JSON
+    
+    Uses the scroll API (Search.scan) so memory use is constant no
+    matter how many documents match.  Documents are emitted in index
+    order, not score or sort order.
+    
+    >>> s = Search(using=DOCSTORE.es, index='ddrentity').query('match', parent_id='ddr-test-123')
+    >>> for line in scan_ndjson(s, fields=['id', 'title']):
+    ...     print(line)
+    b'{"id": "ddr-test-123-1", "title": "..."}\\n'
+    
+    @param s: elasticsearch_dsl.Search
+    @param fields: list (optional) Only return these fields
+    @param scroll: str Scroll context keepalive
+    @param size: int Documents per scroll request
+    @returns: generator of bytes
+    """
+    if fields:
+        s = s.source(fields)
+    s = s.params(scroll=scroll, size=size)
+    for hit in s.scan():
+        doc = hit.to_dict()
+        if (not fields) or ('id' in fields):
+            doc.setdefault('id', hit.meta.id)
+        yield (json.dumps(doc) + '\n').encode('utf-8')
+
+def _fulltext_args(params, search_models):
+    """Convert Searcher params to webui.fulltext.search args
+    """
+    def first(val):
+        if isinstance(val, list):
+            return val[0] if val else None
+        return val
+    return {
+        'fulltext': first(params.get('fulltext')),
+        'parent': first(params.get('parent')),
+        'models': [
+            model.replace(docstore.INDEX_PREFIX, '') for model in search_models
+        ],
+        'terms': {
+            key: val for key,val in params.items()
+            if (key in fulltext.TERM_FIELDS) and val
+        },
+    }
+
+def fulltext_results(params, search_models, limit, offset):
+    """SearchResults from the local fulltext index (see webui.fulltext)
+    
+    Used by Searcher when Elasticsearch is disabled or cannot be reached.
+    
+    @param params: dict Searcher.params
+    @param search_models: list
+    @param limit: int
+    @param offset: int
+    @returns: SearchResults
+    """
+    args = _fulltext_args(params, search_models)
+    total,documents = fulltext.search(limit=limit, offset=offset, **args)
+    results = SearchResults(
+        params=params,
+        query={'fulltext_index': args},
+        count=total,
+        limit=limit,
+        offset=offset,
+    )
+    results.objects = [fulltext.Hit(document) for document in documents]
+    for n,hit in enumerate(results.objects):
+        hit.index = '%s %s/%s' % (n, int(offset)+n, total)
+    results.aggregations = {}
+    return results
+
+def aggs_cache_key(params, search_models=SEARCH_MODELS):
+    """Cache key for aggregations of a query
+    
+    Pagination and sorting params do not change aggregations so
+    all pages of a query share the same key.
+    
+    @param params: dict or QueryDict
+    @param search_models: list
+    @returns: str
+    """
+    if hasattr(params, 'lists'):
+        # QueryDict
+        items = list(params.lists())
+    else:
+        items = list(params.items())
+    data = {
+        'params': sorted([
+            [key,val] for key,val in items
+            if key not in AGGS_CACHE_IGNORE_PARAMS
+        ]),
+        'models': sorted(search_models),
+    }
+    digest = hashlib.md5(
+        json.dumps(data, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+    return SEARCH_AGGS_CACHE_KEY % digest
+
+def cached_aggregations(params, search_models=SEARCH_MODELS, fields_agg=SEARCH_AGG_FIELDS, timeout=SEARCH_AGGS_TIMEOUT):
+    """Facet counts for a query, from cache if available
+    
+    Runs a separate size=0 query that returns only aggregations
+    so that paging through results does not recompute them.
+    
+    @param params: dict or QueryDict
+    @param search_models: list
+    @param fields_agg: dict See SEARCH_AGG_FIELDS
+    @param timeout: int Cache timeout (seconds)
+    @returns: dict See parse_aggregations
+    """
+    key = aggs_cache_key(params, search_models)
+    cached = cache.get(key)
+    if cached is None:
+        searcher = Searcher()
+        searcher.prepare(
+            params=params,
+            params_whitelist=SEARCH_PARAM_WHITELIST,
+            search_models=search_models,
+            fields=SEARCH_INCLUDE_FIELDS,
+            fields_nested=SEARCH_NESTED_FIELDS,
+            fields_agg=fields_agg,
+            aggs=AGGS_ALL,
+        )
+        aggregations = searcher.aggregations()
+        if searcher.fallback:
+            # only cache the real thing; ES may be back on the next request
+            return aggregations
+        cached = aggregations
+        cache.set(key, cached, timeout)
+    return cached
+
 
 class ESPaginator(Paginator):
     """
@@ -291,45 +517,7 @@ class SearchResults(object):
                 self.total = results.hits.total.value
 
             # aggregations
-            self.aggregations = {}
-            if hasattr(results, 'aggregations'):
-                for field in results.aggregations.to_dict().keys():
-                    
-                    # nested aggregations
-                    if field in ['topics', 'facility']:
-                        field_ids = '{}_ids'.format(field)
-                        aggs = results.aggregations[field]
-                        self.aggregations[field] = aggs[field_ids].buckets
-                     
-                    # simple aggregations
-                    else:
-                        aggs = results.aggregations[field]
-                        self.aggregations[field] = aggs.buckets
-
-                    #if VOCAB_TOPICS_IDS_TITLES.get(field):
-                    #    self.aggregations[field] = []
-                    #    for bucket in buckets:
-                    #        if bucket['key'] and bucket['doc_count']:
-                    #            self.aggregations[field].append({
-                    #                'key': bucket['key'],
-                    #                'label': VOCAB_TOPICS_IDS_TITLES[field].get(str(bucket['key'])),
-                    #                'doc_count': str(bucket['doc_count']),
-                    #            })
-                    #            # print topics/facility errors in search results
-                    #            # TODO hard-coded
-                    #            if (field in ['topics', 'facility']) and not (isinstance(bucket['key'], int) or bucket['key'].isdigit()):
-                    #                self.errors.append(bucket)
-                    # 
-                    #else:
-                    #    self.aggregations[field] = [
-                    #        {
-                    #            'key': bucket['key'],
-                    #            'label': bucket['key'],
-                    #            'doc_count': str(bucket['doc_count']),
-                    #        }
-                    #        for bucket in buckets
-                    #        if bucket['key'] and bucket['doc_count']
-                    #    ]
+            self.aggregations = parse_aggregations(results)
 
         elif objects:
             # objects
@@ -442,10 +630,10 @@ class SearchResults(object):
         if pad:
             data['objects'] += [{'n':n} for n in range(0, self.page_start)]
         # page
+        objects = data['objects']
         for o in self.objects:
-            format_function = format_functions[o.meta.index]
-            data['objects'].append(
-                format_function(
+            objects.append(
+                format_functions[o.meta.index](
                     document=o.to_dict(),
                     request=request,
                     listitem=True,
@@ -537,6 +725,8 @@ class Searcher(object):
         """
         self.conn = conn
         self.s = search
+        # aggregations came from the fulltext index
+        self.fallback = False
         fields = []
         params = {}
         q = OrderedDict()
@@ -548,7 +738,7 @@ class Searcher(object):
             es_host_name(self.conn), self.params
         )
 
-    def prepare(self, params={}, params_whitelist=SEARCH_PARAM_WHITELIST, search_models=SEARCH_MODELS, fields=SEARCH_INCLUDE_FIELDS, fields_nested=SEARCH_NESTED_FIELDS, fields_agg=SEARCH_AGG_FIELDS):
+    def prepare(self, params={}, params_whitelist=SEARCH_PARAM_WHITELIST, search_models=SEARCH_MODELS, fields=SEARCH_INCLUDE_FIELDS, fields_nested=SEARCH_NESTED_FIELDS, fields_agg=SEARCH_AGG_FIELDS, aggs=AGGS_ALL, aggs_requested=[]):
         """Assemble elasticsearch_dsl.Search object
         
         @param params:           dict
@@ -557,6 +747,8 @@ class Searcher(object):
         @param fields:           list Retrieve these fields (SEARCH_INCLUDE_FIELDS)
         @param fields_nested:    list See SEARCH_NESTED_FIELDS
         @param fields_agg:       dict See SEARCH_AGG_FIELDS
+        @param aggs:             str Aggregations policy (AGGS_POLICIES)
+        @param aggs_requested:   list Fieldnames to aggregate if aggs=AGGS_REQUESTED
         @returns: 
         """
 
@@ -581,6 +773,7 @@ class Searcher(object):
         for key in bad_fields:
             params.pop(key)
         
+        self.search_models = search_models
         indices = search_models
         if params.get('models'):
             indices = ','.join([DOCSTORE.index_name(model) for model in models])
@@ -680,7 +873,8 @@ class Searcher(object):
                 # 'term' search is for single choice, not multiple choice fields(?)
         
         # aggregations
-        for fieldname,field in fields_agg.items():
+        self.fields_agg = agg_fields(aggs, fields_agg, aggs_requested)
+        for fieldname,field in self.fields_agg.items():
             
             # nested aggregation (Elastic docs: https://goo.gl/xM8fPr)
             if fieldname == 'topics':
@@ -710,8 +904,14 @@ class Searcher(object):
         """
         if not self.s:
             raise Exception('Searcher has no ES Search object.')
+        if not settings.DOCSTORE_ENABLED:
+            return fulltext_results(self.params, self.search_models, limit, offset)
         start,stop = start_stop(limit, offset)
-        response = self.s[start:stop].execute()
+        try:
+            response = self.s[start:stop].execute()
+        except TransportError as err:
+            logger.error('Elasticsearch error, using fulltext index: %s' % err)
+            return fulltext_results(self.params, self.search_models, limit, offset)
         for n,hit in enumerate(response.hits):
             hit.index = '%s %s/%s' % (n, int(offset)+n, response.hits.total)
         return SearchResults(
@@ -721,3 +921,24 @@ class Searcher(object):
             limit=limit,
             offset=offset,
         )
+    
+    def aggregations(self):
+        """Execute query for aggregations only (no hits)
+        
+        Sets self.fallback if they come from the local fulltext index.
+        
+        @returns: dict See parse_aggregations
+        """
+        if not self.s:
+            raise Exception('Searcher has no ES Search object.')
+        if settings.DOCSTORE_ENABLED:
+            self.fallback = False
+            try:
+                return parse_aggregations(self.s[0:0].execute())
+            except TransportError as err:
+                logger.error('Elasticsearch error, using fulltext index: %s' % err)
+        self.fallback = True
+        return fulltext.aggregations(
+            fields=list(self.fields_agg.keys()),
+            **_fulltext_args(self.params, self.search_models)
+        )
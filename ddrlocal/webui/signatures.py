@@ -0,0 +1,291 @@
+"""
+signatures
+
+Incremental signature selection for large collections.
+
+DDR.signatures.find_updates reads every object in the collection on
+every run.  This module keeps a per-collection index, in the Store's tmp/
+dir next to the gitstatus files, of each entity's candidate signature
+files (role, sort, and ID of every file under the entity) and its current
+signature_id, plus the commit at which signatures were last brought up
+to date.
+
+Each run asks git which object JSONs changed since that commit and
+re-reads only the entities they belong to.  Entities whose candidates and
+signature_id are the same as in the index are skipped; for the others,
+DDR's own selection (DDR.signatures.find_updates) is run on the entity
+alone.  The collection's signature is chosen from its entities, so the
+whole collection is only re-read when collection.json changed, entities
+were added or removed, or a touched entity's signature changed.  Only
+the objects DDR reports as changed are written, and they are committed
+in one batch with DDR.signatures.commit_updates.
+
+>>> from webui import signatures
+>>> updates,index = signatures.find_updates(collection)
+>>> updates
+[]
+"""
+
+import json
+import logging
+logger = logging.getLogger(__name__)
+import os
+
+from django.conf import settings
+
+from DDR import dvcs
+from DDR import signatures as ddr_signatures
+
+from webui import gitstatus
+from webui.identifier import Identifier
+from webui.models import Entity
+from webui.util import load_json
+
+OBJECT_JSON_FILES = ['collection.json', 'entity.json']
+
+
+def index_path(base_dir, collection_path):
+    """
+    - STORE/tmp/ddr-test-123.signatures.json
+    """
+    return os.path.join(
+        gitstatus.tmp_dir(base_dir),
+        '%s.signatures.json' % os.path.basename(os.path.normpath(collection_path))
+    )
+
+def read_index(base_dir, collection_path):
+    """
+    @returns: dict {'commit': str, 'entities': {reldir: entry}} or None
+    """
+    path = index_path(base_dir, collection_path)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            try:
+                return json.loads(f.read())
+            except ValueError:
+                logger.error('Bad signatures index %s' % path)
+    return None
+
+def write_index(base_dir, collection_path, index):
+    with open(index_path(base_dir, collection_path), 'w') as f:
+        f.write(json.dumps(index))
+
+def object_dir(relpath):
+    """Dir of the object a changed path belongs to, or None
+    
+    >>> object_dir('files/ddr-test-123-4/entity.json')
+    'files/ddr-test-123-4'
+    >>> object_dir('files/ddr-test-123-4/files/ddr-test-123-4-master-a1b2c3d4e5.json')
+    'files/ddr-test-123-4'
+    >>> object_dir('files/ddr-test-123-4/files/ddr-test-123-4-master-a1b2c3d4e5.jpg')
+    
+    """
+    dirname,filename = os.path.split(relpath)
+    if filename in OBJECT_JSON_FILES:
+        return dirname
+    if filename.endswith('.json') and (os.path.basename(dirname) == 'files'):
+        return os.path.dirname(dirname)
+    return None
+
+def entity_dir(relpath):
+    """Dir of the top-level entity a changed path belongs to, or None
+    
+    Segments and their files belong to their parent entity.
+    
+    >>> entity_dir('files/ddr-test-123-4/files/ddr-test-123-4-5/entity.json')
+    'files/ddr-test-123-4'
+    >>> entity_dir('collection.json')
+    
+    """
+    reldir = object_dir(relpath)
+    if not reldir:
+        return None
+    parts = reldir.split(os.sep)
+    if (len(parts) < 2) or (parts[0] != 'files'):
+        return None
+    return os.path.join(parts[0], parts[1])
+
+def _sort(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+def read_entity(collection_path, reldir):
+    """Index entry for a top-level entity and everything under it
+    
+    @param collection_path: str
+    @param reldir: str Entity dir relative to collection_path
+    @returns: dict or None if the entity is gone
+    """
+    entity_path = os.path.join(collection_path, reldir)
+    json_path = os.path.join(entity_path, 'entity.json')
+    if not os.path.exists(json_path):
+        return None
+    data = load_json(json_path)
+    entry = {
+        'id': os.path.basename(reldir),
+        'sort': _sort(data.get('sort')),
+        'signature_id': data.get('signature_id') or '',
+        'files': [],
+        'segments': [],
+    }
+    for dirpath,dirnames,filenames in os.walk(entity_path):
+        dirnames.sort()
+        if dirpath == entity_path:
+            continue
+        if os.path.basename(dirpath) == 'files':
+            for filename in sorted(filenames):
+                if not filename.endswith('.json'):
+                    continue
+                file_id = os.path.splitext(filename)[0]
+                role = file_id.rsplit('-', 2)[-2] if file_id.count('-') > 1 else ''
+                fdata = load_json(os.path.join(dirpath, filename))
+                entry['files'].append([role, _sort(fdata.get('sort')), file_id])
+        elif 'entity.json' in filenames:
+            sdata = load_json(os.path.join(dirpath, 'entity.json'))
+            entry['segments'].append([
+                os.path.basename(dirpath),
+                _sort(sdata.get('sort')),
+                sdata.get('signature_id') or '',
+            ])
+    return entry
+
+def scan(collection_path):
+    """Index entries for every entity in the collection
+    
+    @returns: dict {reldir: entry}
+    """
+    entities = {}
+    files_dir = os.path.join(collection_path, 'files')
+    if os.path.isdir(files_dir):
+        for name in sorted(os.listdir(files_dir)):
+            reldir = os.path.join('files', name)
+            entry = read_entity(collection_path, reldir)
+            if entry:
+                entities[reldir] = entry
+    return entities
+
+def head(collection_path):
+    return dvcs.repository(collection_path).git.rev_parse('HEAD')
+
+def changed_paths(collection_path, since):
+    """Paths changed since commit, including uncommitted changes
+    
+    @param collection_path: str
+    @param since: str Commit sha
+    @returns: set of relpaths
+    """
+    repo = dvcs.repository(collection_path)
+    paths = set(repo.git.diff('--name-only', since, 'HEAD').splitlines())
+    paths.update(repo.git.ls_files(
+        '--modified', '--others', '--deleted', '--exclude-standard'
+    ).splitlines())
+    return paths
+
+def _signature(updates, oid, default):
+    """signature_id DDR chose for oid, or default if it is not updated
+    """
+    for o in updates:
+        if o.id == oid:
+            return o.signature_id
+    return default
+
+def find_updates(collection, index=None, changed=None, base_dir=None, progress=None):
+    """Objects whose signature_id should change, and the new index
+    
+    Reads the whole collection if there is no index or git cannot diff
+    from the indexed commit.  The index passed in is not modified.
+    
+    @param collection: webui.models.Collection
+    @param index: dict (optional) Defaults to stored index
+    @param changed: list (optional) Changed relpaths, instead of asking git
+    @param base_dir: str (optional) Defaults to settings.MEDIA_BASE
+    @param progress: webui.tasks.common.TaskProgress (optional)
+    @returns: (list of objects (see DDR.signatures.find_updates), index)
+    """
+    if index is None:
+        index = read_index(base_dir or settings.MEDIA_BASE, collection.path)
+    if index and (changed is None):
+        try:
+            changed = changed_paths(collection.path, index['commit'])
+        except Exception as err:
+            logger.error('Could not diff from %s: %s' % (index['commit'], err))
+    if not (index and index.get('entities') is not None and changed is not None):
+        if progress:
+            progress.start('scan')
+        entities = scan(collection.path)
+        updates = ddr_signatures.find_updates(collection)
+        return updates,{'commit': None, 'entities': entities}
+    
+    entities = dict(index['entities'])
+    dirs = sorted(set([
+        d for d in [entity_dir(path) for path in changed] if d is not None
+    ]))
+    rescan = 'collection.json' in changed
+    updates = []
+    if progress:
+        progress.start('read', total=len(dirs))
+    for reldir in dirs:
+        old = entities.get(reldir)
+        new = read_entity(collection.path, reldir)
+        if progress:
+            progress.step()
+        if new == old:
+            continue
+        if not (old and new):
+            # entity added or removed
+            rescan = True
+        if new:
+            entities[reldir] = new
+            entity = Entity.from_identifier(
+                Identifier(path=os.path.join(collection.path, reldir))
+            )
+            entity_updates = ddr_signatures.find_updates(entity)
+            updates += entity_updates
+            if old and (_signature(entity_updates, new['id'], new['signature_id'])
+                        != old['signature_id']):
+                rescan = True
+        else:
+            entities.pop(reldir)
+    if rescan:
+        # collection signature depends on its entities
+        if progress:
+            progress.start('scan')
+        updates = ddr_signatures.find_updates(collection)
+    return updates,{'commit': index['commit'], 'entities': entities}
+
+def update_signatures(collection, git_name, git_mail, agent='ddr-local', progress=None, base_dir=None):
+    """Find, write, and commit signature changes in one batch
+    
+    @param collection: webui.models.Collection
+    @param git_name: str
+    @param git_mail: str
+    @param agent: str
+    @param progress: webui.tasks.common.TaskProgress (optional)
+    @param base_dir: str (optional) Defaults to settings.MEDIA_BASE
+    @returns: (list of paths written, status, msg)
+    """
+    base_dir = base_dir or settings.MEDIA_BASE
+    updates,index = find_updates(collection, base_dir=base_dir, progress=progress)
+    if progress:
+        progress.start('write', total=len(updates))
+    written = ddr_signatures.write_updates(updates) if updates else []
+    status,msg = None,'no changes'
+    if written:
+        if progress:
+            progress.start('commit', total=len(written))
+        status,msg = ddr_signatures.commit_updates(
+            collection, written, git_name, git_mail, agent=agent
+        )
+    # index now matches the committed JSON
+    for reldir in set([
+        entity_dir(os.path.relpath(path, collection.path)) for path in written
+    ]):
+        if reldir:
+            entry = read_entity(collection.path, reldir)
+            if entry:
+                index['entities'][reldir] = entry
+    index['commit'] = head(collection.path)
+    write_index(base_dir, collection.path, index)
+    return written,status,msg
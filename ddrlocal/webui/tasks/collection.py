@@ -15,15 +15,20 @@ from django.urls import reverse
 from DDR import commands
 from DDR import converters
 from DDR import idservice
-from DDR import signatures
-from DDR import util
 
+from webui import access
+from webui import checker
 from webui import csvio
+from webui import docstore
+from webui import fulltext
 from webui import gitstatus
-from webui.models import Collection
+from webui import signatures as signatures_engine
+from webui import uploads
+from webui.models import Collection, Entity, File
 from webui.identifier import Identifier
 from webui import search
 from webui.tasks import dvcs as dvcs_tasks
+from webui.tasks.common import TaskProgress
 
 
 # ----------------------------------------------------------------------
@@ -42,27 +47,22 @@ class CollectionCheckTask(Task):
         gitstatus.log('CollectionCheckTask.after_return(%s, %s, %s, %s, %s, %s)' % (status, retval, task_id, args, kwargs, einfo))
 
 @task(base=CollectionCheckTask, name='webui.tasks.collection_check')
-def check( collection_path ):
+def check( collection_path, incremental=False ):
+    """Validates collection metadata files
+    
+    Errors are written to a JSON-lines report; see webui.checker.
+    
+    @param collection_path: Absolute path to collection repo.
+    @param incremental: Only check files changed since they last passed.
+    @returns: dict summary, with 'report' path and 'timings'
+    """
     if not os.path.exists(settings.MEDIA_BASE):
         raise Exception('base_dir does not exist: %s' % settings.MEDIA_BASE)
-    paths = util.find_meta_files(
-        collection_path, recursive=1,
-        model=None, files_first=False, force_read=False
+    progress = TaskProgress()
+    summary = checker.check_collection(
+        collection_path, incremental=incremental, progress=progress
     )
-    bad_files = util.validate_paths(paths)
-    output = [
-        'Checked %s files' % len(paths),
-    ]
-    if bad_files:
-        for item in bad_files:
-            n,path,err = item
-            output.append(
-                '%s/%s ERROR %s - %s' % (n, len(paths), path, err)
-            )
-    else:
-        output.append('No bad files.')
-    output.append('DONE')
-    return '\n'.join(output)
+    return progress.result(**summary)
 
 
 # ----------------------------------------------------------------------
@@ -121,7 +121,6 @@ class CollectionNewTask(Task):
         lockstatus = collection.unlock(task_id)
         gitstatus.update(settings.MEDIA_BASE, collection.path)
         # locking uses common name
-        gitstatus.unlock(settings.MEDIA_BASE, TASK_COLLECTION_NEW_NAME)
 
 @task(base=CollectionNewTask, name=TASK_COLLECTION_NEW_MANUAL_NAME)
 def collection_new_manual(collection_path, git_name, git_mail):
@@ -136,7 +135,6 @@ def collection_new_manual(collection_path, git_name, git_mail):
     ))
     cidentifier = Identifier(path=collection_path)
     # locking uses common name
-    gitstatus.lock(settings.MEDIA_BASE, TASK_COLLECTION_NEW_NAME)
     
     # Create collection
     try:
@@ -175,7 +173,6 @@ def collection_new_idservice(organization_id, idservice_token, git_name, git_mai
     ))
     oidentifier = Identifier(id=organization_id)
     # locking uses common name
-    gitstatus.lock(settings.MEDIA_BASE, TASK_COLLECTION_NEW_NAME)
 
     ic = idservice.IDServiceClient()
     # resume session
@@ -260,7 +257,6 @@ class CollectionEditTask(Task):
         collection = Collection.from_identifier(Identifier(path=collection_path))
         lockstatus = collection.unlock(task_id)
         gitstatus.update(settings.MEDIA_BASE, collection.path)
-        gitstatus.unlock(settings.MEDIA_BASE, 'collection_edit')
 
 @task(base=CollectionEditTask, name='collection-edit')
 def save(collection_path, cleaned_data, git_name, git_mail):
@@ -275,7 +271,6 @@ def save(collection_path, cleaned_data, git_name, git_mail):
         git_name, git_mail, collection_path))
     
     collection = Collection.from_identifier(Identifier(path=collection_path))
-    gitstatus.lock(settings.MEDIA_BASE, 'collection_edit')
     
     try:
         exit,status,updated_files = collection.save(
@@ -315,7 +310,6 @@ class CollectionSyncDebugTask(Task):
         collection.unlock(task_id)
         collection.cache_delete()
         gitstatus.update(settings.MEDIA_BASE, collection_path)
-        gitstatus.unlock(settings.MEDIA_BASE, 'collection_sync')
 
 @task(base=CollectionSyncDebugTask, name='collection-sync')
 def sync( git_name, git_mail, collection_path ):
@@ -324,25 +318,30 @@ def sync( git_name, git_mail, collection_path ):
     @param git_name: Username of git committer.
     @param git_mail: Email of git committer.
     @param collection_path: Absolute path to collection repo.
-    @return collection_path: Absolute path to collection.
+    @return: dict {'collection_path': str, 'timings': dict}
     """
-    gitstatus.lock(settings.MEDIA_BASE, 'collection_sync')
+    progress = TaskProgress()
     ci = Identifier(path=collection_path)
     collection = Collection.from_identifier(ci)
     
     # TODO move this code to webui.models.Collection.sync
+    progress.start('sync')
     exit,status = commands.sync(
         git_name, git_mail,
         collection
     )
+    logger.debug('Updating fulltext index')
+    progress.start('fulltext')
+    fulltext.post_collection(collection_path, progress=progress)
     logger.debug('Updating Elasticsearch')
     if settings.DOCSTORE_ENABLED:
+        progress.start('elasticsearch')
         try:
             collection.reindex()
         except ConnectionError:
             logger.error('Could not update search index')
     
-    return collection_path
+    return progress.result(collection_path=collection_path)
 
 
 # ----------------------------------------------------------------------
@@ -364,7 +363,6 @@ class CollectionSignaturesDebugTask(Task):
         collection.unlock(task_id)
         collection.cache_delete()
         gitstatus.update(settings.MEDIA_BASE, collection_path)
-        gitstatus.unlock(settings.MEDIA_BASE, 'collection_signatures')
 
 @task(base=CollectionSignaturesDebugTask, name='collection-signatures')
 def signatures(collection_path, git_name, git_mail):
@@ -373,29 +371,67 @@ def signatures(collection_path, git_name, git_mail):
     @param collection_path: Absolute path to collection repo.
     @param git_name: Username of git committer.
     @param git_mail: Email of git committer.
-    @return collection_path: Absolute path to collection.
+    @return: dict {'collection_path': str, 'updated': int, 'timings': dict}
     """
-    gitstatus.lock(settings.MEDIA_BASE, 'collection_signatures')
+    progress = TaskProgress()
     collection = Collection.from_identifier(Identifier(path=collection_path))
-    updates = signatures.find_updates(collection)
-    files_written = signatures.write_updates(updates)
-
-    # TODO move this code to webui.models.Collection
-    status,msg = signatures.commit_updates(
-        collection,
-        files_written,
-        git_name, git_mail, agent='ddr-local'
+    # skipped if no metadata changed since signatures were last chosen
+    files_written,status,msg = signatures_engine.update_signatures(
+        collection, git_name, git_mail, agent='ddr-local', progress=progress
     )
     logger.debug('DONE')
+    logger.debug('Updating fulltext index')
+    progress.start('fulltext')
+    fulltext.post_collection(collection_path, progress=progress)
     logger.debug('Updating Elasticsearch')
     if settings.DOCSTORE_ENABLED:
+        progress.start('elasticsearch')
         collection = Collection.from_identifier(Identifier(path=collection_path))
         try:
             collection.post_json()
         except ConnectionError:
             logger.error('Could not update search index')
     
-    return collection_path
+    return progress.result(
+        collection_path=collection_path, updated=len(files_written)
+    )
+
+
+# ----------------------------------------------------------------------
+
+class CollectionAccessBackfillTask(Task):
+    abstract = True
+    
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        pass
+    
+    def on_success(self, retval, task_id, args, kwargs):
+        pass
+    
+    def after_return(self, status, retval, task_id, args, kwargs, cinfo):
+        collection_path = args[0]
+        collection = Collection.from_identifier(Identifier(path=collection_path))
+        # NOTE: collection is locked immediately after task starts
+        #       in webui.views.collections.access_backfill
+        collection.unlock(task_id)
+        collection.cache_delete()
+        gitstatus.update(settings.MEDIA_BASE, collection_path)
+
+@task(base=CollectionAccessBackfillTask, name='collection-access-backfill')
+def access_backfill(collection_path, git_name, git_mail):
+    """Makes missing access files for a collection; see webui.access.
+    
+    @param collection_path: Absolute path to collection repo.
+    @param git_name: Username of git committer.
+    @param git_mail: Email of git committer.
+    @return: dict {'collection_path': str, 'stats': dict, 'timings': dict}
+    """
+    progress = TaskProgress()
+    collection = Collection.from_identifier(Identifier(path=collection_path))
+    results,stats = access.backfill(
+        collection, git_name, git_mail, agent=settings.AGENT, progress=progress
+    )
+    return progress.result(collection_path=collection_path, stats=stats)
 
 
 # ----------------------------------------------------------------------
@@ -434,14 +470,170 @@ class CSVExportDebugTask(Task):
 def csv_export_model(collection_path, model):
     """Export collection {model} metadata to CSV file.
     
-    @return collection_path: Absolute path to collection.
-    @return model: 'entity' or 'file'.
+    Returns at once if the existing export is up to date.
+    
+    @param collection_path: Absolute path to collection.
+    @param model: 'entity' or 'file'.
+    @return: dict {'path': str, 'cached': bool, 'timings': dict}
     """
-    return str(csvio.export_to_csv(
-        Collection.from_identifier(Identifier(path=collection_path)),
+    progress = TaskProgress()
+    collection = Collection.from_identifier(Identifier(path=collection_path))
+    path = csvio.cached_export(collection, model)
+    if path:
+        return progress.result(path=str(path), cached=True)
+    progress.start('export')
+    path = csvio.export_to_csv(
+        collection,
         model,
-        logger
-    ))
+        logger,
+        progress=progress
+    )
+    return progress.result(path=str(path), cached=False)
+
+
+# ----------------------------------------------------------------------
+
+def csv_plan(request, collection, model, csv_path, upload_id):
+    result = csv_plan_model.apply_async(
+        (collection.path, model, str(csv_path)),
+        countdown=2
+    )
+    # add celery task_id to session
+    celery_tasks = request.session.get(settings.CELERY_TASKS_SESSION_KEY, {})
+    # IMPORTANT: 'action' *must* match a message in webui.tasks.TASK_STATUS_MESSAGES.
+    if model == 'entity':
+        import_url = collection.import_entities_url()
+    else:
+        import_url = collection.import_files_url()
+    task = {
+        'task_id': result.task_id,
+        'action': 'csv-plan-model',
+        'collection_id': collection.id,
+        'collection_url': collection.absolute_url(),
+        'things': csvio.models(model),
+        'file_name': os.path.basename(str(csv_path)),
+        'plan_url': '%s?upload=%s' % (import_url, upload_id),
+        'start': converters.datetime_to_text(datetime.now(settings.TZ)),
+    }
+    celery_tasks[result.task_id] = task
+    request.session[settings.CELERY_TASKS_SESSION_KEY] = celery_tasks
+
+class CSVPlanDebugTask(Task):
+    abstract = True
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        pass
+    def on_success(self, retval, task_id, args, kwargs):
+        pass
+    def after_return(self, status, retval, task_id, args, kwargs, cinfo):
+        pass
+
+@task(base=CSVPlanDebugTask, name='webui-csv-plan-model')
+def csv_plan_model(collection_path, model, csv_path):
+    """Dry run of a collection {model} CSV import; see webui.csvio.plan_import.
+    
+    The plan is saved next to the CSV file (csvio.plan_path).
+    
+    @param collection_path: Absolute path to collection.
+    @param model: 'entity' or 'file'.
+    @param csv_path: Absolute path to uploaded CSV file.
+    @return: dict {'path': str, 'valid': bool, 'timings': dict}
+    """
+    progress = TaskProgress()
+    collection = Collection.from_identifier(Identifier(path=collection_path))
+    plan = csvio.plan_import(csv_path, collection, model, progress=progress)
+    return progress.result(
+        path=str(csvio.plan_path(csv_path, model)), valid=plan['valid']
+    )
+
+
+# ----------------------------------------------------------------------
+
+def csv_import(request, collection, model, csv_path, file_name):
+    result = csv_import_model.apply_async(
+        (collection.path, model, str(csv_path),
+         request.session['git_name'], request.session['git_mail']),
+        countdown=2
+    )
+    lockstatus = collection.lock(result.task_id)
+    # add celery task_id to session
+    celery_tasks = request.session.get(settings.CELERY_TASKS_SESSION_KEY, {})
+    # IMPORTANT: 'action' *must* match a message in webui.tasks.TASK_STATUS_MESSAGES.
+    task = {
+        'task_id': result.task_id,
+        'action': 'csv-import-model',
+        'collection_id': collection.id,
+        'collection_url': collection.absolute_url(),
+        'things': csvio.models(model),
+        'file_name': file_name,
+        'start': converters.datetime_to_text(datetime.now(settings.TZ)),
+    }
+    celery_tasks[result.task_id] = task
+    request.session[settings.CELERY_TASKS_SESSION_KEY] = celery_tasks
+
+class CSVImportDebugTask(Task):
+    abstract = True
+    
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        pass
+    
+    def on_success(self, retval, task_id, args, kwargs):
+        pass
+    
+    def after_return(self, status, retval, task_id, args, kwargs, cinfo):
+        collection_path = args[0]
+        collection = Collection.from_identifier(Identifier(path=collection_path))
+        # NOTE: collection is locked immediately after task starts
+        #       in webui.tasks.collection.csv_import
+        collection.unlock(task_id)
+        collection.cache_delete()
+        gitstatus.update(settings.MEDIA_BASE, collection_path)
+        if status == 'SUCCESS':
+            # STORE/tmp/uploads/UPLOAD_ID/
+            uploads.discard(args[2])
+
+@task(base=CSVImportDebugTask, name='webui-csv-import-model')
+def csv_import_model(collection_path, model, csv_path, git_name, git_mail):
+    """Import collection {model} metadata from CSV file.
+    
+    Entities are validated up front and committed together;
+    see webui.csvio.import_entities.
+    
+    @param collection_path: Absolute path to collection.
+    @param model: 'entity' or 'file'.
+    @param csv_path: Absolute path to uploaded CSV file.
+    @param git_name: Username of git committer.
+    @param git_mail: Email of git committer.
+    @return: dict {'collection_path': str, 'imported': int, 'commit': str, 'timings': dict}
+    """
+    progress = TaskProgress()
+    collection = Collection.from_identifier(Identifier(path=collection_path))
+    if model == 'entity':
+        commit,imported = csvio.import_entities(
+            csv_path, collection, git_name, git_mail, progress=progress
+        )
+        from_json = Entity.from_json
+    else:
+        progress.start('import')
+        commit,imported = csvio.import_files(csv_path, collection, git_name, git_mail)
+        from_json = File.from_json
+    logger.debug('Imported %s %s, commit %s' % (len(imported), csvio.models(model), commit))
+    logger.debug('Updating fulltext index')
+    progress.start('fulltext')
+    fulltext.post_collection(collection_path, progress=progress)
+    if settings.DOCSTORE_ENABLED and imported:
+        logger.debug('Updating Elasticsearch')
+        progress.start('elasticsearch', total=len(imported))
+        objects = [
+            from_json(os.path.join(collection_path, path))
+            for path in imported
+        ]
+        try:
+            docstore.Docstore().post_bulk(objects)
+        except ConnectionError:
+            logger.error('Could not update search index')
+    return progress.result(
+        collection_path=collection_path, imported=len(imported), commit=commit
+    )
 
 
 # ----------------------------------------------------------------------
@@ -483,11 +675,15 @@ def collection_reindex(collection_path):
     """Reindexes collection
     
     @param collection_path: Absolute path to collection repo.
-    @return collection_path: Absolute path to collection.
+    @return: dict {'collection_path': str, 'timings': dict}
     """
     logger.debug('tasks.collection.reindex({})'.format(collection_path))
+    progress = TaskProgress()
     collection = Collection.from_identifier(Identifier(path=collection_path))
+    progress.start('fulltext')
+    fulltext.index_collection(collection_path, force=True, progress=progress)
     if settings.DOCSTORE_ENABLED:
+        progress.start('elasticsearch')
         # nice UI if Elasticsearch is down
         try:
             search.DOCSTORE.status()
@@ -496,6 +692,4 @@ def collection_reindex(collection_path):
                 "<b>TransportError</b>: Cannot connect to search engine."
             )
         collection.reindex()
-    else:
-        raise Exception('Search engine disabled (DOCSTORE_ENABLED=False)')
-    return collection_path
+    return progress.result(collection_path=collection_path)
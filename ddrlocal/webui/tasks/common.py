@@ -1,6 +1,13 @@
+from collections import OrderedDict
+from datetime import datetime
+import json
+import time
+
 from celery.utils.log import get_task_logger
 logger = get_task_logger(__name__)
 
+from celery import current_app
+from celery import current_task
 from celery import states
 from celery.result import AsyncResult
 from celery.utils.encoding import safe_repr
@@ -9,13 +16,21 @@ from celery.utils import get_full_cls_name
 from django.conf import settings
 from django.urls import reverse
 
+from DDR import converters
+
 from webui import identifier
 
 
-TASK_STATUSES = ['STARTED', 'PENDING', 'SUCCESS', 'FAILURE', 'RETRY', 'REVOKED',]
+TASK_STATUSES = ['STARTED', 'PENDING', 'PROGRESS', 'SUCCESS', 'FAILURE', 'RETRY', 'REVOKED',]
 TASK_STATUSES_DISMISSABLE = ['STARTED', 'SUCCESS', 'FAILURE', 'RETRY', 'REVOKED',]
 
+# Custom state for running tasks that report progress (see TaskProgress)
+TASK_STATE_PROGRESS = 'PROGRESS'
+# Min seconds between progress updates
+TASK_PROGRESS_INTERVAL = 2
+
 # Background task status messages.
+# PROGRESS messages default to the PENDING message plus progress info.
 # IMPORTANT: These are templates.  Arguments (words in {parentheses}) MUST match keys in the task dict. 
 # See "Accessing arguments by name" section on http://docs.python.org/2.7/library/string.html#format-examples
 TASK_STATUS_MESSAGES = {
@@ -65,6 +80,15 @@ TASK_STATUS_MESSAGES = {
         #'REVOKED': '',
     },
 
+    'collection-access-backfill': {
+        #'STARTED': '',
+        'PENDING': 'Making missing access files for <b><a href="{collection_url}">{collection_id}</a></b>.',
+        'SUCCESS': 'Made missing access files for <b><a href="{collection_url}">{collection_id}</a></b>.',
+        'FAILURE': 'Could not make access files for <b><a href="{collection_url}">{collection_id}</a></b>.',
+        #'RETRY': '',
+        #'REVOKED': '',
+    },
+
     'collection-signatures': {
         #'STARTED': '',
         'PENDING': 'Choosing signatures for <b><a href="{collection_url}">{collection_id}</a></b>.',
@@ -83,6 +107,24 @@ TASK_STATUS_MESSAGES = {
         #'REVOKED': '',
     },
 
+    'csv-plan-model': {
+        #'STARTED': '',
+        'PENDING': 'Checking import of {collection_id} {things} from <b>{file_name}</b>.',
+        'SUCCESS': 'Dry run of <a href="{plan_url}">{file_name}</a> is ready.',
+        'FAILURE': 'Could not check import of {collection_id} {things} from <b>{file_name}</b>.',
+        #'RETRY': '',
+        #'REVOKED': '',
+    },
+
+    'csv-import-model': {
+        #'STARTED': '',
+        'PENDING': 'Importing {collection_id} {things} from <b>{file_name}</b>.',
+        'SUCCESS': 'Imported {collection_id} {things} from <b>{file_name}</b>.',
+        'FAILURE': 'Could not import {collection_id} {things} from <b>{file_name}</b>.',
+        #'RETRY': '',
+        #'REVOKED': '',
+    },
+
     'collection-reindex': {
         #'STARTED': '',
         'PENDING': 'Reindexing collection <b><a href="{collection_url}">{collection_id}</a></b>.',
@@ -151,6 +193,14 @@ TASK_STATUS_MESSAGES = {
         #'RETRY': '',
         #'REVOKED': '',
     },
+    'webui-file-new-batch': {
+        #'STARTED': '',
+        'PENDING': 'Uploading <b>{count}</b> files to <a href="{entity_url}">{entity_id}</a>.',
+        'SUCCESS': 'Uploaded <b>{count}</b> files to <a href="{entity_url}">{entity_id}</a>.',
+        'FAILURE': 'Could not upload <b>{count}</b> files to <a href="{entity_url}">{entity_id}</a>.<br/>{result}',
+        #'RETRY': '',
+        #'REVOKED': '',
+    },
     'webui-file-new-external': {
         #'STARTED': '',
         'PENDING': 'Adding <b>{filename}</b> to <a href="{entity_url}">{entity_id}</a>.',
@@ -171,81 +221,347 @@ TASK_STATUS_MESSAGES = {
 }
 
 
+class TaskProgress(object):
+    """Reports progress of the current task to the result backend
+    
+    Work is divided into named phases.  Calls to step() are cheap;
+    update_state is called at most every TASK_PROGRESS_INTERVAL seconds.
+    result() returns the task's return value with per-phase timings.
+    
+    >>> progress = TaskProgress()
+    >>> progress.start('validate', total=len(paths))
+    >>> for path in paths:
+    ...     validate(path)
+    ...     progress.step()
+    >>> progress.start('commit')
+    >>> ...
+    >>> return progress.result(collection_path=collection_path)
+    {'collection_path': '...', 'timings': {'validate': 12.345, 'commit': 0.678}}
+    
+    @param task: celery.Task (optional) Defaults to current_task
+    @param interval: int Min seconds between updates
+    @param task_id: str (optional) Report as this task instead of current one
+    """
+    
+    def __init__(self, task=None, interval=TASK_PROGRESS_INTERVAL, task_id=None):
+        self.task = task or current_task
+        self.task_id = task_id
+        self.interval = interval
+        self.timings = OrderedDict()
+        self.phase = None
+        self.total = 0
+        self.processed = 0
+        self.started = time.time()
+        self.reported = 0
+    
+    def start(self, phase, total=0):
+        """Finish previous phase (if any) and start a new one
+        
+        @param phase: str
+        @param total: int (optional) Number of items, if known
+        """
+        self.finish()
+        self.phase = phase
+        self.total = total
+        self.processed = 0
+        self.started = time.time()
+        self.report()
+    
+    def step(self, n=1):
+        """Mark n items processed; report if interval has passed
+        """
+        self.processed += n
+        if time.time() - self.reported >= self.interval:
+            self.report()
+    
+    def finish(self):
+        """Record timing of current phase
+        """
+        if self.phase:
+            self.timings[self.phase] = round(time.time() - self.started, 3)
+        self.phase = None
+    
+    def state(self):
+        """
+        @returns: dict phase, processed, total, percent, elapsed, rate (items/sec)
+        """
+        elapsed = time.time() - self.started
+        percent = None
+        if self.total:
+            percent = int(100 * self.processed / self.total)
+        return {
+            'phase': self.phase,
+            'processed': self.processed,
+            'total': self.total,
+            'percent': percent,
+            'elapsed': round(elapsed, 1),
+            'rate': round(self.processed / elapsed, 1) if elapsed else 0,
+            'timings': dict(self.timings),
+        }
+    
+    def report(self):
+        self.reported = time.time()
+        if self.task and (self.task_id or self.task.request.id):
+            self.task.update_state(
+                task_id=self.task_id or self.task.request.id,
+                state=TASK_STATE_PROGRESS, meta=self.state()
+            )
+    
+    def result(self, **kwargs):
+        """Task return value, with per-phase timings
+        """
+        self.finish()
+        kwargs['timings'] = dict(self.timings)
+        return kwargs
+
+def progress_text(progress):
+    """Human-readable summary of TaskProgress.state
+    
+    >>> progress_text({'phase': 'validate', 'processed': 1200, 'total': 20000, 'percent': 6, 'rate': 150.2})
+    'validate: 1,200/20,000 (6%) 150.2/sec'
+    """
+    if not progress:
+        return ''
+    text = '%s: {:,}'.format(progress.get('processed', 0)) % progress.get('phase')
+    if progress.get('total'):
+        text += '/{:,} ({}%)'.format(progress['total'], progress['percent'])
+    if progress.get('rate'):
+        text += ' %s/sec' % progress['rate']
+    return text
+
+def task_metas(task_ids, backend=None):
+    """Get status/result of many tasks from the result backend at once
+    
+    Key-value backends (e.g. Redis) are queried with a single MGET
+    instead of one GET per AsyncResult.  Other backends fall back to
+    one lookup per task.
+    
+    @param task_ids: list
+    @param backend: (optional) Celery result backend
+    @returns: dict {task_id: {'status': ..., 'result': ..., 'traceback': ...}}
+    """
+    if not task_ids:
+        return {}
+    if backend is None:
+        backend = current_app.backend
+    if not hasattr(backend, 'mget'):
+        metas = {}
+        for task_id in task_ids:
+            result = AsyncResult(task_id)
+            metas[task_id] = {
+                'status': result.state,
+                'result': result.result,
+                'traceback': result.traceback,
+            }
+        return metas
+    values = backend.mget([backend.get_key_for_task(task_id) for task_id in task_ids])
+    metas = {}
+    for task_id,value in zip(task_ids, values):
+        if value:
+            metas[task_id] = backend.decode_result(value)
+        else:
+            metas[task_id] = {
+                'status': states.PENDING, 'result': None, 'traceback': None
+            }
+    return metas
+
+def _task_expired(task, now):
+    try:
+        started = converters.text_to_datetime(task['start'])
+        return (now - started).total_seconds() > settings.CELERY_TASKS_SESSION_EXPIRE
+    except (KeyError, ValueError, TypeError):
+        return False
+
+def prune_session_tasks(tasks, now=None):
+    """Remove old finished tasks
+    
+    Finished tasks older than CELERY_TASKS_SESSION_EXPIRE are removed,
+    and only the newest CELERY_TASKS_SESSION_MAX finished tasks are kept.
+    Unfinished tasks are never removed.
+    
+    @param tasks: dict {task_id: task}
+    @param now: datetime (optional)
+    @returns: list of removed task_ids
+    """
+    if not now:
+        now = datetime.now(settings.TZ)
+    finished = sorted(
+        [task for task in tasks.values() if task.get('status') in states.READY_STATES],
+        key=lambda t: t.get('start', ''),
+        reverse=True
+    )
+    removed = [
+        task['task_id']
+        for n,task in enumerate(finished)
+        if (n >= settings.CELERY_TASKS_SESSION_MAX) or _task_expired(task, now)
+    ]
+    for task_id in removed:
+        tasks.pop(task_id, None)
+    return removed
+
+def _format_task(task, meta):
+    """Add status, result, URLs, message from result backend meta to task dict
+    """
+    if task.get('action') in ['webui-file-new-local',
+                              'webui-file-new-batch',
+                              'webui-file-new-external',
+                              'webui-file-new-access']:
+        # Add entity_url to task for newly-created file
+        task['entity_url'] = reverse('webui-entity', args=[task['entity_id']])
+    state,retval = meta['status'],meta['result']
+    task['status'] = state
+    task['result'] = retval
+    if state == TASK_STATE_PROGRESS:
+        task['progress'] = retval
+        task['progress_text'] = progress_text(retval)
+        task['result'] = None
+        retval = None
+    elif isinstance(retval, dict) and retval.get('timings'):
+        task['timings'] = retval['timings']
+    if state in states.EXCEPTION_STATES:
+        task['result'] = safe_repr(retval)
+        task['exc'] = get_full_cls_name(retval.__class__)
+        task['traceback'] = meta.get('traceback')
+    # try to convert 'result' into a collection/entity/file URL
+    if (state != 'FAILURE') and retval:
+        if isinstance(retval, dict) and retval.get('id', None):
+            oid = identifier.Identifier(retval['id'])
+            object_url = reverse('webui-%s' % oid.model, args=[oid.id])
+            task['%s_url' % oid.model] = object_url
+    # pretty status messages
+    messages = TASK_STATUS_MESSAGES.get(task.get('action'), None)
+    if messages and messages.get(state):
+        task['message'] = messages[state].format(**task)
+    elif messages and (state == TASK_STATE_PROGRESS) and messages.get('PENDING'):
+        task['message'] = '%s <small>%s</small>' % (
+            messages['PENDING'].format(**task), task['progress_text']
+        )
+    # indicate if task is dismiss or not
+    task['dismissable'] = (state in TASK_STATUSES_DISMISSABLE)
+    return task
+
 def session_tasks( request ):
     """Gets task statuses from Celery API, appends to task dicts from session.
     
     This function is used to generate the list of pending/successful/failed tasks
     in the webapp page notification area.
     
+    Statuses of all unfinished tasks are fetched in one batch (see task_metas).
+    Finished tasks (SUCCESS, FAILURE, REVOKED) are saved to the session with
+    their status and message and are not looked up again.  Old finished tasks
+    are pruned (see prune_session_tasks).
+    
+    Returns copies of the session task dicts so callers can modify them.
+    
     @param request: A Django request object
     @return tasks: a dict with task_id for key
     """
     # basic tasks info from session:
     # task_id, action ('name' argument of @task), start time, args
-    tasks = request.session.get(settings.CELERY_TASKS_SESSION_KEY, {})
-    # add entity URLs
-    for task_id in list(tasks.keys()):
-        task = tasks.get(task_id, None)
-        if task and task['action'] in ['webui-file-new-local',
-                                       'webui-file-new-external',
-                                       'webui-file-new-access']:
-                # Add entity_url to task for newly-created file
-                task['entity_url'] = reverse('webui-entity', args=[task['entity_id']])
-    # Hit the celery-task_status view for status updates on each task.
-    # get status, retval from celery
-    # TODO Don't create a new ctask/task dict here!!! >:-O
-    traceback = None
-    for task_id in list(tasks.keys()):
-        # Skip the HTTP and get directly from Celery API
-        # djcelery.views.task_status
-        result = AsyncResult(task_id)
-        state, retval = result.state, result.result
-        response_data = {'id': task_id, 'status': state, 'result': retval}
-        if state in states.EXCEPTION_STATES:
-            traceback = result.traceback
-            response_data.update({'result': safe_repr(retval),
-                                  'exc': get_full_cls_name(retval.__class__),
-                                  'traceback': traceback})
-        # end djcelery.views.task_status
-        task = response_data
-        # construct collection/entity/file urls if possible
-        if task:
-            ctask = tasks[task['id']]
-            ctask['status'] = task.get('status', None)
-            ctask['result'] = task.get('result', None)
-            # try to convert 'result' into a collection/entity/file URL
-            if (ctask['status'] != 'FAILURE') and ctask['result']:
-                r = ctask['result']
-                if type(r) == type({}):
-                    if r.get('id', None):
-                        oid = identifier.Identifier(r['id'])
-                        object_url = reverse('webui-%s' % oid.model, args=[oid.id])
-                        ctask['%s_url' % oid.model] = object_url
-            tasks[task['id']] = ctask
-    # pretty status messages
-    for task_id in list(tasks.keys()):
-        task = tasks[task_id]
-        action = task.get('action', None)
-        if action:
-            messages = TASK_STATUS_MESSAGES.get(action, None)
-        status = task.get('status', None)
-        template = None
-        if messages and status:
-            template = messages.get(status, None)
-        if template:
-            msg = template.format(**task)
-            task['message'] = msg
-    # indicate if task is dismiss or not
-    for task_id in list(tasks.keys()):
-        task = tasks[task_id]
-        if task.get('status', None):
-            task['dismissable'] = (task['status'] in TASK_STATUSES_DISMISSABLE)
-    # include traceback in task if present
-    if traceback:
-        task['traceback'] = traceback
-    # done
+    stored = request.session.get(settings.CELERY_TASKS_SESSION_KEY, {})
+    modified = False
+    unfinished = [
+        task_id for task_id,task in stored.items()
+        if task.get('status') not in states.READY_STATES
+    ]
+    metas = task_metas(unfinished)
+    tasks = {}
+    for task_id,task in stored.items():
+        task = dict(task)
+        if task_id in metas:
+            _format_task(task, metas[task_id])
+            if task['status'] in states.READY_STATES:
+                try:
+                    json.dumps(task)
+                except (TypeError, ValueError):
+                    task['result'] = safe_repr(task['result'])
+                stored[task_id] = dict(task)
+                modified = True
+        tasks[task_id] = task
+    if prune_session_tasks(stored):
+        modified = True
+        tasks = {task_id: tasks[task_id] for task_id in stored.keys()}
+    if modified:
+        request.session[settings.CELERY_TASKS_SESSION_KEY] = stored
     return tasks
 
+def _task_event(task):
+    """Format task as a server-sent event
+    """
+    data = {
+        key: task.get(key)
+        for key in ['task_id', 'status', 'message', 'dismissable', 'progress']
+    }
+    return 'event: task\ndata: %s\n\n' % json.dumps(data)
+
+def _channel(key):
+    if isinstance(key, bytes):
+        return key.decode('utf-8')
+    return key
+
+def task_events(tasks, timeout=None, keepalive=15, backend=None):
+    """Server-sent events for state changes of unfinished tasks
+    
+    The Redis result backend publishes every stored task state on a
+    channel named after the task's result key, so instead of polling
+    we subscribe to the channels of the session's unfinished tasks.
+    Sends the current state of each, then an event per change, then
+    'done' when all tasks have finished.  Returns after timeout
+    seconds so the client reconnects with a fresh task list.
+    
+    @param tasks: dict {task_id: task} See session_tasks
+    @param timeout: int (optional) Seconds
+    @param keepalive: int Send a comment if idle this many seconds
+    @param backend: (optional) Celery result backend
+    @returns: generator of str
+    """
+    if backend is None:
+        backend = current_app.backend
+    if timeout is None:
+        timeout = settings.CELERY_TASKS_EVENTS_TIMEOUT
+    yield 'retry: %s\n\n' % (settings.CELERY_TASKS_EVENTS_RETRY * 1000)
+    unfinished = {
+        _channel(backend.get_key_for_task(task_id)): task_id
+        for task_id,task in tasks.items()
+        if task.get('status') not in states.READY_STATES
+    }
+    if not (unfinished and hasattr(backend, 'client')):
+        yield 'event: done\ndata: {}\n\n'
+        return
+    pubsub = backend.client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(*unfinished.keys())
+    try:
+        # subscribed first so no change is missed between these steps
+        metas = task_metas(list(unfinished.values()), backend)
+        for channel,task_id in list(unfinished.items()):
+            task = _format_task(dict(tasks[task_id]), metas[task_id])
+            yield _task_event(task)
+            if task['status'] in states.READY_STATES:
+                pubsub.unsubscribe(channel)
+                unfinished.pop(channel)
+        start = last = time.time()
+        while unfinished and (time.time() - start < timeout):
+            message = pubsub.get_message(timeout=1.0)
+            if message and (message['type'] == 'message'):
+                channel = _channel(message['channel'])
+                task_id = unfinished.get(channel)
+                if task_id:
+                    task = _format_task(
+                        dict(tasks[task_id]), backend.decode_result(message['data'])
+                    )
+                    yield _task_event(task)
+                    if task['status'] in states.READY_STATES:
+                        pubsub.unsubscribe(channel)
+                        unfinished.pop(channel)
+                last = time.time()
+            elif time.time() - last > keepalive:
+                yield ': keepalive\n\n'
+                last = time.time()
+        if not unfinished:
+            yield 'event: done\ndata: {}\n\n'
+    finally:
+        pubsub.close()
+
 def session_tasks_list( request ):
     """session_tasks as a list, sorted in reverse chronological order.
     
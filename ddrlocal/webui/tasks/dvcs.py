@@ -64,8 +64,14 @@ def gitstatus_update_store():
             gitolite.get_repos_orgs()
         )
         gitstatus.queue_write(settings.MEDIA_BASE, queue)
+    # Updates run in the collection's task lane (see webui.tasks.routing)
+    # so they never overlap with edits to the same repo.
     return gitstatus.update_store(
         base_dir=settings.MEDIA_BASE,
         delta=60,
         minimum=settings.GITSTATUS_INTERVAL,
+        local=not settings.GITSTATUS_USE_GLOBAL_LOCK,
+        dispatch=lambda collection_path: gitstatus_update.apply_async(
+            (collection_path,)
+        ),
     )
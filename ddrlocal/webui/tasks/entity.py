@@ -12,6 +12,7 @@ from django.conf import settings
 from DDR import converters
 
 from webui import docstore
+from webui import fulltext
 from webui import gitstatus
 from webui.models import Collection, Entity
 from webui.identifier import Identifier
@@ -58,7 +59,6 @@ class EntityEditTask(Task):
         collection = Collection.from_identifier(Identifier(path=collection_path))
         lockstatus = collection.unlock(task_id)
         gitstatus.update(settings.MEDIA_BASE, collection_path)
-        gitstatus.unlock(settings.MEDIA_BASE, 'entity_edit')
 
 @task(base=EntityEditTask, name='entity-edit')
 def entity_edit(collection_path, entity_id, form_data, git_name, git_mail, agent=''):
@@ -75,7 +75,6 @@ def entity_edit(collection_path, entity_id, form_data, git_name, git_mail, agent
         git_name, git_mail, collection_path, entity_id, agent))
     collection = Collection.from_identifier(Identifier(path=collection_path))
     entity = Entity.from_identifier(Identifier(id=entity_id))
-    gitstatus.lock(settings.MEDIA_BASE, 'entity_edit')
     
     try:
         exit,status,updated_files = entity.save(
@@ -138,7 +137,6 @@ class DeleteEntityTask(Task):
         collection = Collection.from_identifier(Identifier(path=collection_path))
         lockstatus = collection.unlock(task_id)
         gitstatus.update(settings.MEDIA_BASE, collection_path)
-        gitstatus.unlock(settings.MEDIA_BASE, 'entity_delete')
 
 @task(base=DeleteEntityTask, name='entity-delete')
 def entity_delete(collection_path, entity_id, git_name, git_mail, agent):
@@ -174,6 +172,7 @@ def entity_delete(collection_path, entity_id, git_name, git_mail, agent):
     )
     
     logger.debug('Updating Elasticsearch')
+    fulltext.delete(entity.id)
     if settings.DOCSTORE_ENABLED:
         ds = docstore.Docstore()
         try:
@@ -222,7 +221,6 @@ class EntityReloadTask(Task):
         entity = Entity.from_identifier(Identifier(id=entity_id))
         lockstatus = collection.unlock(task_id)
         gitstatus.update(settings.MEDIA_BASE, collection_path)
-        gitstatus.unlock(settings.MEDIA_BASE, 'reload_files')
 
 @task(base=EntityReloadTask, name='entity-reload-files')
 def reload_files(collection_path, entity_id, git_name, git_mail, agent=''):
@@ -235,7 +233,6 @@ def reload_files(collection_path, entity_id, git_name, git_mail, agent=''):
     @param agent: (optional) Name of software making the change.
     """
     logger.debug('tasks.entity.reload_files(%s,%s,%s,%s,%s)' % (collection_path, entity_id, git_name, git_mail, agent))
-    gitstatus.lock(settings.MEDIA_BASE, 'reload_files')
     entity = Entity.from_identifier(Identifier(entity_id))
     collection = Collection.from_identifier(Identifier(path=collection_path))
     
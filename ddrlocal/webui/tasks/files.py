@@ -1,5 +1,6 @@
 from datetime import datetime
 import os
+import uuid
 
 from elasticsearch.exceptions import ConnectionError, RequestError
 
@@ -15,9 +16,11 @@ from DDR.ingest import addfile_logger
 
 from webui import docstore
 from webui import gitstatus
+from webui import ingest
 from webui.models import Collection, Entity, File
 from webui.identifier import Identifier
 from webui.tasks import dvcs as dvcs_tasks
+from webui.tasks.common import TaskProgress
 
 
 # ----------------------------------------------------------------------
@@ -25,18 +28,54 @@ from webui.tasks import dvcs as dvcs_tasks
 TASK_FILE_ADD_LOCAL_NAME = 'webui-file-new-local'
 TASK_FILE_ADD_EXTERNAL_NAME = 'webui-file-new-external'
 TASK_FILE_ADD_ACCESS_NAME = 'webui-file-new-access'
+TASK_FILE_INGEST_PREPARE_NAME = 'webui-file-ingest-prepare'
+TASK_FILE_ADD_BATCH_NAME = 'webui-file-new-batch'
 
 def add_local(request, form_data, entity, role, src_path, git_name, git_mail):
-    collection = entity.collection()
+    """Hash and copy on the ingest queue, then stage/commit/index in
+    the collection's lane.  See webui.ingest.
+    
+    The file_add_local task ID is chosen here so it can be tracked
+    before that task is queued.  The collection is not locked until
+    file_add_local starts, so files for other entities in the collection
+    can be hashed and copied in the meantime.
+    """
     # start tasks
-    result = file_add_local.apply_async(
+    task_id = str(uuid.uuid4())
+    file_ingest_prepare.apply_async(
         (entity.path, src_path, role, form_data, git_name, git_mail),
+        {'add_task_id': task_id},
         countdown=2
     )
     log = addfile_logger(entity.identifier)
     log.ok('START %s' % TASK_FILE_ADD_LOCAL_NAME)
-    log.ok('task_id %s' % result.task_id)
+    log.ok('task_id %s' % task_id)
     log.ok('ddrlocal.webui.file.new')
+    # add celery task_id to session
+    celery_tasks = request.session.get(settings.CELERY_TASKS_SESSION_KEY, {})
+    # IMPORTANT: 'action' *must* match a message in webui.tasks.TASK_STATUS_MESSAGES.
+    celery_tasks[task_id] = {
+        'task_id': task_id,
+        'action': TASK_FILE_ADD_LOCAL_NAME,
+        'filename': os.path.basename(src_path),
+        'entity_id': entity.id,
+        'start': converters.datetime_to_text(datetime.now(settings.TZ)),
+    }
+    request.session[settings.CELERY_TASKS_SESSION_KEY] = celery_tasks
+
+def add_batch(request, form_data, entity, role, src_paths, git_name, git_mail):
+    """Add several local files in one task.  See webui.ingest.batch.
+    """
+    collection = entity.collection()
+    # start tasks
+    result = file_add_batch.apply_async(
+        (entity.path, src_paths, role, form_data, git_name, git_mail),
+        countdown=2
+    )
+    log = addfile_logger(entity.identifier)
+    log.ok('START %s' % TASK_FILE_ADD_BATCH_NAME)
+    log.ok('task_id %s' % result.task_id)
+    log.ok('ddrlocal.webui.file.batch')
     log.ok('Locking %s' % collection.id)
     # lock collection
     lockstatus = collection.lock(result.task_id)
@@ -49,8 +88,8 @@ def add_local(request, form_data, entity, role, src_path, git_name, git_mail):
     # IMPORTANT: 'action' *must* match a message in webui.tasks.TASK_STATUS_MESSAGES.
     celery_tasks[result.task_id] = {
         'task_id': result.task_id,
-        'action': TASK_FILE_ADD_LOCAL_NAME,
-        'filename': os.path.basename(src_path),
+        'action': TASK_FILE_ADD_BATCH_NAME,
+        'count': len(src_paths),
         'entity_id': entity.id,
         'start': converters.datetime_to_text(datetime.now(settings.TZ)),
     }
@@ -169,11 +208,60 @@ class FileAddDebugTask(Task):
         log.ok('END task_id %s\n' % task_id)
         collection.cache_delete()
         gitstatus.update(settings.MEDIA_BASE, collection.path)
-        gitstatus.unlock(settings.MEDIA_BASE, 'file-add-*')
+
+class FileIngestPrepareTask(Task):
+    abstract = True
+    
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        # file_add_local will not run; fail it so the user sees why
+        entity_path = args[0]
+        add_task_id = kwargs['add_task_id']
+        entity = Entity.from_identifier(Identifier(path=entity_path))
+        log = addfile_logger(entity.identifier)
+        log.not_ok('FileIngestPrepareTask.ON_FAILURE')
+        log.not_ok('exc %s' % exc)
+        file_add_local.backend.mark_as_failure(add_task_id, exc)
+        log.ok('END task_id %s\n' % add_task_id)
+    
+    def on_success(self, retval, task_id, args, kwargs):
+        pass
+    
+    def after_return(self, status, retval, task_id, args, kwargs, einfo):
+        pass
+
+@task(base=FileIngestPrepareTask, name=TASK_FILE_INGEST_PREPARE_NAME)
+def file_ingest_prepare(entity_path, src_path, role, data, git_name, git_mail, add_task_id):
+    """Hash and copy stages; queues file_add_local when done
+    
+    Runs on the ingest queue, several at a time (see webui.tasks.routing).
+    Progress is reported under add_task_id, the task the user sees.
+    
+    @param entity_path: str
+    @param src_path: Absolute path to an uploadable file.
+    @param role: Keyword of a file role.
+    @param data: Dict containing form data.
+    @param git_name: Username of git committer.
+    @param git_mail: Email of git committer.
+    @param add_task_id: str Task ID for file_add_local
+    """
+    entity = Entity.from_identifier(Identifier(path=entity_path))
+    log = addfile_logger(entity.identifier)
+    progress = TaskProgress(task_id=add_task_id)
+    ingest.prepare(entity, src_path, role, log, progress=progress)
+    file_add_local.apply_async(
+        (entity_path, src_path, role, data, git_name, git_mail),
+        task_id=add_task_id
+    )
+    return progress.result(add_task_id=add_task_id)
 
 @task(base=FileAddDebugTask, name=TASK_FILE_ADD_LOCAL_NAME)
 def file_add_local(entity_path, src_path, role, data, git_name, git_mail):
-    """
+    """Stage, commit, and index stages of webui.ingest
+    
+    Stages already done (per checkpoints in the addfile log) are skipped,
+    so a retry resumes where the last attempt failed.  The collection is
+    locked from here until FileAddDebugTask.after_return.
+    
     @param entity_path: str
     @param src_path: Absolute path to an uploadable file.
     @param role: Keyword of a file role.
@@ -181,31 +269,48 @@ def file_add_local(entity_path, src_path, role, data, git_name, git_mail):
     @param git_name: Username of git committer.
     @param git_mail: Email of git committer.
     """
-    gitstatus.lock(settings.MEDIA_BASE, 'file-add-*')
-    # TODO move this code to webui.models.Entity or .File
     entity = Entity.from_identifier(Identifier(path=entity_path))
-    file_,repo,log = entity.add_local_file(
-        src_path, role, data,
-        git_name, git_mail, agent=settings.AGENT
+    collection = entity.collection()
+    log = addfile_logger(entity.identifier)
+    log.ok('Locking %s' % collection.id)
+    # lock collection
+    lockstatus = collection.lock(file_add_local.request.id)
+    if lockstatus == 'ok':
+        log.ok('locked')
+    else:
+        log.not_ok(lockstatus)
+    progress = TaskProgress()
+    file_ = ingest.finish(
+        entity, src_path, role, data,
+        git_name, git_mail, settings.AGENT, log,
+        progress=progress
     )
-    file_,repo,log = entity.add_file_commit(
-        file_, repo, log,
-        git_name, git_mail, agent=settings.AGENT
+    return progress.result(id=file_.id, status='ok')
+
+@task(base=FileAddDebugTask, name=TASK_FILE_ADD_BATCH_NAME)
+def file_add_batch(entity_path, src_paths, role, data, git_name, git_mail):
+    """Add several files with one commit and one bulk index request
+    
+    gitstatus is updated once, in FileAddDebugTask.after_return.
+    
+    @param entity_path: str
+    @param src_paths: List of absolute paths to uploadable files.
+    @param role: Keyword of a file role.
+    @param data: Dict containing form data shared by all files.
+    @param git_name: Username of git committer.
+    @param git_mail: Email of git committer.
+    """
+    entity = Entity.from_identifier(Identifier(path=entity_path))
+    log = addfile_logger(entity.identifier)
+    progress = TaskProgress()
+    files = ingest.batch(
+        entity, src_paths, role, data,
+        git_name, git_mail, settings.AGENT, log,
+        progress=progress
+    )
+    return progress.result(
+        id=entity.id, files=[file_.id for file_ in files], status='ok'
     )
-    log.ok('Updating Elasticsearch')
-    logger.debug('Updating Elasticsearch')
-    if settings.DOCSTORE_ENABLED:
-        try:
-            result = file_.post_json()
-            log.ok('| %s' % result)
-        except ConnectionError as err:
-            log.not_ok("ConnectionError: {0}".format(err))
-        except RequestError as err:
-            log.not_ok("RequestError: {0}".format(err))
-    return {
-        'id': file_.id,
-        'status': 'ok'
-    }
 
 @task(base=FileAddDebugTask, name=TASK_FILE_ADD_EXTERNAL_NAME)
 def file_add_external(entity_path, data, git_name, git_mail):
@@ -215,7 +320,6 @@ def file_add_external(entity_path, data, git_name, git_mail):
     @param git_name: Username of git committer.
     @param git_mail: Email of git committer.
     """
-    gitstatus.lock(settings.MEDIA_BASE, 'file-add-*')
     entity = Entity.from_identifier(Identifier(path=entity_path))
     file_,repo,log = entity.add_external_file(
         data,
@@ -249,7 +353,6 @@ def file_add_access(entity_path, file_data, src_path, git_name, git_mail):
     @param git_name: Username of git committer.
     @param git_mail: Email of git committer.
     """
-    gitstatus.lock(settings.MEDIA_BASE, 'file-add-*')
     entity = Entity.from_identifier(Identifier(path=entity_path))
     file_ = File.from_identifier(Identifier(id=file_data['id']))
     file_,repo,log,op = entity.add_access(
@@ -308,7 +411,6 @@ class FileEditTask(Task):
         collection = Collection.from_identifier(Identifier(path=collection_path))
         lockstatus = collection.unlock(task_id)
         gitstatus.update(settings.MEDIA_BASE, collection_path)
-        gitstatus.unlock(settings.MEDIA_BASE, 'file_edit')
 
 @task(base=FileEditTask, name='file-edit')
 def file_edit(collection_path, file_id, form_data, git_name, git_mail):
@@ -323,7 +425,6 @@ def file_edit(collection_path, file_id, form_data, git_name, git_mail):
     logger.debug('tasks.files.edit(%s,%s,%s,%s)' % (git_name, git_mail, collection_path, file_id))
     fidentifier = Identifier(id=file_id)
     file_ = File.from_identifier(fidentifier)
-    gitstatus.lock(settings.MEDIA_BASE, 'file_edit')
     
     try:
         exit,status,updated_files = file_.save(
@@ -381,7 +482,6 @@ class DeleteFileTask(Task):
         collection = Collection.from_identifier(Identifier(path=collection_path))
         lockstatus = collection.unlock(task_id)
         gitstatus.update(settings.MEDIA_BASE, collection_path)
-        gitstatus.unlock(settings.MEDIA_BASE, 'delete_file')
 
 @task(base=DeleteFileTask, name='file-delete')
 def delete_file( git_name, git_mail, collection_path, entity_id, file_basename, agent='' ):
@@ -395,7 +495,6 @@ def delete_file( git_name, git_mail, collection_path, entity_id, file_basename,
     """
     logger.debug('tasks.files.delete_file(%s,%s,%s,%s,%s,%s)' % (git_name, git_mail, collection_path, entity_id, file_basename, agent))
     
-    gitstatus.lock(settings.MEDIA_BASE, 'delete_file')
     file_id = os.path.splitext(file_basename)[0]
     file_ = File.from_identifier(Identifier(file_id))
 
@@ -459,7 +558,6 @@ class FileSignatureTask(Task):
         collection_path = collection.identifier.path_abs()
         lockstatus = collection.unlock(task_id)
         gitstatus.update(settings.MEDIA_BASE, collection_path)
-        gitstatus.unlock(settings.MEDIA_BASE, 'set_signature')
 
 @task(base=FileSignatureTask, name='set-signature')
 def set_signature(parent_id, file_id, git_name, git_mail):
@@ -477,7 +575,6 @@ def set_signature(parent_id, file_id, git_name, git_mail):
     file_ = Identifier(id=file_id).object()
     collection_path = file_.collection_path
     parent.signature_id = file_id
-    gitstatus.lock(settings.MEDIA_BASE, 'set_signature')
     exit,status,updated_files = parent.save(
         git_name, git_mail,
         {}
@@ -0,0 +1,140 @@
+"""
+routing
+
+Sends Celery tasks to queues by what they do and which collection they touch.
+
+Tasks that write to a collection repository (edits, file ingest, sync,
+signatures, git status) go to a per-collection serial lane.  Each lane
+is a queue consumed by a single worker process with concurrency 1,
+so tasks for one collection run one at a time in the order they were
+sent while tasks for other collections proceed in parallel on other lanes.
+Mutual exclusion comes from the broker; no lockfile is needed.
+
+Read-only or Store-wide tasks go to dedicated queues so they never wait
+behind a long file upload:
+- QUEUE_INGEST     hashing and copying new files (webui.ingest)
+- QUEUE_INDEX      fulltext/Elasticsearch indexing, CSV export and import
+                   dry runs, file checks
+- QUEUE_GITSTATUS  scheduled gitstatus/gitolite updates
+- QUEUE_METADATA   other short tasks
+
+Lanes are chosen by a stable hash of the collection ID so every process
+agrees on the lane.  Several collections share a lane when there are more
+collections than lanes.
+
+Configure with settings.CELERY_TASK_ROUTES and start one worker per lane:
+
+>>> CELERY_TASK_ROUTES = ('webui.tasks.routing.route_task',)
+$ celery -A ddrlocal worker -c 1 -Q collection-0 -n lane0@%h
+$ celery -A ddrlocal worker -c 1 -Q collection-1 -n lane1@%h
+...
+$ celery -A ddrlocal worker --pool=threads -Q celery,metadata,ingest,index,gitstatus
+
+See conf/celeryd.conf.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import os
+import zlib
+
+from django.conf import settings
+
+from webui.identifier import Identifier
+
+QUEUE_METADATA = 'metadata'
+QUEUE_INGEST = 'ingest'
+QUEUE_INDEX = 'index'
+QUEUE_GITSTATUS = 'gitstatus'
+LANE_QUEUE = 'collection-%s'
+
+# Tasks that write to a collection repo, and the position of the argument
+# (collection/entity path or object ID) that identifies the collection.
+LANE_TASKS = {
+    'collection-new-manual': 0,
+    'collection-edit': 0,
+    'collection-sync': 2,
+    'collection-signatures': 0,
+    'collection-access-backfill': 0,
+    'webui-csv-import-model': 0,
+    'entity-edit': 0,
+    'entity-delete': 0,
+    'entity-reload-files': 0,
+    'webui-file-new-local': 0,
+    'webui-file-new-batch': 0,
+    'webui-file-new-external': 0,
+    'webui-file-new-access': 0,
+    'file-edit': 0,
+    'file-delete': 2,
+    'set-signature': 0,
+    'webui.tasks.gitstatus_update': 0,
+}
+
+# Tasks that do not write to collection repos
+QUEUE_TASKS = {
+    'collection-new-idservice': QUEUE_METADATA,
+    'webui-file-ingest-prepare': QUEUE_INGEST,
+    'collection-reindex': QUEUE_INDEX,
+    'search-reindex': QUEUE_INDEX,
+    'webui-csv-export-model': QUEUE_INDEX,
+    'webui-csv-plan-model': QUEUE_INDEX,
+    'webui.tasks.collection_check': QUEUE_INDEX,
+    'webui.tasks.gitstatus_update_store': QUEUE_GITSTATUS,
+    'webui.tasks.gitolite_info_refresh': QUEUE_GITSTATUS,
+}
+
+
+def collection_id(value):
+    """Collection ID from a path or object ID
+    
+    >>> collection_id('/var/www/media/ddr/ddr-test-123/files/ddr-test-123-4')
+    'ddr-test-123'
+    >>> collection_id('ddr-test-123-4-master-a1b2c3d4e5')
+    'ddr-test-123'
+    
+    @param value: str Absolute path or object ID
+    @returns: str or None
+    """
+    try:
+        if os.path.isabs(value):
+            oi = Identifier(path=value)
+        else:
+            oi = Identifier(id=value)
+        return oi.collection_id()
+    except Exception:
+        return None
+
+def lane(cid, lanes=None):
+    """Name of the serial lane queue for a collection
+    
+    crc32 rather than hash() because str hashes vary between processes.
+    
+    >>> lane('ddr-test-123', lanes=4)
+    'collection-0'
+    
+    @param cid: str Collection ID
+    @param lanes: int Number of lanes (default settings.CELERY_COLLECTION_LANES)
+    @returns: str queue name
+    """
+    if lanes is None:
+        lanes = settings.CELERY_COLLECTION_LANES
+    return LANE_QUEUE % (zlib.crc32(cid.encode('utf-8')) % lanes)
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """Celery router; see module docstring
+    
+    Tasks not listed here go to the default queue.
+    
+    @returns: dict {'queue': str} or None
+    """
+    if name in QUEUE_TASKS:
+        return {'queue': QUEUE_TASKS[name]}
+    if name in LANE_TASKS:
+        cid = None
+        if args and len(args) > LANE_TASKS[name]:
+            cid = collection_id(args[LANE_TASKS[name]])
+        if cid:
+            return {'queue': lane(cid)}
+        logger.error('No collection for %s %s' % (name, args))
+        return {'queue': QUEUE_METADATA}
+    return None
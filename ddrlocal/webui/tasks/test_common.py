@@ -0,0 +1,19 @@
+from django.test import TestCase
+
+from webui.tasks.common import TaskProgress, progress_text
+
+
+class Progress(TestCase):
+
+    def test_task_progress(self):
+        progress = TaskProgress(task=None)
+        progress.start('validate', total=2000)
+        progress.step(1200)
+        state = progress.state()
+        self.assertEqual(state['percent'], 60)
+        self.assertTrue(
+            progress_text(state).startswith('validate: 1,200/2,000 (60%)')
+        )
+        progress.start('commit')
+        result = progress.result(collection_path='/tmp/ddr-test-123')
+        self.assertEqual(list(result['timings'].keys()), ['validate', 'commit'])
@@ -0,0 +1,22 @@
+from django.test import TestCase
+
+from webui.tasks import routing
+
+
+class Routing(TestCase):
+
+    def test_route_task(self):
+        self.assertEqual(routing.lane('ddr-test-123', lanes=4), 'collection-0')
+        self.assertEqual(
+            routing.route_task('collection-reindex', ('/tmp/ddr-test-123',), {}, {}),
+            {'queue': routing.QUEUE_INDEX}
+        )
+        self.assertEqual(
+            routing.route_task('entity-edit', ('/tmp/ddr-test-123',), {}, {})['queue'],
+            routing.route_task('file-delete', ('a', 'b', '/tmp/ddr-test-123'), {}, {})['queue'],
+        )
+        self.assertEqual(
+            routing.route_task('entity-edit', ('/tmp/ddr-test-123',), {}, {})['queue'],
+            routing.route_task('webui-file-new-batch', ('/tmp/ddr-test-123', [], 'master'), {}, {})['queue'],
+        )
+        self.assertIsNone(routing.route_task('unknown-task', (), {}, {}))
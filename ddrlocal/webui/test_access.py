@@ -0,0 +1,98 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from django.test import TestCase
+
+from webui import access
+
+
+class Access(TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.files_dir = os.path.join(
+            self.base_dir, 'ddr-test-123', 'files', 'ddr-test-123-4', 'files'
+        )
+        os.makedirs(self.files_dir)
+        self.thumbnails = []
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def add_file(self, fid, ext='.tif', data=b'image', sha1='a1b2c3'):
+        path = os.path.join(self.files_dir, fid + ext)
+        with open(path, 'wb') as f:
+            f.write(data)
+        with open(os.path.join(self.files_dir, fid + '.json'), 'w') as f:
+            f.write(json.dumps([{'git_version': 'x'}, {'id': fid}, {'sha1': sha1}]))
+        return path
+
+    def thumbnail(self, src, dest, geometry):
+        self.thumbnails.append(src)
+        with open(dest, 'wb') as f:
+            f.write(b'jpeg')
+
+    def test_missing(self):
+        master = self.add_file('ddr-test-123-4-master-a1b2c3d4e5')
+        done = self.add_file('ddr-test-123-4-mezzanine-f6g7h8i9j0')
+        with open(access.access_path(done), 'wb') as f:
+            f.write(b'jpeg')
+        self.add_file('ddr-test-123-4-transcript-0a1b2c3d4e', ext='.pdf')
+        # annex content not present
+        os.remove(self.add_file('ddr-test-123-4-master-5f6g7h8i9j'))
+        jobs = access.missing(os.path.join(self.base_dir, 'ddr-test-123'))
+        self.assertEqual([(j['src'], j['dest'], j['sha1']) for j in jobs], [
+            (master, access.access_path(master), 'a1b2c3'),
+        ])
+
+    def test_generate_dedup(self):
+        src1 = self.add_file('ddr-test-123-4-master-a1b2c3d4e5')
+        src2 = self.add_file('ddr-test-123-4-mezzanine-f6g7h8i9j0')
+        jobs = [
+            access.job(src1, sha1='a1b2c3', geometry='1024x1024>'),
+            access.job(src1, sha1='a1b2c3', geometry='1024x1024>'),
+            # same content: made once, copied
+            access.job(src2, sha1='a1b2c3', geometry='1024x1024>'),
+        ]
+        with mock.patch('webui.access.imaging.thumbnail', side_effect=self.thumbnail):
+            results,stats = access.generate(jobs, workers=2, base_dir=self.base_dir)
+            self.assertEqual(len(self.thumbnails), 1)
+            self.assertEqual(sorted([r['status'] for r in results]), ['cached', 'made'])
+            for j in jobs:
+                self.assertTrue(os.path.exists(j['dest']))
+            # cached by sha1: running again only copies
+            results,stats = access.generate(jobs, base_dir=self.base_dir)
+            self.assertEqual(len(self.thumbnails), 1)
+            self.assertEqual(stats['formats']['TIFF']['cached'], 2)
+
+    def test_prune(self):
+        old = access.cache_path('a1b2c3', '1024x1024>', self.base_dir)
+        new = access.cache_path('d4e5f6', '1024x1024>', self.base_dir)
+        os.makedirs(os.path.dirname(old))
+        for path in [old, new]:
+            with open(path, 'wb') as f:
+                f.write(b'jpeg')
+        os.utime(old, (time.time() - access.CACHE_MAX_AGE - 60,) * 2)
+        access.prune(self.base_dir)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+    def test_format_stats(self):
+        src = self.add_file('ddr-test-123-4-master-a1b2c3d4e5', data=b'x' * 1024 * 1024)
+        results = [
+            {'src': src, 'status': 'made', 'seconds': 1.5},
+            {'src': src, 'status': 'cached', 'seconds': 0.5},
+            {'src': '/missing/file.pdf', 'status': 'error', 'seconds': 0.0},
+        ]
+        stats = access.format_stats(results, elapsed=1.0)
+        self.assertEqual(stats['formats']['TIFF'], {
+            'files': 2, 'made': 1, 'cached': 1, 'errors': 0,
+            'MB': 2.0, 'seconds': 2.0, 'files_per_sec': 1.0,
+        })
+        self.assertEqual(stats['formats']['PDF']['errors'], 1)
+        self.assertEqual(stats['formats']['PDF']['files_per_sec'], None)
+        self.assertEqual((stats['files'], stats['elapsed'], stats['files_per_sec']), (3, 1.0, 3.0))
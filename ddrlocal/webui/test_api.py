@@ -1,3 +1,5 @@
+import json
+
 from elasticsearch.connection.base import TransportError
 import pytest
 import requests
@@ -6,6 +8,8 @@ from django.conf import settings
 from django.test import TestCase
 from django.urls import reverse
 
+from webui import models
+
 HOST_CHECK_URL = 'http://{}'.format(settings.DOCSTORE_HOST)
 
 NO_ELASTICSEARCH_ERR = "Elasticsearch cluster not available."
@@ -86,6 +90,33 @@ class APIObjectViewsFS(TestCase):
         response = self.client.get(reverse('api-fs-detail', args=[oid]))
         self.assertEqual(response.status_code, 200)
 
+    def test_api_fs_conditional(self):
+        oid = 'ddr-densho-10-1'
+        url = reverse('api-fs-detail', args=[oid])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_api_fs_bulk(self):
+        oids = ['ddr-densho-10', 'ddr-densho-10-1', 'ddr-densho-10-99999']
+        url = reverse('api-fs-bulk') + '?ids=' + ','.join(oids)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.data.keys()), oids)
+        self.assertIsNone(response.data['ddr-densho-10-99999'])
+        response = self.client.get(reverse('api-fs-bulk'))
+        self.assertEqual(response.status_code, 400)
+
+
+class URLTemplates(TestCase):
+
+    def test_url(self):
+        oid = 'ddr-densho-10-1'
+        urls = models.URLTemplates(None)
+        for name in ['api-object', 'api-object-children', 'webui-detail']:
+            self.assertEqual(urls.url(name, oid), reverse(name, args=[oid]))
+
 
 class APISearchView(TestCase):
 
@@ -110,3 +141,33 @@ class APISearchView(TestCase):
         url = reverse('api-search') + '?fulltext=seattle&genre=photograph'
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
+    
+    @pytest.mark.skipif(no_elasticsearch(), reason=NO_ELASTICSEARCH_ERR)
+    def test_search_results_aggs(self):
+        url = reverse('api-search') + '?fulltext=seattle'
+        response = self.client.get(url)
+        self.assertNotIn('aggregations', response.data)
+        url = reverse('api-search') + '?fulltext=seattle&aggs=requested&facets=genre'
+        response = self.client.get(url)
+        self.assertEqual(list(response.data['aggregations'].keys()), ['genre'])
+        url = reverse('api-search') + '?fulltext=seattle&aggs=bogus'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 400)
+    
+    @pytest.mark.skipif(no_elasticsearch(), reason=NO_ELASTICSEARCH_ERR)
+    def test_search_export(self):
+        url = reverse('api-search-export') + '?fulltext=seattle&fields=id,title'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        for line in b''.join(response.streaming_content).splitlines():
+            self.assertTrue(json.loads(line).get('id'))
+        response = self.client.get(reverse('api-search-export'))
+        self.assertEqual(response.status_code, 400)
+    
+    @pytest.mark.skipif(no_elasticsearch(), reason=NO_ELASTICSEARCH_ERR)
+    def test_search_facets(self):
+        url = reverse('api-search-facets') + '?fulltext=seattle'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age', response['Cache-Control'])
@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import mock
+
+from django.test import TestCase
+
+from webui import checker
+
+
+def fake_validate_paths(paths):
+    """Stands in for DDR.util.validate_paths: files containing "bad" fail
+    """
+    for n,path in enumerate(paths):
+        with open(path, 'r') as f:
+            if 'bad' in f.read():
+                yield n, path, Exception('bad JSON')
+
+def find_json(collection_path, **kwargs):
+    paths = []
+    for dirpath,dirnames,filenames in os.walk(collection_path):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        paths += [os.path.join(dirpath, f) for f in filenames if f.endswith('.json')]
+    return sorted(paths)
+
+
+class Checker(TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.collection_path = os.path.join(self.base_dir, 'ddr-test-123')
+        os.makedirs(self.collection_path)
+        self.git('init')
+        self.git('config', 'user.name', 'test')
+        self.git('config', 'user.email', 'test@example.com')
+        self.write('collection.json', {'id': 'ddr-test-123'})
+        for n in range(1, 4):
+            self.write('files/ddr-test-123-%s/entity.json' % n, {'id': 'ddr-test-123-%s' % n})
+        self.write('files/ddr-test-123-3/entity.json', 'bad')
+        self.git('add', '.')
+        self.git('commit', '-m', 'test')
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def git(self, *args):
+        return subprocess.check_output(
+            ['git'] + list(args), cwd=self.collection_path, stderr=subprocess.DEVNULL
+        ).decode().strip()
+
+    def write(self, relpath, data):
+        path = os.path.join(self.collection_path, relpath)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(json.dumps(data))
+
+    def check(self, incremental):
+        with mock.patch.object(checker.util, 'find_meta_files', find_json), \
+             mock.patch.object(checker.util, 'validate_paths', fake_validate_paths):
+            return checker.check_collection(
+                self.collection_path, incremental=incremental,
+                workers=1, base_dir=self.base_dir, chunk_size=2
+            )
+
+    def test_blob_shas(self):
+        self.write('files/ddr-test-123-1/entity.json', {'id': 'changed'})
+        self.write('files/ddr-test-123-4/entity.json', {'id': 'untracked'})
+        shas = checker.blob_shas(self.collection_path)
+        self.assertEqual(sorted(shas.keys()), [
+            'collection.json',
+            'files/ddr-test-123-2/entity.json',
+            'files/ddr-test-123-3/entity.json',
+        ])
+        self.assertEqual(
+            shas['collection.json'], self.git('hash-object', 'collection.json')
+        )
+
+    def test_check_collection(self):
+        summary = self.check(incremental=False)
+        self.assertEqual((summary['files'], summary['checked'], summary['errors']), (4, 4, 1))
+        self.assertEqual(
+            summary['bad_files'], ['files/ddr-test-123-3/entity.json ERROR bad JSON']
+        )
+        with open(summary['report'], 'r') as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([line['type'] for line in lines], ['error', 'summary'])
+
+    def test_incremental(self):
+        self.check(incremental=False)
+        # only the failed file and the modified file are checked again
+        self.write('files/ddr-test-123-1/entity.json', {'id': 'changed'})
+        summary = self.check(incremental=True)
+        self.assertEqual((summary['checked'], summary['skipped']), (2, 2))
+        # model definitions changed: everything is checked again
+        with mock.patch.dict(checker.dvcs.APP_COMMITS, {'def': 'a1b2c3d4e5'}):
+            summary = self.check(incremental=True)
+        self.assertEqual((summary['checked'], summary['skipped']), (4, 0))
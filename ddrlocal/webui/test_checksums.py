@@ -0,0 +1,80 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from webui import checksums
+
+
+class Checksums(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def expected(self, data):
+        return {
+            'size': len(data),
+            'md5': hashlib.md5(data).hexdigest(),
+            'sha1': hashlib.sha1(data).hexdigest(),
+            'sha256': hashlib.sha256(data).hexdigest(),
+        }
+
+    def test_multihash(self):
+        data = os.urandom(5000)
+        h = checksums.MultiHash()
+        h.update(data[:1000])
+        h.update(data[1000:])
+        self.assertEqual(h.hexdigests(), self.expected(data))
+        h = checksums.MultiHash(['sha1'])
+        self.assertEqual(h.hexdigests(), {'size': 0, 'sha1': hashlib.sha1().hexdigest()})
+
+    def test_file_checksums(self):
+        # several chunks, the last one partial
+        data = os.urandom(10000)
+        path = self.write('IMG_0001.TIF', data)
+        for use_mmap in [False, True]:
+            self.assertEqual(
+                checksums.file_checksums(path, chunk_size=4096, use_mmap=use_mmap),
+                self.expected(data)
+            )
+        self.assertEqual(
+            checksums.file_checksums(path, ['sha1']),
+            {'size': 10000, 'sha1': hashlib.sha1(data).hexdigest()}
+        )
+
+    def test_file_checksums_empty(self):
+        path = self.write('empty', b'')
+        for use_mmap in [False, True]:
+            self.assertEqual(
+                checksums.file_checksums(path, use_mmap=use_mmap), self.expected(b'')
+            )
+
+    def test_known_checksums(self):
+        data = b'0123456789'
+        path = self.write('IMG_0002.TIF', data)
+        self.assertIsNone(checksums.known_checksums(path))
+        checksums.save_checksums(path, checksums.file_checksums(path, ['sha1']))
+        self.assertEqual(
+            checksums.known_checksums(path, ['sha1']),
+            {'size': 10, 'sha1': hashlib.sha1(data).hexdigest()}
+        )
+        # md5 was not saved
+        self.assertIsNone(checksums.known_checksums(path, ['md5', 'sha1']))
+        # file changed since
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime + 10))
+        self.assertIsNone(checksums.known_checksums(path, ['sha1']))
+        checksums.save_checksums(path, checksums.file_checksums(path, ['sha1']))
+        self.write('IMG_0002.TIF', data + b'more')
+        self.assertIsNone(checksums.known_checksums(path, ['sha1']))
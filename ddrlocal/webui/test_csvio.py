@@ -0,0 +1,310 @@
+import csv
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from webui import csvio
+
+
+def fake_export(paths, model, csv_path, required_only=False):
+    """Stands in for DDR.batch.Exporter.export: one row per object,
+    with a newline inside a quoted field
+    """
+    with open(csv_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'title'])
+        for path in paths:
+            with open(path, 'r') as j:
+                title = j.read()
+            writer.writerow([os.path.basename(os.path.dirname(path)), '%s\nsecond line' % title])
+
+
+class FakeIdentifier(object):
+    """Stands in for DDR.identifier.Identifier: IDs under one collection dir
+    """
+    base_dir = None
+
+    def __init__(self, id=None, path=None):
+        parts = id.split('-')
+        if len(parts) < 4:
+            raise Exception('bad ID')
+        self.id = id
+        self.model = {4: 'entity', 5: 'file-role', 6: 'file'}[len(parts)]
+
+    def parent(self):
+        if self.model == 'entity':
+            return None
+        return FakeIdentifier(id='-'.join(self.id.split('-')[:4]))
+
+    def path_abs(self, append=None):
+        entity_dir = os.path.join(
+            self.base_dir, 'ddr-test-123', 'files', '-'.join(self.id.split('-')[:4])
+        )
+        if self.model == 'entity':
+            return os.path.join(entity_dir, {None: '', 'json': 'entity.json'}.get(append, append))
+        return os.path.join(entity_dir, 'files', '%s.json' % self.id)
+
+
+class FakeCollection(object):
+    def __init__(self, path):
+        self.path_abs = path
+        self.id = os.path.basename(path)
+
+
+class Export(TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.collection_path = os.path.join(self.base_dir, 'ddr-test-123')
+        os.makedirs(self.collection_path)
+        self.git('init')
+        self.git('config', 'user.name', 'test')
+        self.git('config', 'user.email', 'test@example.com')
+        for n in range(1, 6):
+            self.write('files/ddr-test-123-%s/entity.json' % n, 'title %s' % n)
+        self.git('add', '.')
+        self.git('commit', '-m', 'test')
+        self.exported = []
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def git(self, *args):
+        return subprocess.check_output(
+            ['git'] + list(args), cwd=self.collection_path, stderr=subprocess.DEVNULL
+        ).decode().strip()
+
+    def write(self, relpath, text):
+        path = os.path.join(self.collection_path, relpath)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def export(self, paths, model, csv_path, required_only=False):
+        self.exported += [os.path.basename(os.path.dirname(path)) for path in paths]
+        fake_export(paths, model, csv_path, required_only)
+
+    def export_rows(self, rows_db=None):
+        with mock.patch('webui.csvio.Exporter.export', side_effect=self.export):
+            return ''.join(csvio.export_rows(
+                self.collection_path, 'entity', workers=1, chunk_size=2, rows_db=rows_db
+            ))
+
+    def test_split_rows(self):
+        text = 'a,"one\ntwo"\r\nb,three\r\nc,"four\r\n""five""\nsix"\r\n'
+        self.assertEqual(csvio._split_rows(text), [
+            'a,"one\ntwo"\r\n', 'b,three\r\n', 'c,"four\r\n""five""\nsix"\r\n',
+        ])
+        self.assertEqual(csvio._split_rows(''), [])
+
+    def test_rows_cache(self):
+        rows_db = csvio.rows_db_path(self.base_dir, self.collection_path, 'entity')
+        full = self.export_rows(rows_db)
+        self.assertEqual(len(self.exported), 5)
+        self.exported = []
+        # nothing changed: every row comes from the cache
+        self.assertEqual(self.export_rows(rows_db), full)
+        self.assertEqual(self.exported, [])
+        # only the changed object is formatted again
+        self.write('files/ddr-test-123-3/entity.json', 'changed')
+        text = self.export_rows(rows_db)
+        self.assertEqual(self.exported, ['ddr-test-123-3'])
+        self.assertIn('changed\nsecond line', text)
+        self.exported = []
+        self.assertEqual(text, self.export_rows())
+
+    def test_rows_cache_version(self):
+        path = csvio.rows_db_path(self.base_dir, self.collection_path, 'entity')
+        conn = csvio.rows_connect(path, 'v1')
+        conn.execute("INSERT INTO rows VALUES ('a.json', 'abc', 'row')")
+        conn.commit()
+        conn.close()
+        conn = csvio.rows_connect(path, 'v1')
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM rows').fetchone()[0], 1)
+        conn.close()
+        # new model definitions or ddr-cmdln empty the cache
+        conn = csvio.rows_connect(path, 'v2')
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM rows').fetchone()[0], 0)
+        conn.close()
+
+    def test_cached_export(self):
+        collection = FakeCollection(self.collection_path)
+        csv_export_path = {'entity': os.path.join(self.base_dir, '%s-objects.csv')}
+        with override_settings(CSV_EXPORT_PATH=csv_export_path, MEDIA_BASE=self.base_dir):
+            self.assertEqual(csvio.cached_export(collection, 'entity'), None)
+            with mock.patch('webui.csvio.Exporter.export', side_effect=self.export):
+                path = csvio.export_to_csv(collection, 'entity')
+            self.assertEqual(csvio.cached_export(collection, 'entity'), path)
+            # uncommitted edit
+            self.write('files/ddr-test-123-2/entity.json', 'edit 1')
+            self.assertEqual(csvio.cached_export(collection, 'entity'), None)
+            with mock.patch('webui.csvio.Exporter.export', side_effect=self.export):
+                path = csvio.export_to_csv(collection, 'entity')
+            self.assertEqual(csvio.cached_export(collection, 'entity'), path)
+            # same file edited again: git status is unchanged, content is not
+            self.write('files/ddr-test-123-2/entity.json', 'edit 2')
+            self.assertEqual(csvio.cached_export(collection, 'entity'), None)
+            # new commit
+            self.git('commit', '-a', '-m', 'edit')
+            self.assertEqual(csvio.cached_export(collection, 'entity'), None)
+
+
+class Import(TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        FakeIdentifier.base_dir = self.base_dir
+        self.collection = FakeCollection(os.path.join(self.base_dir, 'ddr-test-123'))
+        os.makedirs(os.path.join(self.collection.path_abs, 'files', 'ddr-test-123-4', 'files'))
+        with open(FakeIdentifier(id='ddr-test-123-4').path_abs('json'), 'w') as f:
+            f.write('[]')
+        with open(FakeIdentifier(id='ddr-test-123-4').path_abs('changelog'), 'w') as f:
+            f.write('created\n')
+        with open(FakeIdentifier(id='ddr-test-123-4-master-a1b2c3d4e5').path_abs('json'), 'w') as f:
+            f.write('[]')
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def git(self, *args):
+        return subprocess.check_output(
+            ['git'] + list(args), cwd=self.collection.path_abs, stderr=subprocess.DEVNULL
+        ).decode().strip()
+
+    def init_repo(self):
+        self.git('init')
+        self.git('config', 'user.name', 'test')
+        self.git('config', 'user.email', 'test@example.com')
+        self.git('add', '.')
+        self.git('commit', '-m', 'test')
+
+    def build_chunk(self, args):
+        """Stands in for csvio._build_chunk: title into entity.json, a changelog line
+        """
+        collection_path,rows,git_name,git_mail,agent = args
+        written = []
+        for n,rowd in rows:
+            oid = FakeIdentifier(id=rowd['id'])
+            os.makedirs(oid.path_abs(), exist_ok=True)
+            with open(oid.path_abs('json'), 'w') as f:
+                f.write(rowd['title'])
+            with open(oid.path_abs('changelog'), 'a') as f:
+                f.write('%s\n' % agent)
+            written += [
+                os.path.relpath(oid.path_abs('json'), collection_path),
+                os.path.relpath(oid.path_abs('changelog'), collection_path),
+            ]
+        return written
+
+    def import_entities(self, path):
+        with mock.patch('webui.csvio.Identifier', FakeIdentifier), \
+             mock.patch('webui.csvio.cached_plan', return_value=None), \
+             mock.patch('webui.csvio.validate_rows', return_value=[]), \
+             mock.patch('webui.csvio._build_chunk', side_effect=self.build_chunk):
+            return csvio.import_entities(path, self.collection, 'test', 'test@example.com', workers=2)
+
+    def write_csv(self, text):
+        path = os.path.join(self.base_dir, 'import.csv')
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+        return path
+
+    def test_read_rows(self):
+        path = self.write_csv(
+            '\ufeffid , title,extra\r\n'
+            'ddr-test-123-4, Title ,\r\n'
+            'ddr-test-123-5,"two\r\nlines",x,overflow\r\n'
+        )
+        headers,rowds = csvio.read_rows(path)
+        self.assertEqual(headers, ['id', 'title', 'extra'])
+        self.assertEqual(rowds, [
+            {'id': 'ddr-test-123-4', 'title': 'Title', 'extra': ''},
+            {'id': 'ddr-test-123-5', 'title': 'two\r\nlines', 'extra': 'x'},
+        ])
+
+    def test_plan_import(self):
+        with open(os.path.join(self.base_dir, 'IMG_0001.TIF'), 'wb') as f:
+            f.write(b'x' * 100)
+        path = self.write_csv(
+            'id,basename_orig\n'
+            'ddr-test-123-4-master,IMG_0001.TIF\n'
+            'ddr-test-123-4-mezzanine,IMG_0002.TIF\n'
+            'ddr-test-123-5-master,IMG_0001.TIF\n'
+            'ddr-test-123-4-master-a1b2c3d4e5,\n'
+            'ddr-test-123-4-master-f6g7h8i9j0,\n'
+        )
+        with mock.patch('webui.csvio.Identifier', FakeIdentifier), \
+             mock.patch('webui.csvio.validate_rows', return_value=[]), \
+             mock.patch('webui.csvio.plan_key', return_value={}):
+            plan = csvio.plan_import(path, self.collection, 'file')
+        self.assertFalse(plan['valid'])
+        self.assertEqual(plan['rows'], 5)
+        self.assertEqual(plan['entities'], {
+            'new': [], 'existing': ['ddr-test-123-4'], 'missing': ['ddr-test-123-5'],
+        })
+        self.assertEqual(plan['files'], {
+            'new': 3, 'existing': 1,
+            'missing': [os.path.join(self.base_dir, 'IMG_0002.TIF')],
+        })
+        self.assertEqual(len(plan['errors']), 3)
+        self.assertIn('row 3: ddr-test-123-4-mezzanine source file', plan['errors'][0])
+        self.assertIn('row 4: ddr-test-123-5-master entity ddr-test-123-5', plan['errors'][1])
+        self.assertIn('row 6: ddr-test-123-4-master-f6g7h8i9j0 does not', plan['errors'][2])
+        # same source twice is counted once; DDR hashes it three times, copies it once
+        self.assertEqual(plan['copy_bytes'], 100)
+        self.assertEqual(plan['hash_bytes'], 300)
+        self.assertEqual(plan['read_bytes'], 400)
+        self.assertEqual(plan['annex_bytes'], 100)
+        self.assertEqual(csvio.read_plan(path, 'file'), plan)
+
+    def test_import_entities(self):
+        self.init_repo()
+        path = self.write_csv('id,title\nddr-test-123-4,Updated\nddr-test-123-5,New\n')
+        commit,imported = self.import_entities(path)
+        self.assertEqual(commit, self.git('rev-parse', 'HEAD'))
+        self.assertEqual(imported, [
+            'files/ddr-test-123-4/entity.json', 'files/ddr-test-123-5/entity.json',
+        ])
+        self.assertEqual(self.git('status', '--porcelain'), '')
+        self.assertEqual(self.git('rev-list', '--count', 'HEAD'), '2')
+
+    def test_import_entities_rollback(self):
+        self.init_repo()
+        head = self.git('rev-parse', 'HEAD')
+        # commit fails after everything is built and staged
+        hook = os.path.join(self.collection.path_abs, '.git', 'hooks', 'pre-commit')
+        with open(hook, 'w') as f:
+            f.write('#!/bin/sh\nexit 1\n')
+        os.chmod(hook, 0o755)
+        path = self.write_csv('id,title\nddr-test-123-4,Updated\nddr-test-123-5,New\n')
+        self.assertRaises(Exception, self.import_entities, path)
+        self.assertEqual(self.git('rev-parse', 'HEAD'), head)
+        self.assertEqual(self.git('status', '--porcelain'), '')
+        with open(FakeIdentifier(id='ddr-test-123-4').path_abs('json'), 'r') as f:
+            self.assertEqual(f.read(), '[]')
+        self.assertFalse(os.path.exists(FakeIdentifier(id='ddr-test-123-5').path_abs()))
+
+    def test_import_entities_invalid(self):
+        path = self.write_csv('id,title\nddr-test-123-5,\n')
+        with mock.patch('webui.csvio.cached_plan', return_value=None), \
+             mock.patch('webui.csvio.validate_rows', return_value=['row 2: title: required']):
+            self.assertRaisesRegex(
+                Exception, '1 errors in import.csv', csvio.import_entities,
+                path, self.collection, 'test', 'test@example.com'
+            )
+        self.assertFalse(os.path.exists(FakeIdentifier(id='ddr-test-123-5').path_abs()))
+
+    def test_validate_row(self):
+        specs = {'names': ['id', 'title', 'status'], 'required': ['id', 'title']}
+        rowd = {'id': 'ddr-test-123-4', 'title': 'Title', 'status': 'completed'}
+        self.assertEqual(csvio.validate_row(rowd, specs, 'ddr-test-123'), [])
+        rowd = {'id': 'ddr-test-124-4', 'title': ''}
+        self.assertEqual(
+            csvio.validate_row(rowd, specs, 'ddr-test-123'),
+            ['id: "ddr-test-124-4" is not in ddr-test-123', 'title: required']
+        )
@@ -0,0 +1,76 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import TestCase
+
+from webui import dataset
+
+
+class Dataset(TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.out_dir = os.path.join(self.base_dir, 'tmp', 'dataset')
+        self.keys = {}
+        for cid in ['ddr-test-1', 'ddr-test-2', 'ddr-test-3']:
+            self.write(cid, 'collection.json', {'id': cid})
+            for n in [1, 2]:
+                eid = '%s-%s' % (cid, n)
+                self.write(cid, 'files/%s/entity.json' % eid, [{'git_version': 'x'}, {'id': eid}])
+                fid = '%s-master-a1b2c3d4e5' % eid
+                self.write(cid, 'files/%s/files/%s.json' % (eid, fid), {'id': fid})
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def write(self, cid, relpath, data):
+        path = os.path.join(self.base_dir, cid, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(json.dumps(data))
+
+    def export_key(self, collection_path, model):
+        return {'commit': self.keys.get(os.path.basename(collection_path), 'a')}
+
+    def export_store(self, **kwargs):
+        with mock.patch('webui.dataset.csvio.export_key', side_effect=self.export_key):
+            return dataset.export_store(self.base_dir, self.out_dir, workers=1, **kwargs)
+
+    def test_export_store(self):
+        stats = self.export_store()
+        self.assertEqual(stats['exported'], ['ddr-test-1', 'ddr-test-2', 'ddr-test-3'])
+        self.assertEqual((stats['entities'], stats['files']), (6, 6))
+        path = os.path.join(
+            dataset.partition_path(self.out_dir, 'file', 'ddr-test-1'), dataset.PART_FILENAME
+        )
+        with gzip.open(path, 'rt') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(rows[0], {
+            'id': 'ddr-test-1-1-master-a1b2c3d4e5',
+            'collection_id': 'ddr-test-1', 'entity_id': 'ddr-test-1-1',
+        })
+
+    def test_refresh(self):
+        self.export_store()
+        # one collection changed, one removed from the Store
+        self.keys['ddr-test-2'] = 'b'
+        shutil.rmtree(os.path.join(self.base_dir, 'ddr-test-3'))
+        stats = self.export_store()
+        self.assertEqual(stats['exported'], ['ddr-test-2'])
+        self.assertEqual(stats['unchanged'], ['ddr-test-1'])
+        self.assertEqual(stats['removed'], ['ddr-test-3'])
+        self.assertEqual((stats['entities'], stats['files']), (4, 4))
+        manifest = dataset.read_manifest(self.out_dir)
+        self.assertEqual(sorted(manifest['collections'].keys()), ['ddr-test-1', 'ddr-test-2'])
+        self.assertEqual(manifest['collections']['ddr-test-2']['key'], {'commit': 'b'})
+        for model in dataset.MODELS:
+            self.assertEqual(
+                sorted(os.listdir(os.path.join(self.out_dir, model))),
+                ['collection_id=ddr-test-1', 'collection_id=ddr-test-2']
+            )
+        # force rewrites everything
+        self.assertEqual(self.export_store(force=True)['unchanged'], [])
@@ -0,0 +1,102 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from webui import fulltext
+
+OBJECTS = [
+    ('ddr-test-1', 'collection', {'title': 'Seattle collection'}),
+    ('ddr-test-1-1', 'entity', {
+        'title': 'Photo of Seattle', 'description': 'Café', 'genre': 'photograph',
+        'topics': [{'id': 120, 'term': 'Activism'}],
+    }),
+    ('ddr-test-1-2', 'entity', {
+        'title': 'Letter from Minidoka', 'genre': 'letter',
+        'topics': [{'id': 120, 'term': 'Activism'}],
+    }),
+    ('ddr-test-10', 'collection', {'title': 'Another collection'}),
+    ('ddr-test-10-1', 'entity', {'title': 'Seattle street', 'genre': 'photograph'}),
+]
+
+
+class Fulltext(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'index', 'fulltext.sqlite3')
+        conn = fulltext.connect(self.path)
+        with conn:
+            for oid,model,data in OBJECTS:
+                json_path = os.path.join(self.tmp, '%s.json' % oid)
+                with open(json_path, 'w') as f:
+                    f.write(json.dumps([{'git_version': 'x'}, {'id': oid}, data]))
+                self.assertTrue(fulltext.index_json(conn, oid, model, json_path))
+                # unchanged JSON is not indexed again
+                self.assertFalse(fulltext.index_json(conn, oid, model, json_path))
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def ids(self, **kwargs):
+        total,documents = fulltext.search(path=self.path, **kwargs)
+        self.assertEqual(total, len(documents))
+        return sorted(document['id'] for document in documents)
+
+    def test_document(self):
+        total,documents = fulltext.search(fulltext='minidoka', path=self.path)
+        self.assertEqual(documents[0]['id'], 'ddr-test-1-2')
+        self.assertEqual(documents[0]['parent_id'], 'ddr-test-1')
+        self.assertEqual(documents[0]['collection_id'], 'ddr-test-1')
+        self.assertEqual(documents[0]['organization_id'], 'ddr-test')
+
+    def test_fulltext(self):
+        self.assertEqual(
+            self.ids(fulltext='seattle'), ['ddr-test-1', 'ddr-test-1-1', 'ddr-test-10-1']
+        )
+        self.assertEqual(self.ids(fulltext='seattle photo'), ['ddr-test-1-1'])
+        self.assertEqual(self.ids(fulltext='cafe'), ['ddr-test-1-1'])
+        self.assertEqual(self.ids(fulltext='minid*'), ['ddr-test-1-2'])
+        self.assertEqual(self.ids(fulltext='minid'), [])
+        # FTS5 syntax in user input is inert
+        self.assertEqual(fulltext.search(fulltext='"; *', path=self.path), (0, []))
+
+    def test_parent(self):
+        # ddr-test-10-1 is not a child of ddr-test-1
+        self.assertEqual(
+            self.ids(parent='ddr-test-1'), ['ddr-test-1-1', 'ddr-test-1-2']
+        )
+        self.assertEqual(
+            self.ids(fulltext='seattle', parent='ddr-test-1', models=['entity']),
+            ['ddr-test-1-1']
+        )
+
+    def test_terms(self):
+        self.assertEqual(
+            self.ids(terms={'genre': 'photograph'}), ['ddr-test-1-1', 'ddr-test-10-1']
+        )
+        self.assertEqual(
+            self.ids(terms={'genre': ['photograph', 'letter'], 'topics': 120}),
+            ['ddr-test-1-1', 'ddr-test-1-2']
+        )
+        aggs = fulltext.aggregations(parent='ddr-test-1', fields=['genre'], path=self.path)
+        self.assertEqual(
+            sorted(aggs['genre'], key=lambda agg: agg['key']),
+            [{'key': 'letter', 'doc_count': 1}, {'key': 'photograph', 'doc_count': 1}]
+        )
+        aggs = fulltext.aggregations(fulltext='seattle', fields=['genre', 'topics'], path=self.path)
+        self.assertEqual(aggs['genre'], [{'key': 'photograph', 'doc_count': 2}])
+        self.assertEqual(aggs['topics'], [{'key': '120', 'doc_count': 1}])
+
+    def test_delete(self):
+        fulltext.delete('ddr-test-1', path=self.path)
+        self.assertEqual(self.ids(), ['ddr-test-10', 'ddr-test-10-1'])
+        self.assertEqual(self.ids(fulltext='seattle'), ['ddr-test-10-1'])
+        self.assertEqual(self.ids(terms={'topics': 120}), [])
+
+    def test_connect_recreates(self):
+        os.remove(self.path)
+        self.assertEqual(fulltext.search(path=self.path), (0, []))
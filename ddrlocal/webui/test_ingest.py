@@ -0,0 +1,134 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from webui import ingest
+
+
+class FakeLog(object):
+    """Stands in for DDR.ingest.AddFileLogger
+    """
+    def __init__(self):
+        self.lines = []
+
+    def ok(self, msg):
+        self.lines.append('ok - %s' % msg)
+
+    def not_ok(self, msg):
+        self.lines.append('not ok - %s' % msg)
+
+    def crash(self, msg):
+        self.not_ok(msg)
+        raise Exception(msg)
+
+    def log(self):
+        return '\n'.join(self.lines)
+
+
+class FakeEntity(object):
+    def __init__(self, base_dir, eid):
+        self.id = eid
+        self.files_path = os.path.join(base_dir, eid, 'files')
+        os.makedirs(self.files_path)
+
+
+class Ingest(TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.entity = FakeEntity(self.base_dir, 'ddr-test-123-4')
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.base_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_checkpoints(self):
+        log = FakeLog()
+        ingest.checkpoint(log, 'a1b2c3d4e5', 'hash', {'sha1': 'abc'})
+        ingest.checkpoint(log, 'a1b2c3d4e5', 'copy', {'path': '/tmp/x'})
+        ingest.checkpoint(log, 'f6g7h8i9j0', 'hash')
+        log.ok('not a checkpoint')
+        self.assertEqual(ingest.read_checkpoints(log), {
+            'a1b2c3d4e5': {'hash': {'sha1': 'abc'}, 'copy': {'path': '/tmp/x'}},
+            'f6g7h8i9j0': {'hash': {}},
+        })
+        self.assertEqual(ingest.checkpoints(log, 'unknown'), {})
+
+    def test_copy_file_resume(self):
+        data = os.urandom(10000)
+        src_path = self.write('src.bin', data)
+        dest_path = os.path.join(self.base_dir, 'staged', 'src.bin')
+        # interrupted copy left the first part
+        os.makedirs(os.path.dirname(dest_path))
+        with open(dest_path + '.part', 'wb') as f:
+            f.write(data[:3000])
+        hashed = ingest.copy_file(src_path, dest_path, chunk_size=1024)
+        self.assertEqual(hashed, {'size': 10000, 'sha1': hashlib.sha1(data).hexdigest()})
+        self.assertFalse(os.path.exists(dest_path + '.part'))
+        with open(dest_path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_prepare_resume(self):
+        with override_settings(MEDIA_BASE=self.base_dir):
+            data = b'0123456789' * 100
+            src_path = self.write('IMG_0001.TIF', data)
+            log = FakeLog()
+            done = ingest.prepare(self.entity, src_path, 'master', log)
+            sha1 = hashlib.sha1(data).hexdigest()
+            self.assertEqual(done['hash']['sha1'], sha1)
+            self.assertEqual(
+                done['hash']['file_id'], 'ddr-test-123-4-master-%s' % sha1[:10]
+            )
+            key = ingest.ingest_key(src_path)
+            self.assertEqual(ingest.checkpoints(log, key)['hash'], done['hash'])
+            # retry skips the stages already done
+            again = ingest.prepare(self.entity, src_path, 'master', log)
+            self.assertEqual(again['hash'], done['hash'])
+            self.assertIn('ok - resume: %s hash done' % key, log.lines)
+
+    def test_prepare_copy(self):
+        # source not on the Store's filesystem: hashed while it is copied
+        data = b'0123456789' * 100
+        src_path = self.write('IMG_0005.TIF', data)
+        log = FakeLog()
+        with override_settings(MEDIA_BASE=self.base_dir):
+            with mock.patch('webui.ingest.on_store', return_value=False):
+                with mock.patch('webui.checksums.file_checksums') as file_checksums:
+                    done = ingest.prepare(self.entity, src_path, 'master', log)
+                    file_checksums.assert_not_called()
+        self.assertEqual(done['hash']['sha1'], hashlib.sha1(data).hexdigest())
+        with open(done['copy']['path'], 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_prepare_duplicate(self):
+        with override_settings(MEDIA_BASE=self.base_dir):
+            data = b'duplicate'
+            src_path = self.write('IMG_0002.TIF', data)
+            fid = ingest.file_id(self.entity, 'master', hashlib.sha1(data).hexdigest())
+            with open(os.path.join(self.entity.files_path, '%s.json' % fid), 'w') as f:
+                f.write('[]')
+            self.assertRaisesRegex(
+                Exception, 'already has file',
+                ingest.prepare, self.entity, src_path, 'master', FakeLog()
+            )
+
+    def test_batch_identical(self):
+        with override_settings(MEDIA_BASE=self.base_dir):
+            src_paths = [
+                self.write('IMG_0003.TIF', b'same'),
+                self.write('IMG_0004.TIF', b'same'),
+            ]
+            # fails before anything is staged (FakeEntity cannot stage)
+            self.assertRaisesRegex(
+                Exception, 'identical', ingest.batch, self.entity, src_paths, 'master', {},
+                'name', 'mail@example.com', 'agent', FakeLog()
+            )
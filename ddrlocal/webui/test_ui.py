@@ -271,6 +271,13 @@ class TaskView(TestCase):
     def test_task_status(self):
         response = self.client.get(reverse('webui-task-status'))
         self.assertEqual(response.status_code, 200)
+
+    def test_task_events(self):
+        # no tasks in session: stream ends immediately
+        response = self.client.get(reverse('webui-task-events'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn(b'event: done', b''.join(response.streaming_content))
     
     # webui-tasks-dismiss
 
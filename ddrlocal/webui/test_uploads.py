@@ -0,0 +1,45 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from webui import checksums
+from webui import uploads
+
+
+class Uploads(TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def test_upload_resume(self):
+        data = b'0123456789' * 1000
+        upload_id,path = uploads.new_upload('../a b.csv', len(data), self.base_dir)
+        self.assertEqual(os.path.basename(path), 'a_b.csv')
+        status = uploads.append(upload_id, 0, [data[:4000]], base_dir=self.base_dir)
+        self.assertEqual((status['offset'], status['complete']), (4000, False))
+        self.assertIn(upload_id, uploads._HASHES)
+        # wrong offset
+        self.assertRaises(Exception, uploads.append, upload_id, 0, [data], None, self.base_dir)
+        # resumed without digests (e.g. another process): hashed at the end
+        uploads._HASHES.clear()
+        status = uploads.append(upload_id, 4000, [data[4000:]], base_dir=self.base_dir)
+        self.assertTrue(status['complete'])
+        self.assertEqual(
+            checksums.known_checksums(path)['sha1'], hashlib.sha1(data).hexdigest()
+        )
+        uploads.discard(path, self.base_dir)
+        self.assertFalse(os.path.exists(os.path.dirname(path)))
+
+    def test_prune(self):
+        upload_id,path = uploads.new_upload('abandoned.tif', 100, self.base_dir)
+        uploads.append(upload_id, 0, [b'x' * 10], base_dir=self.base_dir)
+        self.assertIn(upload_id, uploads._HASHES)
+        uploads.prune(self.base_dir, max_age=-1)
+        self.assertFalse(os.path.exists(os.path.dirname(path)))
+        self.assertNotIn(upload_id, uploads._HASHES)
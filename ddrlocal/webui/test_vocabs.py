@@ -0,0 +1,28 @@
+from django.test import TestCase
+
+from webui.vocabs import VocabIndex
+
+
+class Vocabs(TestCase):
+
+    def test_vocab_index(self):
+        fields = [
+            {'name': 'status', 'form_type': 'ChoiceField', 'form': {
+                'choices': [('inprocess', 'In Process'), ('completed', 'Completed')],
+            }},
+            {'name': 'language', 'form_type': 'MultipleChoiceField', 'form': {
+                'choices': [('eng', 'English'), ('jpn', 'Japanese')],
+            }},
+            {'name': 'topics', 'form_type': 'CharField', 'form': {}},
+        ]
+        vocabs = {'topics': {'terms': [{'id': 31, 'title': 'Manzanar'}]}}
+        index = VocabIndex(fields, vocabs)
+        self.assertEqual(index.cell('status', 'complete'), ('completed', []))
+        self.assertEqual(index.cell('language', 'eng:English; japanese'), ('eng; jpn', []))
+        self.assertEqual(index.cell('topics', 'Manzanar [31]; Tule Lake [32]'), (
+            'Manzanar [31]; Tule Lake [32]', ['Tule Lake [32]']
+        ))
+        headers = ['id', 'status']
+        rowds = [{'id': 'a', 'status': 'In Progress'}, {'id': 'b', 'status': 'done'}]
+        self.assertEqual(index.normalize(headers, rowds), [(1, 'status', 'done')])
+        self.assertEqual(rowds[0]['status'], 'inprocess')
@@ -0,0 +1,280 @@
+"""
+uploads
+
+Streams uploaded files to the Store, hashing them as they arrive.
+
+Django's default handlers kept small uploads in memory and spooled big
+ones to /tmp in 64KB chunks, after which the CSV import view copied them
+to a fixed /tmp/import-CID-MODEL.csv (two imports for the same collection
+overwrote each other) and ingest read each file again to hash it.
+
+Each upload now gets its own directory on the Store:
+
+    STORE/tmp/uploads/UPLOAD_ID/upload.json
+    STORE/tmp/uploads/UPLOAD_ID/FILENAME.part               while uploading
+    STORE/tmp/uploads/UPLOAD_ID/FILENAME                    when complete
+    STORE/tmp/uploads/UPLOAD_ID/FILENAME.checksums.json
+
+- StoreUploadHandler writes form uploads there in large chunks, feeding
+  each chunk to the checksum digests.  Only views that keep their
+  uploads add it (e.g. CSV import); other uploads are not written to
+  the Store.
+- append() takes a file in pieces (PUT with Content-Range, see
+  webui.views.upload_chunk); an interrupted upload continues from offset.
+  A complete upload is added to an entity with the new file view
+  (webui.views.files.new, ?upload=UPLOAD_ID).
+When an upload is complete its checksums are saved next to it, and
+webui.checksums.known_checksums returns them instead of reading the file.
+
+>>> from webui import uploads
+>>> upload_id,path = uploads.new_upload('IMG_0001.TIF', size=123456789)
+>>> uploads.append(upload_id, 0, chunks, total=123456789)
+{'id': '...', 'name': 'IMG_0001.TIF', 'path': '...', 'size': 123456789, 'offset': 123456789, 'complete': True}
+"""
+
+import fcntl
+import json
+import logging
+logger = logging.getLogger(__name__)
+import os
+import re
+import shutil
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.utils.text import get_valid_filename
+
+from webui import checksums
+from webui import gitstatus
+
+# Bytes written (and hashed) at a time
+UPLOAD_CHUNK_SIZE = checksums.CHECKSUM_CHUNK_SIZE
+UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+UPLOAD_INFO = 'upload.json'
+PART_SUFFIX = '.part'
+# Uploads not used after this many seconds are removed
+UPLOAD_MAX_AGE = 7 * 24 * 60 * 60
+
+# Digests of uploads being appended, by upload ID.  Only valid while
+# chunks arrive in order in this process; otherwise the file is hashed
+# when it is complete.
+_HASHES = {}
+
+
+def upload_dir(base_dir=None):
+    """
+    - STORE/tmp/uploads
+    """
+    return os.path.join(gitstatus.tmp_dir(base_dir or settings.MEDIA_BASE), 'uploads')
+
+def _upload_dir(upload_id, base_dir=None):
+    if not UPLOAD_ID.match(upload_id or ''):
+        raise Exception('Bad upload ID: "%s"' % upload_id)
+    path = os.path.join(upload_dir(base_dir), upload_id)
+    if not os.path.exists(os.path.join(path, UPLOAD_INFO)):
+        raise Exception('No upload %s' % upload_id)
+    return path
+
+def prune(base_dir=None, max_age=UPLOAD_MAX_AGE):
+    """Remove uploads older than max_age seconds
+    """
+    now = time.time()
+    path = upload_dir(base_dir)
+    if not os.path.exists(path):
+        return
+    for upload_id in os.listdir(path):
+        if now - os.path.getmtime(os.path.join(path, upload_id)) > max_age:
+            logger.debug('Removing old upload %s' % upload_id)
+            shutil.rmtree(os.path.join(path, upload_id), ignore_errors=True)
+            _HASHES.pop(upload_id, None)
+
+def new_upload(name, size=None, base_dir=None):
+    """Make a directory for a new upload
+    
+    @param name: str Name of the uploaded file
+    @param size: int (optional) Expected size
+    @param base_dir: str (optional) Defaults to settings.MEDIA_BASE
+    @returns: (upload_id, path of complete file)
+    """
+    prune(base_dir)
+    upload_id = uuid.uuid4().hex
+    path = os.path.join(upload_dir(base_dir), upload_id)
+    os.makedirs(path)
+    name = get_valid_filename(os.path.basename(name.replace('\\', '/'))) or 'upload'
+    with open(os.path.join(path, UPLOAD_INFO), 'w') as f:
+        f.write(json.dumps({'name': name, 'size': size}))
+    return upload_id, os.path.join(path, name)
+
+def status(upload_id, base_dir=None):
+    """
+    @param upload_id: str
+    @param base_dir: str (optional) Defaults to settings.MEDIA_BASE
+    @returns: dict {'id', 'name', 'path', 'size', 'offset', 'complete'}
+    """
+    path = _upload_dir(upload_id, base_dir)
+    with open(os.path.join(path, UPLOAD_INFO), 'r') as f:
+        data = json.loads(f.read())
+    data['id'] = upload_id
+    data['path'] = os.path.join(path, data['name'])
+    data['complete'] = os.path.exists(data['path'])
+    if data['complete']:
+        data['offset'] = os.path.getsize(data['path'])
+    elif os.path.exists(data['path'] + PART_SUFFIX):
+        data['offset'] = os.path.getsize(data['path'] + PART_SUFFIX)
+    else:
+        data['offset'] = 0
+    return data
+
+def _complete(path, hashes):
+    os.rename(path + PART_SUFFIX, path)
+    if hashes:
+        data = hashes.hexdigests()
+    else:
+        data = checksums.file_checksums(path)
+    checksums.save_checksums(path, data)
+    return data
+
+def append(upload_id, offset, chunks, total=None, base_dir=None):
+    """Write chunks to an upload starting at offset
+    
+    The upload is complete when it reaches total bytes (or the size given
+    to new_upload).  Requests for the same upload take turns, holding a
+    lock on its upload.json (the part file is renamed when complete),
+    and the offset is checked under the lock so two requests for the
+    same offset cannot both append.
+    
+    @param upload_id: str
+    @param offset: int Must be the size of what has been received so far
+    @param chunks: iterable of bytes
+    @param total: int (optional) Size of the complete file
+    @param base_dir: str (optional) Defaults to settings.MEDIA_BASE
+    @returns: dict status
+    """
+    path = _upload_dir(upload_id, base_dir)
+    with open(os.path.join(path, UPLOAD_INFO), 'r') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        data = status(upload_id, base_dir)
+        if data['complete']:
+            raise Exception('Upload %s is already complete' % upload_id)
+        if offset != data['offset']:
+            raise Exception('Upload %s is at %s, not %s' % (upload_id, data['offset'], offset))
+        if total is None:
+            total = data['size']
+        hashes = _HASHES.pop(upload_id, None)
+        if (offset == 0) and not hashes:
+            hashes = checksums.MultiHash()
+        if hashes and (hashes.size != offset):
+            hashes = None
+        with open(data['path'] + PART_SUFFIX, 'ab') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                if hashes:
+                    hashes.update(chunk)
+                data['offset'] += len(chunk)
+        if (total is not None) and (data['offset'] > total):
+            raise Exception('Upload %s is larger than %s' % (upload_id, total))
+        if (total is not None) and (data['offset'] == total):
+            _complete(data['path'], hashes)
+            data['complete'] = True
+        elif hashes:
+            _HASHES[upload_id] = hashes
+    return data
+
+def save(f, base_dir=None):
+    """Put an uploaded file (Django UploadedFile) in the Store
+    
+    Files received by StoreUploadHandler are already there.
+    
+    @param f: django.core.files.uploadedfile.UploadedFile
+    @param base_dir: str (optional) Defaults to settings.MEDIA_BASE
+    @returns: (upload_id, path)
+    """
+    if isinstance(f, StoreUploadedFile):
+        return f.upload_id, f.temporary_file_path()
+    upload_id,path = new_upload(f.name, f.size, base_dir)
+    append(upload_id, 0, f.chunks(UPLOAD_CHUNK_SIZE), f.size, base_dir)
+    return upload_id, path
+
+def discard(path, base_dir=None):
+    """Remove the upload a file belongs to; other paths are left alone
+    """
+    upload_path = os.path.dirname(os.path.realpath(path))
+    if os.path.dirname(upload_path) == os.path.realpath(upload_dir(base_dir)):
+        shutil.rmtree(upload_path, ignore_errors=True)
+        _HASHES.pop(os.path.basename(upload_path), None)
+
+
+class StoreUploadedFile(UploadedFile):
+    """A file uploaded to STORE/tmp/uploads/ by StoreUploadHandler
+    
+    @param path: str
+    @param upload_id: str
+    @param checksums: dict {'size': int, algorithm: hexdigest, ...}
+    """
+    
+    def __init__(self, path, upload_id, name, content_type, size, charset, content_type_extra=None, checksums=None):
+        super().__init__(open(path, 'rb'), name, content_type, size, charset, content_type_extra)
+        self.path = path
+        self.upload_id = upload_id
+        self.checksums = checksums
+    
+    def temporary_file_path(self):
+        return self.path
+    
+    def close(self):
+        try:
+            return self.file.close()
+        except FileNotFoundError:
+            # file was moved or discarded
+            pass
+
+
+class StoreUploadHandler(FileUploadHandler):
+    """Writes uploads to STORE/tmp/uploads/ in large chunks, hashing as it goes
+    
+    Add it in the view, before request.POST or request.FILES is read:
+    >>> request.upload_handlers.insert(0, StoreUploadHandler(request))
+    If the Store is not available the upload is left to the next handler
+    in settings.FILE_UPLOAD_HANDLERS.
+    """
+    chunk_size = UPLOAD_CHUNK_SIZE
+    
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.upload_id = None
+        if not os.path.exists(settings.MEDIA_BASE):
+            # no Store mounted
+            return
+        try:
+            self.upload_id,self.path = new_upload(self.file_name, self.content_length)
+        except OSError as err:
+            logger.error('Could not upload to Store: %s' % err)
+            return
+        self.file = open(self.path + PART_SUFFIX, 'wb')
+        self.hashes = checksums.MultiHash()
+        raise StopFutureHandlers()
+    
+    def receive_data_chunk(self, raw_data, start):
+        if not self.upload_id:
+            return raw_data
+        self.file.write(raw_data)
+        self.hashes.update(raw_data)
+        return None
+    
+    def file_complete(self, file_size):
+        if not self.upload_id:
+            return None
+        self.file.close()
+        data = _complete(self.path, self.hashes)
+        return StoreUploadedFile(
+            self.path, self.upload_id, self.file_name, self.content_type,
+            file_size, self.charset, self.content_type_extra, data
+        )
+    
+    def upload_interrupted(self):
+        if self.upload_id:
+            self.file.close()
+            shutil.rmtree(os.path.dirname(self.path), ignore_errors=True)
@@ -5,8 +5,9 @@ from rest_framework.schemas import get_schema_view
 
 from webui import api
 from webui.views import LoginOffline, login, logout
-from webui.views import task_status, task_dismiss, task_list
+from webui.views import task_status, task_events, task_dismiss, task_list
 from webui.views import gitstatus_queue, gitstatus_toggle
+from webui.views import upload_new, upload_chunk
 from webui.views import repository, organization, collections, entities, files
 from webui.views import detail, merge, search
 
@@ -19,9 +20,13 @@ urlpatterns = [
     # admin
 
     path('task-status/', task_status, name='webui-task-status'),
+    path('task-events/', task_events, name='webui-task-events'),
     path('tasks/<slug:task_id>/dismiss/', task_dismiss, name='webui-tasks-dismiss'),
     path('tasks/', task_list, name='webui-tasks'),
     
+    path('upload/', upload_new, name='webui-upload-new'),
+    path('upload/<slug:upload_id>/', upload_chunk, name='webui-upload'),
+    
     path('gitstatus-queue/', gitstatus_queue, name='webui-gitstatus-queue'),
     path('gitstatus-toggle/', gitstatus_toggle, name='webui-gitstatus-toggle'),
     
@@ -43,10 +48,14 @@ urlpatterns = [
     
     path('api/1.0/ui-state/', api.ui_state, name='api-state'),
     
+    path('api/1.0/search/facets', api.search_facets, name='api-search-facets'),
+    path('api/1.0/search/export', api.search_export, name='api-search-export'),
     path('api/1.0/search', api.Search.as_view(), name='api-search'),
     
+    path('api/1.0/es/<slug:oid>/children/export', api.es_children_export, name='api-es-children-export'),
     path('api/1.0/es/<slug:oid>/children/', api.es_children, name='api-es-children'),
     path('api/1.0/es/<slug:oid>/', api.es_detail, name='api-es-detail'),
+    path('api/1.0/fs/bulk/', api.fs_bulk, name='api-fs-bulk'),
     path('api/1.0/<slug:oid>/children/', api.fs_children, name='api-fs-children'),
     path('api/1.0/<slug:oid>/', api.fs_detail, name='api-fs-detail'),
     
@@ -83,6 +92,7 @@ urlpatterns = [
     path('collection/<slug:cid>/reindex/', collections.reindex, name='webui-collection-reindex'),
     path('collection/<slug:cid>/check/', collections.check, name='webui-collection-check'),
     path('collection/<slug:cid>/signatures/', collections.signatures, name='webui-collection-signatures'),
+    path('collection/<slug:cid>/access/', collections.access_backfill, name='webui-collection-access-backfill'),
     path('collection/<slug:cid>/unlock/<slug:task_id>/', collections.unlock, name='webui-collection-unlock'),
 
     path('collection/<slug:cid>/export/objects/', collections.csv_export, kwargs={'model':'entity'}, name='webui-collection-export-entities'),
@@ -2,3 +2,95 @@
 # an import loop.  Yes I know this is stupid but I named the collections
 # module before I knew anything about collections.OrderedDict.
 from collections import OrderedDict
+from collections import deque
+import json
+import logging
+logger = logging.getLogger(__name__)
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+import os
+
+
+def load_json(json_path):
+    """Read object JSON and flatten into a single dict
+    
+    DDR object JSONs are lists of dicts; the first one contains
+    metadata (git_version, etc) and is skipped.
+    
+    @param json_path: str Absolute path to object JSON file
+    @returns: dict
+    """
+    with open(json_path, 'r') as f:
+        data = json.loads(f.read())
+    if isinstance(data, dict):
+        return data
+    document = {}
+    for line in data:
+        if 'git_version' in line:
+            continue
+        document.update(line)
+    return document
+
+def chunked(items, size):
+    """Yield lists of size items (the last may be shorter), lazily
+    
+    >>> list(chunked(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def pool_map(func, items, workers=None, ordered=True, ahead=None, threads=False):
+    """Yield func(item) for each item, from a pool of workers
+    
+    Runs serially if workers is 1, if there is only one item, or if a
+    process pool cannot start (daemonic processes such as prefork Celery
+    workers cannot have children).  Use threads for I/O-bound work or
+    when running in such a worker.  The pool is stopped when the
+    generator is exhausted or closed.
+    
+    >>> for result in pool_map(func, paths, workers=4):
+    ...     pass
+    
+    @param func: callable Must be picklable (module-level) for processes
+    @param items: iterable
+    @param workers: int Pool size (default os.cpu_count()); 1 disables pool
+    @param ordered: bool Results in order of items; else as they finish
+    @param ahead: int (optional) Most items in flight (ordered only), so
+                  items are consumed lazily and memory stays bounded
+    @param threads: bool Thread pool instead of process pool
+    """
+    workers = workers or os.cpu_count() or 1
+    if hasattr(items, '__len__'):
+        workers = min(workers, len(items))
+    pool = None
+    if workers > 1:
+        try:
+            pool = (ThreadPool if threads else Pool)(workers)
+        except AssertionError:
+            logger.error('Could not start pool, running %s serially' % func.__name__)
+    if not pool:
+        yield from map(func, items)
+        return
+    try:
+        if ordered and ahead:
+            pending = deque()
+            for item in items:
+                pending.append(pool.apply_async(func, (item,)))
+                if len(pending) >= ahead:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        elif ordered:
+            yield from pool.imap(func, items)
+        else:
+            yield from pool.imap_unordered(func, items)
+    finally:
+        pool.terminate()
+        pool.join()
@@ -2,27 +2,33 @@ import json
 import logging
 logger = logging.getLogger(__name__)
 import os
+import re
 
 from django.conf import settings
 from django.contrib import messages
-from django.http import HttpResponse, HttpResponseRedirect
-from django.shortcuts import render
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.http import HttpResponseBadRequest, HttpResponseNotAllowed
+from django.shortcuts import Http404, render
 from django.urls import reverse
 from django.views import View
 
 from DDR import converters
 from DDR import idservice
 
+from storage.decorators import storage_required
 from webui import WEBUI_MESSAGES
 from webui import gitstatus
 from webui.decorators import ddrview
 from webui import forms
 from webui import identifier
 from webui.tasks import common as common_tasks
+from webui import uploads
 from webui.views.decorators import login_required
 
 # helpers --------------------------------------------------------------
 
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
 
 # views ----------------------------------------------------------------
 
@@ -242,6 +248,20 @@ def task_status( request ):
         'dismiss_next': request.GET.get('this', reverse('webui-index'))
     })
 
+def task_events( request ):
+    """Server-sent events stream of state changes for tasks in session.
+    
+    Replaces polling task_status; see webui.tasks.common.task_events.
+    """
+    response = StreamingHttpResponse(
+        common_tasks.task_events(common_tasks.session_tasks(request)),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # don't let nginx buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @login_required
 def task_dismiss( request, task_id ):
     common_tasks.dismiss_session_task(
@@ -251,6 +271,65 @@ def task_dismiss( request, task_id ):
     data = {'status':'ok'}
     return HttpResponse(json.dumps(data), content_type="application/json")
 
+@login_required
+@storage_required
+def upload_new(request):
+    """Starts a resumable upload (POST name, size); returns upload status JSON
+    
+    Send the file to the returned url in PUT requests with
+    Content-Range: bytes START-END/SIZE, see upload_chunk.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        size = int(request.POST['size'])
+        upload_id,path = uploads.new_upload(request.POST['name'], size)
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest('name and size required')
+    data = uploads.status(upload_id)
+    data['url'] = reverse('webui-upload', args=[upload_id])
+    return HttpResponse(json.dumps(data), content_type="application/json")
+
+@login_required
+@storage_required
+def upload_chunk(request, upload_id):
+    """GET status of a resumable upload, or PUT the next chunk of it
+    
+    PUT with Content-Range: bytes START-END/SIZE.  If START is not where
+    the upload stopped, responds 409 with the status; resume from offset.
+    A complete upload is added to an entity by the new file view, with
+    ?upload=UPLOAD_ID instead of ?path=.
+    """
+    try:
+        data = uploads.status(upload_id)
+    except Exception:
+        raise Http404
+    if request.method == 'PUT':
+        match = CONTENT_RANGE.match(request.META.get('HTTP_CONTENT_RANGE', ''))
+        if not match:
+            return HttpResponseBadRequest('Content-Range: bytes START-END/SIZE required')
+        start,end,size = [int(n) for n in match.groups()]
+        if data['complete'] or (start != data['offset']):
+            data.pop('path')
+            return HttpResponse(json.dumps(data), content_type="application/json", status=409)
+        try:
+            data = uploads.append(
+                upload_id, start,
+                iter(lambda: request.read(uploads.UPLOAD_CHUNK_SIZE), b''),
+                size
+            )
+        except Exception:
+            # another request for this offset got the lock first
+            data = uploads.status(upload_id)
+            if data['complete'] or (start != data['offset']):
+                data.pop('path')
+                return HttpResponse(json.dumps(data), content_type="application/json", status=409)
+            raise
+    elif request.method != 'GET':
+        return HttpResponseNotAllowed(['GET', 'PUT'])
+    data.pop('path')
+    return HttpResponse(json.dumps(data), content_type="application/json")
+
 @ddrview
 def gitstatus_toggle(request):
     """Toggle the Celery status update that runs every N seconds; remember for session.
@@ -1,9 +1,9 @@
-import csv
 from datetime import datetime
 import json
 import logging
 logger = logging.getLogger(__name__)
 import os
+from pathlib import Path
 import random
 
 from django.conf import settings
@@ -13,6 +13,7 @@ from django.http import HttpResponse, HttpResponseRedirect
 from django.http import StreamingHttpResponse
 from django.shortcuts import Http404, render
 from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 
 from elasticsearch import TransportError
 
@@ -26,13 +27,14 @@ from webui.decorators import ddrview
 from webui.forms import DDRForm
 from webui.forms.collections import NewCollectionForm, UploadFileForm
 from webui.forms.collections import SyncConfirmForm, SignaturesConfirmForm
-from webui.forms.collections import ReindexConfirmForm
+from webui.forms.collections import ReindexConfirmForm, AccessBackfillConfirmForm
 from webui import gitolite
 from webui.gitstatus import repository, annex_info
 from webui.models import Collection
 from webui.identifier import Identifier
 from webui import search
 from webui.tasks import collection as collection_tasks
+from webui import uploads
 from webui.views.decorators import login_required
 
 
@@ -341,6 +343,54 @@ def edit( request, cid ):
         'form': form,
     })
 
+@ddrview
+@login_required
+@storage_required
+def access_backfill( request, cid ):
+    """Make missing access files for the collection, in one commit
+    """
+    try:
+        collection = Collection.from_identifier(Identifier(cid))
+    except:
+        raise Http404
+    git_name = request.session.get('git_name')
+    git_mail = request.session.get('git_mail')
+    if not git_name and git_mail:
+        messages.error(request, WEBUI_MESSAGES['LOGIN_REQUIRED'])
+    alert_if_conflicted(request, collection)
+    if collection.locked():
+        messages.error(request, WEBUI_MESSAGES['VIEWS_COLL_LOCKED'].format(collection.id))
+        return HttpResponseRedirect(collection.absolute_url())
+    if request.method == 'POST':
+        form = AccessBackfillConfirmForm(request.POST)
+        if form.is_valid() and form.cleaned_data['confirmed']:
+            
+            result = collection_tasks.access_backfill.apply_async(
+                (collection.path,git_name,git_mail),
+                countdown=2
+            )
+            lockstatus = collection.lock(result.task_id)
+            # add celery task_id to session
+            celery_tasks = request.session.get(settings.CELERY_TASKS_SESSION_KEY, {})
+            # IMPORTANT: 'action' *must* match a message in webui.tasks.TASK_STATUS_MESSAGES.
+            task = {
+                'task_id': result.task_id,
+                'action': 'collection-access-backfill',
+                'collection_id': collection.id,
+                'collection_url': collection.absolute_url(),
+                'start': converters.datetime_to_text(datetime.now(settings.TZ)),
+            }
+            celery_tasks[result.task_id] = task
+            request.session[settings.CELERY_TASKS_SESSION_KEY] = celery_tasks
+            return HttpResponseRedirect(collection.absolute_url())
+        
+    else:
+        form = AccessBackfillConfirmForm()
+    return render(request, 'webui/collections/access-confirm.html', {
+        'collection': collection,
+        'form': form,
+    })
+
 @ddrview
 @login_required
 @storage_required
@@ -397,6 +447,9 @@ def csv_export(request, cid, model):
         raise Http404
     if not model in list(csvio.CSV_MODELS.keys()):
         raise Http404
+    # nothing changed since last export
+    if csvio.cached_export(collection, model):
+        return HttpResponseRedirect(csvio.csv_url(collection, model))
     collection_tasks.csv_export(request, collection, model)
     return HttpResponseRedirect(collection.absolute_url())
 
@@ -405,8 +458,8 @@ def csv_download(request, cid, model):
     """Offers CSV file in settings.CSV_TMPDIR for download.
     
     File must actually exist in settings.CSV_EXPORT_PATH and be readable.
-    File must be readable by Python csv module.
-    If all that is true then it must be a legal CSV file.
+    The file was written by csvio.export_to_csv so its bytes are passed
+    through as-is.
     """
     try:
         collection = Collection.from_identifier(Identifier(cid))
@@ -417,73 +470,103 @@ def csv_download(request, cid, model):
     path = csvio.csv_path(collection, model)
     if not path.exists():
         raise Http404
-    
-    class Echo:
-        """Object that implements write method of file-like interface."""
-        def write(self, value):
-            """Write value by returning it instead of storing in a buffer"""
-            return value
-    
-    rows = csvio.csv_rows(path)
-    pseudo_buffer = Echo()
-    writer = csv.writer(pseudo_buffer)
-    response = StreamingHttpResponse(
-        (writer.writerow(row) for row in rows),
-        content_type="text/csv"
-    )
+    response = StreamingHttpResponse(csvio.csv_bytes(path), content_type="text/csv")
     response['Content-Disposition'] = 'attachment; filename="%s"' % path.name
     return response
 
+@csrf_exempt
 @login_required
 @storage_required
 def csv_import(request, cid, model):
-    """Accepts a CSV file for batch import
+    """Accepts a CSV file for batch import; imported in a background task
+    
+    The upload is written straight to STORE/tmp/uploads/ (webui.uploads).
+    Handlers must be set before the request body is read, so CSRF is
+    checked by _csv_import instead of the middleware.
+    
+    With dryrun, works out what the import would do in a background task
+    (csvio.plan_import); ?upload=UPLOAD_ID then shows the plan and offers
+    to import the same file.
     
     TODO fix broken files import
     """
+    request.upload_handlers.insert(0, uploads.StoreUploadHandler(request))
+    return _csv_import(request, cid, model)
+
+@csrf_protect
+def _csv_import(request, cid, model):
     try:
         collection = Collection.from_identifier(Identifier(cid))
     except:
         raise Http404
     if not model in list(csvio.CSV_MODELS.keys()):
         raise Http404
+    plan = None
     if request.method == 'POST':
         form = UploadFileForm(request.POST, request.FILES)
-        if form.is_valid():
-            # write uploaded file to tmp/
-            handle_uploaded_file(cid, model, request.FILES['file'])
-            csv_path = csvio.csv_import_path(cid, model)
+        if request.POST.get('planned'):
+            # import the file that was uploaded for a dry run
+            try:
+                csv_path = Path(uploads.status(request.POST.get('upload'))['path'])
+            except Exception:
+                csv_path = None
+            if not (csv_path and csv_path.exists()):
+                messages.error(request, 'CSV file upload failed!')
+                return HttpResponseRedirect(collection.absolute_url())
+            if collection.locked():
+                messages.error(request, WEBUI_MESSAGES['VIEWS_COLL_LOCKED'].format(collection.id))
+                return HttpResponseRedirect(collection.absolute_url())
+            collection_tasks.csv_import(
+                request, collection, model, csv_path, request.POST['planned']
+            )
+            return HttpResponseRedirect(collection.absolute_url())
+        elif form.is_valid():
+            # uploaded file is in STORE/tmp/uploads/
+            upload_id,csv_path = handle_uploaded_file(request.FILES['file'])
             if csv_path.exists():
                 messages.success(request, 'CSV file upload success!.')
             else:
                 messages.error(request, 'CSV file upload failed!')
                 return HttpResponseRedirect(collection.absolute_url())
-            # process the contents
-            result,imported = csvio.import_from_csv(
-                csv_path, collection, model,
-                request.session['git_name'],
-                request.session['git_mail'],
-            )
-            msg = 'Successfully imported {} objects from {}.'.format(
-                str(len(imported)),
-                request.FILES['file'].name,
-            )
-            messages.success(request, msg)
-            return HttpResponseRedirect(collection.absolute_url())
+            if form.cleaned_data['dryrun']:
+                # plan in the background; task message links back here
+                collection_tasks.csv_plan(request, collection, model, csv_path, upload_id)
+                return HttpResponseRedirect(collection.absolute_url())
+            else:
+                if collection.locked():
+                    messages.error(request, WEBUI_MESSAGES['VIEWS_COLL_LOCKED'].format(collection.id))
+                    return HttpResponseRedirect(collection.absolute_url())
+                # process the contents in the background
+                collection_tasks.csv_import(
+                    request, collection, model, csv_path, request.FILES['file'].name
+                )
+                return HttpResponseRedirect(collection.absolute_url())
     else:
         form = UploadFileForm()
+        if request.GET.get('upload'):
+            # dry run (see collection_tasks.csv_plan)
+            try:
+                upload = uploads.status(request.GET['upload'])
+            except Exception:
+                raise Http404
+            plan = csvio.read_plan(upload['path'], model)
+            if plan:
+                plan['upload_id'] = upload['id']
+            else:
+                messages.info(request, 'Dry run of %s is not finished.' % upload['name'])
     return render(request, 'webui/collections/csv-import.html', {
         'collection': collection,
         'form': form,
+        'plan': plan,
     })
 
-def handle_uploaded_file(cid, model, f):
-    """Write uploaded file to /tmp/
+def handle_uploaded_file(f):
+    """Put uploaded file in its own dir in STORE/tmp/uploads/
+    
+    @returns: (upload_id, Path)
     """
-    path = csvio.csv_import_path(cid, model)
-    with path.open('wb+') as destination:
-        for chunk in f.chunks():
-            destination.write(chunk)
+    upload_id,path = uploads.save(f)
+    return upload_id, Path(path)
 
 @ddrview
 @login_required
@@ -505,9 +588,12 @@ def unlock( request, cid, task_id ):
 @login_required
 @storage_required
 def check(request, cid):
+    """Check collection files; ?full=1 rechecks files that passed before
+    """
     ci = Identifier(cid)
     result = collection_tasks.check.apply_async(
         [ci.path_abs()],
+        {'incremental': not request.GET.get('full')},
         countdown=2
     )
     # add celery task_id to session
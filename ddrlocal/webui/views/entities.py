@@ -265,7 +265,7 @@ def file_role( request, rid ):
         'children_urls': entity.children_urls(active=role),
         'browse_url': entity.file_browse_url(role),
         'external_url': entity.file_external_url(role),
-        'batch_url': entity.file_browse_url(role),
+        'batch_url': entity.file_batch_url(role),
         'paginator': paginator,
         'page': page,
         'thispage': thispage,
@@ -13,30 +13,19 @@ from webui import WEBUI_MESSAGES
 from webui.decorators import ddrview
 from webui.forms import DDRForm
 from webui.forms.files import NewFileDDRForm, NewExternalFileForm, NewAccessFileForm
-from webui.forms.files import DeleteFileForm
+from webui.forms.files import BatchFileForm, DeleteFileForm
 from webui.forms.files import shared_folder_files
 from webui.gitstatus import repository, annex_whereis_file
-from webui.models import Stub, Entity, File
+from webui.models import Stub, File
 from webui.models import MODULES
 from webui.identifier import Identifier
 from webui.tasks import files as file_tasks
+from webui import uploads
 from webui.views.decorators import login_required
 
 
 # helpers --------------------------------------------------------------
 
-def handle_uploaded_file(f, dest_dir):
-    if not os.path.exists(dest_dir):
-        os.makedirs(dest_dir)
-    print('dest_dir {}'.format(dest_dir))
-    dest_path_abs = os.path.join(dest_dir, f.name)
-    print('dest_path_abs {}'.format(dest_path_abs))
-    with open(dest_path_abs, 'wb+') as destination:
-        for chunk in f.chunks():
-            destination.write(chunk)
-    print('destination {}'.format(destination))
-    return dest_path_abs
-
 def prep_newfile_form_fields(FIELDS):
     """
     - path field is needed even though it's not in the model
@@ -183,6 +172,19 @@ def new( request, rid ):
     module = MODULES[FILE_MODEL]
     #
     path = request.GET.get('path', None)
+    upload_id = request.GET.get('upload', None)
+    if upload_id:
+        # complete resumable upload (see webui.views.upload_chunk);
+        # it is on the Store and already hashed, so ingest does not copy
+        # or read it again
+        try:
+            upload = uploads.status(upload_id)
+        except Exception:
+            raise Http404
+        if not upload['complete']:
+            messages.error(request, 'Upload %s is not complete' % upload_id)
+            return HttpResponseRedirect(entity.absolute_url())
+        path = upload['path']
     FIELDS = prep_newfile_form_fields(module.FIELDS_NEW)
     if request.method == 'POST':
         form = NewFileDDRForm(
@@ -303,15 +305,65 @@ def new_access( request, fid ):
 @login_required
 @storage_required
 def batch( request, rid ):
-    """Add multiple files to entity.
+    """Add multiple files from a shared folder dir to entity.
+    
+    All selected files are added in one task, with one commit.
     """
+    enforce_git_credentials(request)
     file_role = Stub.from_identifier(Identifier(rid))
-    entity = Entity.from_request(request)
+    role = file_role.identifier.parts['role']
+    entity = file_role.parent(stubs=True)
     collection = entity.collection()
-    check_parents(entity, collection)
-    return render(request, 'webui/files/new.html', {
+    check_parents(entity, collection, check_locks=0, fetch=0)
+    if entity.locked():
+        messages.error(request, WEBUI_MESSAGES['VIEWS_ENT_LOCKED'])
+        return HttpResponseRedirect(entity.absolute_url())
+    if collection.locked():
+        messages.error(request, WEBUI_MESSAGES['VIEWS_COLL_LOCKED'].format(collection.id))
+        return HttpResponseRedirect(entity.absolute_url())
+    path = request.GET.get('path', '')
+    # resolve symlinks and '..'; a sibling like /media/sf_ddrshared2 is outside too
+    shared = os.path.realpath(settings.VIRTUALBOX_SHARED_FOLDER)
+    path_abs = os.path.realpath(os.path.join(shared, path))
+    if not (os.path.commonpath([path_abs, shared]) == shared and os.path.isdir(path_abs)):
+        raise Http404
+    path_choices = sorted(shared_folder_files(path), key=lambda x: x[1])
+    if request.method == 'POST':
+        form = BatchFileForm(request.POST, path_choices=path_choices)
+        if form.is_valid():
+            data = {
+                'id': entity.id,
+                'external': False,
+                'role': role,
+                'public': int(form.cleaned_data['public']),
+                'sort': form.cleaned_data['sort'],
+            }
+            # keep listing order, not order of submission
+            selected = set(form.cleaned_data['paths'])
+            src_paths = [p for p,name in path_choices if p in selected]
+            file_tasks.add_batch(
+                request, data, entity, role, src_paths,
+                request.session['git_name'], request.session['git_mail'],
+            )
+            return HttpResponseRedirect(entity.absolute_url())
+    else:
+        form = BatchFileForm(
+            initial={'public': True, 'sort': 1},
+            path_choices=path_choices
+        )
+    dirs = sorted([
+        os.path.join(path, x) for x in os.listdir(path_abs)
+        if os.path.isdir(os.path.join(path_abs, x))
+    ])
+    return render(request, 'webui/files/batch.html', {
         'collection': collection,
         'entity': entity,
+        'file_role': file_role,
+        'form': form,
+        'path': path,
+        'parent': os.path.dirname(path) if path else None,
+        'dirs': dirs,
+        'shared_folder': settings.VIRTUALBOX_SHARED_FOLDER,
     })
 
 @ddrview
@@ -102,17 +102,16 @@ def search_ui(request, obj=None):
     }
     
     # nice UI if Elasticsearch is down
-    try:
-        search.DOCSTORE.status()
-    except TransportError:
-        messages.error(
-            request, "<b>TransportError</b>: Cannot connect to search engine."
-        )
-        form = forms.SearchForm(
-            data=request.GET.copy(),
-        )
-        context['search_form'] = forms.SearchForm()
-        return render(request, 'webui/search/results.html', context)
+    # Searcher falls back to the local fulltext index (see webui.fulltext)
+    if settings.DOCSTORE_ENABLED:
+        try:
+            search.DOCSTORE.status()
+        except TransportError:
+            messages.warning(
+                request,
+                "<b>TransportError</b>: Cannot connect to search engine. "
+                "Showing results from local fulltext index."
+            )
     
     if obj:
         if hasattr(obj, 'identifier') and obj.identifier.model == 'collection':
@@ -128,6 +127,7 @@ def search_ui(request, obj=None):
             context['template_extends'] = "ui/narrators/base.html"
     
     searcher = search.Searcher()
+    search_models = search.SEARCH_MODELS
     if request.GET.get('fulltext'):
         # Redirect if fulltext is a DDR ID
         if is_ddr_id(request.GET.get('fulltext')):
@@ -164,12 +164,17 @@ def search_ui(request, obj=None):
             fields=search.SEARCH_INCLUDE_FIELDS,
             fields_nested=search.SEARCH_NESTED_FIELDS,
             fields_agg=search.SEARCH_AGG_FIELDS,
+            aggs=search.AGGS_NONE,
         )
         context['searching'] = True
     
     if searcher.params.get('fulltext'):
         limit,offset = limit_offset(request)
         results = searcher.execute(limit, offset)
+        # facet counts are the same for every page of a search
+        results.aggregations = search.cached_aggregations(
+            searcher.params, search_models
+        )
         paginator = Paginator(
             results.ordered_dict(
                 request=request,
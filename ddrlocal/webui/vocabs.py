@@ -0,0 +1,291 @@
+"""
+vocabs
+
+Compiled controlled-vocabulary index for validating and normalizing CSV imports.
+
+Checking each cell against a list of choices, and rebuilding the list for
+every row, is slow for big imports.  VocabIndex is built once per import
+from the model's FIELDS and the vocabularies at VOCABS_URL:
+- valid values of each field in a frozenset
+- variant spellings mapped to the official value in a dict
+so each cell is one lookup.  Columns are checked a column at a time and
+each distinct value is only looked up once, which matters because most
+columns (status, genre, language...) have only a few distinct values.
+
+>>> from webui import vocabs
+>>> index = vocabs.VocabIndex.from_model('entity')
+>>> index.cell('status', 'Completed')
+('completed', [])
+>>> index.cell('language', 'eng:English; Japanese')
+('eng; jpn', [])
+>>> index.cell('language', 'eng; xyz')
+('eng; xyz', ['xyz'])
+>>> errors = index.normalize(headers, rowds)
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import re
+
+from django.conf import settings
+
+from DDR import vocab
+
+from webui.identifier import MODULES
+
+# Alternative forms of controlled-vocabulary terms, by field.
+# Choice values and labels ('completed', 'Completed') are added from FIELDS.
+CHOICES_ALT = {
+    'status': {
+        'inprocess': ['In Process', 'In Progress', 'inprogress',],
+        'completed': ['Completed', 'complete', 'Complete',],
+    },
+    'public': {
+        '1': ['public', 'Public',],
+        '0': ['private', 'Private',],
+    },
+    'language': {
+        'eng': ['english', 'English', 'eng:English',],
+        'jpn': ['japanese', 'Japanese', 'jpn:Japanese',],
+        'chi': ['chinese', 'Chinese', 'chi:Chinese',],
+        'fre': ['french', 'French', 'fre:French',],
+        'ger': ['german', 'German', 'ger:German',],
+        'ita': ['italian', 'Italian', 'ita:Italian',],
+        'kor': ['korean', 'Korean', 'kor:Korean',],
+        'por': ['portuguese', 'Portuguese', 'por:Portuguese',],
+        'rus': ['russian', 'Russian', 'rus:Russian',],
+        'spa': ['spanish', 'Spanish', 'spa:Spanish',],
+        'tgl': ['tagalog', 'Tagalog', 'tgl:Tagalog',],
+    },
+    'genre': {
+        'advertisement': ['Advertisements', 'Advertisement',],
+        'album': ['Albums', 'Album',],
+        'architecture': ['Architecture',],
+        'baseball_card': ['Baseball Cards', 'Baseball Card',],
+        'blank_form': ['Blank Forms', 'Blank Form',],
+        'book': ['Books', 'Book',],
+        'broadside': ['Broadsides', 'Broadside',],
+        'cartoon': ['Cartoons (Commentary)', 'Cartoon (Commentary)',],
+        'catalog': ['Catalogs', 'Catalog',],
+        'cityscape': ['Cityscapes', 'Cityscape',],
+        'clipping': ['Clippings', 'Clipping',],
+        'correspondence': ['Correspondence',],
+        'diary': ['Diaries', 'Diary',],
+        'drawing': ['Drawings', 'Drawing',],
+        'ephemera': ['Ephemera',],
+        'essay': ['Essays', 'Essay',],
+        'ethnography': ['Ethnographies', 'Ethnography',],
+        'fieldnotes': ['Fieldnotes', 'Fieldnote',],
+        'illustration': ['Illustrations', 'Illustration',],
+        'interview': ['Interviews', 'Interview',],
+        'landscape': ['Landscapes', 'Landscape',],
+        'leaflet': ['Leaflets', 'Leaflet',],
+        'manuscript': ['Manuscripts', 'Manuscript',],
+        'map': ['Maps', 'Map',],
+        'misc_document': ['Miscellaneous Documents', 'Miscellaneous Document',],
+        'motion_picture': ['Motion Pictures', 'Motion Picture',],
+        'music': ['Music',],
+        'narrative': ['Narratives', 'Narrative',],
+        'painting': ['Paintings', 'Painting',],
+        'pamphlet': ['Pamphlets', 'Pamphlet',],
+        'periodical': ['Periodicals', 'Periodical',],
+        'petition': ['Petitions', 'Petition',],
+        'photograph': ['Photographs', 'Photograph',],
+        'physical_object': ['Physical Objects', 'Physical Object',],
+        'poetry': ['Poetry',],
+        'portrait': ['Portraits', 'Portrait',],
+        'postcard': ['Postcards', 'Postcard',],
+        'poster': ['Posters', 'Poster',],
+        'print': ['Prints', 'Print',],
+        'program': ['Programs', 'Program',],
+        'rec_log': ['Recording Logs', 'Recording Log',],
+        'score': ['Scores', 'Score',],
+        'sheet_music': ['Sheet Music',],
+        'timetable': ['Timetables', 'Timetable',],
+        'transcription': ['Transcriptions', 'Transcription',],
+    },
+    'format': {
+        'av': ['Audio/Visual',],
+        'ds': ['Datasets', 'Dataset',],
+        'doc': ['Documents', 'Document',],
+        'img': ['Still Images', 'Still Image',],
+        'vh': ['Oral Histories', 'Oral History',],
+    },
+}
+
+# Vocabulary fields (topics, facility) are lists of terms, each of which
+# may be 'Title [123]', 'term:Title|id:123', or '123'.
+VOCAB_TERM_ID = re.compile(r'\[\s*(\d+)\s*\]\s*$|id:\s*(\d+)\s*$|^\s*(\d+)\s*$')
+
+
+def variant_index(choices_alt):
+    """Make variant->official index from a CHOICES_ALT dict
+    
+    >>> variant_index({'completed': ['Completed', 'complete']})
+    {'Completed': 'completed', 'complete': 'completed'}
+    """
+    index = {}
+    for key,value in choices_alt.items():
+        for v in value:
+            index[v] = key
+    return index
+
+def term_id(text):
+    """ID of a vocabulary term in any of its CSV forms, or None
+    
+    >>> term_id('Manzanar [31]')
+    '31'
+    >>> term_id('term:Manzanar|id:31')
+    '31'
+    """
+    match = VOCAB_TERM_ID.search(text)
+    if match:
+        return [group for group in match.groups() if group][0]
+    return None
+
+
+class VocabIndex(object):
+    """Valid values and variant->official maps for the fields of a model
+    
+    Build once per import; plain data so it can be sent to pool workers.
+    
+    @param fields: list of FIELDS dicts from the model module
+    @param vocabs: dict {fieldname: {'terms': [...]}} from DDR.vocab.get_vocabs
+    @param choices_alt: dict {fieldname: {value: [variants]}}
+    """
+    
+    def __init__(self, fields, vocabs={}, choices_alt=CHOICES_ALT):
+        self.values = {}
+        self.variants = {}
+        self.multiple = set()
+        self.terms = {}
+        for field in fields:
+            name = field['name']
+            form = field.get('form') or {}
+            if form.get('choices'):
+                values = [str(value) for value,label in form['choices']]
+                variants = {}
+                for value,label in form['choices']:
+                    variants[str(label)] = str(value)
+                    variants['%s:%s' % (value, label)] = str(value)
+                variants.update(variant_index(choices_alt.get(name, {})))
+                for variant,value in list(variants.items()):
+                    variants.setdefault(variant.lower(), value)
+                self.values[name] = frozenset(values)
+                self.variants[name] = {
+                    variant: value for variant,value in variants.items()
+                    if value in self.values[name]
+                }
+                if field.get('form_type') == 'MultipleChoiceField':
+                    self.multiple.add(name)
+            elif name in vocabs:
+                self.terms[name] = frozenset(
+                    str(term['id']) for term in vocabs[name].get('terms', [])
+                )
+    
+    @staticmethod
+    def from_model(model, vocabs_url=None):
+        """Index for a model; vocabularies are fetched once from vocabs_url
+        
+        If the vocabularies cannot be fetched, vocabulary fields are not
+        checked (DDR's load_csv still checks them).
+        
+        @param model: str 'entity' or 'file'
+        @param vocabs_url: str (optional) Defaults to settings.VOCABS_URL
+        @returns: VocabIndex
+        """
+        try:
+            vocabs = vocab.get_vocabs(vocabs_url or settings.VOCABS_URL)
+        except Exception as err:
+            logger.error('Could not load vocabularies: %s' % err)
+            vocabs = {}
+        return VocabIndex(MODULES[model].FIELDS, vocabs)
+    
+    def fields(self):
+        """Names of fields with controlled values
+        """
+        return sorted(list(self.values.keys()) + list(self.terms.keys()))
+    
+    def value(self, name, text):
+        """Official value for text, or None
+        
+        @param name: str Field name
+        @param text: str One value (not a list)
+        @returns: str or None
+        """
+        if name in self.terms:
+            tid = term_id(text)
+            if tid in self.terms[name]:
+                return text
+            return None
+        if text in self.values[name]:
+            return text
+        return self.variants[name].get(text, self.variants[name].get(text.lower()))
+    
+    def cell(self, name, text):
+        """Normalize one cell
+        
+        Choice values are replaced with the official value.  Multiple
+        values are separated by semicolons.  Vocabulary terms are only
+        checked; DDR reads them in any of their forms.
+        
+        @param name: str Field name
+        @param text: str
+        @returns: (str normalized text, list of invalid values)
+        """
+        text = text.strip()
+        if not text:
+            return text, []
+        if (name in self.multiple) or (name in self.terms):
+            items = [item.strip() for item in text.split(';') if item.strip()]
+        else:
+            items = [text]
+        values = []
+        invalid = []
+        for item in items:
+            value = self.value(name, item)
+            if value is None:
+                invalid.append(item)
+            else:
+                values.append(value)
+        if invalid:
+            return text, invalid
+        return '; '.join(values), invalid
+    
+    def column(self, name, texts):
+        """Normalize a whole column; each distinct value is checked once
+        
+        @param name: str Field name
+        @param texts: list of str
+        @returns: (list of normalized str, dict {position: list of invalid values})
+        """
+        seen = {}
+        for text in set(texts):
+            seen[text] = self.cell(name, text)
+        normalized = [seen[text][0] for text in texts]
+        invalid = {
+            n: seen[text][1]
+            for n,text in enumerate(texts) if seen[text][1]
+        }
+        return normalized, invalid
+    
+    def normalize(self, headers, rowds):
+        """Normalize controlled-vocabulary columns of rows, in place
+        
+        @param headers: list of field names
+        @param rowds: list of dicts
+        @returns: list of (position in rowds, field name, invalid value)
+        """
+        errors = []
+        for name in headers:
+            if not ((name in self.values) or (name in self.terms)):
+                continue
+            normalized,invalid = self.column(
+                name, [rowd.get(name, '') for rowd in rowds]
+            )
+            for rowd,text in zip(rowds, normalized):
+                if name in rowd:
+                    rowd[name] = text
+            for n,values in invalid.items():
+                errors += [(n, name, value) for value in values]
+        return sorted(errors)